@@ -1,3 +1,3 @@
 #!/bin/bash
-epydoc --html -o doc multicube.py pymulticube/camera.py pymulticube/createimage.py pymulticube/cubemaker.py
+epydoc --html -o doc multicube.py pymulticube/camera.py pymulticube/createimage.py pymulticube/cubemaker.py pymulticube/tracer.py pymulticube/cubefield.py pymulticube/renderqueue.py pymulticube/overdraw.py pymulticube/occlusion.py pymulticube/streambuffer.py pymulticube/textureloader.py pymulticube/atlas.py pymulticube/mipmaps.py pymulticube/texturemanager.py pymulticube/imagecache.py pymulticube/compositor.py pymulticube/imagepack.py pymulticube/cubeshader.py pymulticube/scene.py pymulticube/snapshot.py pymulticube/audioworker.py pymulticube/inputstate.py pymulticube/bvh.py pymulticube/spatialgrid.py pymulticube/collision.py pymulticube/physics.py pymulticube/chunkworld.py pymulticube/framecapture.py pymulticube/tiledrender.py pymulticube/resolution.py
  
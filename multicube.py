@@ -8,21 +8,33 @@
 * May 2020 San Diego, California USA
 * ********************************************************
 """
+from time import perf_counter
+STARTED = perf_counter()
+# When the program started, for the startup profile.
 import OpenGL
 from OpenGL.GL import *
 from OpenGL.GLUT import *
-from sfml import sf
-from sfml.window import VideoMode
 from numpy import array, zeros
 from pymulticube.camera import Camera
 from pymulticube.cubemaker import CubeMaker
 from pymulticube.createimage import CreateImage
+from pymulticube.cubefield import CubeField
+from pymulticube.renderqueue import RenderQueue
+from pymulticube.textureloader import TextureLoader
+from pymulticube.texturemanager import TextureManager
+from pymulticube.inputstate import InputState
+from pymulticube.tracer import tracer, ChromeTraceWriter, ConsoleSubscriber, StartupProfile
+from pymulticube.imagecache import imageCache
 from glm import *
 import sys
+import atexit
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from math import fmod
-from multiprocessing import Process
 from random import randint
 from random import random
+# The sound library and the optional subsystems are imported where
+# they are first used, so only what a run needs is loaded.
 
 class PosOrient:
     """
@@ -81,10 +93,22 @@ class MultiCube:
     # The skybox texture buffer id.
     debug1 = False
     # The debug flag.
-    firstMouse = True
-    # The flag to signal the first time reading the mouse position.
-    sndthrd = None
-    # The sound thread.
+    input = None
+    # The keyboard and mouse input gathered between frames.
+    bvh = None
+    # The bounding volume hierarchy over the cubes, made at the first pick.
+    collider = None
+    # Keeps the camera out of the cubes, if enabled.
+    audio = None
+    # The background music worker.
+    physics = None
+    # Moves the cubes about on a worker thread, if enabled.
+    world = None
+    # Makes the cubes of an endless field around the camera, if enabled.
+    capture = None
+    # Records the frames drawn, if enabled.
+    governor = None
+    # Lowers the resolution drawn to hold the frame time budget, if enabled.
     fullScreen = True
     # A full screen flag.
     modes = None
@@ -97,16 +121,38 @@ class MultiCube:
     # The start time of one eventLoop iteration.
     timeend = 0
     # The end time of one eventLoop iteration.
-    mousePos1 = vec2()
-    # The recorded mouse position.
-    mousePos2 = vec2()
-    # The previosly recorded mouse position.
     arraysize = 0
     # The size of the image list minus one to 
     # account for the first image being a background 
     # for the rest.
     distVals = list()
     # The list of cube location and orientation values.
+    cubes = None
+    # The cube location and orientation values as numpy arrays.
+    queue = None
+    # The render queue that draws the cubes sorted by texture.
+    spinSteps = 6
+    # The number of rotation increments applied per frame.
+    overdraw = None
+    # The fragment counter for the cube pass, if enabled.
+    culler = None
+    # The occlusion culling stage, if enabled.
+    cubeMatrices = None
+    # The modelview and projection matrices of the last cube pass, for picking.
+    loader = None
+    # The background texture loader.
+    textures = None
+    # The texture manager keeping the textures within the memory budget.
+    options = None
+    # The command line options.
+    scene = None
+    # The scene description, if one was given.
+    savedView = None
+    # The camera state from a loaded snapshot.
+    startup = None
+    # The threads laying out the cubes and decoding the pictures at startup.
+    profile = None
+    # The startup profile, reported and dropped at the first frame.
     soundFile = "/usr/share/openglresources/sounds/celticfive.wav"
     # The Sound file.
     # The list of file location for cube images.
@@ -139,29 +185,69 @@ class MultiCube:
         "/usr/share/openglresources/images/skybox/scene_back.tga"
     ])
     
-    def __init__(self):
+    def __init__(self, options = None, scene = None):
         """
         Initialize the GLUT windowing system and start the sound using the SFML library.
+        The options are the parsed command line options, and the optional
+        scene replaces the built in pictures and cube layout.
         """
-        glutInit(sys.argv)
-        self.arraysize = 2 * (len(self.boximages)  - 1)
-        self.permLoc()
+        self.options = options
+        self.scene = scene
+        with tracer.span("startup.glut"):
+            glutInit(sys.argv)
+        if ((options is not None) and (options.snapshot) and (self.loadState(options.snapshot))):
+            pass
+        elif (scene is not None):
+            self.boximages = scene.boxImages()
+            self.skyfiles = scene.skybox
+            if (scene.sound is not None):
+                self.soundFile = scene.sound
+            self.arraysize = scene.cubes
+        else:
+            self.arraysize = 2 * (len(self.boximages)  - 1)
+        with tracer.span("startup.audio"):
+            from pymulticube.audioworker import AudioWorker
+            self.audio = AudioWorker(self.soundFile)
+            self.audio.start()
+        self.input = InputState()
         self.camera = Camera(self.Width, self.Height, vec3(0.0, 0.0, 20.0), vec3(0.0, 0.0, 0.0))
+        if (self.savedView is not None):
+            self.camera.setState(self.savedView)
+        if ((options is not None) and (options.infinite)):
+            self.startWorld()
+        # Lay out the cubes and decode the pictures while the window and OpenGL start.
+        self.startup = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+        geometry = None
+        if (self.cubes is None):
+            geometry = self.startup.submit(self.buildCubes)
+        if (options is not None):
+            imageCache.capBytes = options.image_cache_mb * 1024 * 1024
+        # The pack and the mipmap cache mostly spare the loader decoding the pictures.
+        if ((options is None) or ((not options.pack) and ((options.atlas) 
+                or (options.mipmaps == "gpu") or (options.no_mip_cache)))):
+            self.startup.submit(self.prefetchImages)
         # create the main window
-        self.modes = VideoMode.get_fullscreen_modes()
-        if (self.debug1):
-            print("Mode 0 dimensions: ", self.modes[0].width, ", ", self.modes[0].height)
-        glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH | GLUT_ALPHA)
-        glutInitWindowSize(self.width, self.height) 
-        glutInitWindowPosition(int((self.modes[0].width / 2) - (self.width / 2)), int((self.modes[0].height / 2) - (self.height / 2))) 
-        self.windowID = glutCreateWindow("Python Glut OpenGL Demo")
+        with tracer.span("startup.window"):
+            from sfml.window import VideoMode
+            self.modes = VideoMode.get_fullscreen_modes()
+            if (self.debug1):
+                print("Mode 0 dimensions: ", self.modes[0].width, ", ", self.modes[0].height)
+            glutInitDisplayMode(GLUT_RGBA | GLUT_DOUBLE | GLUT_DEPTH | GLUT_ALPHA)
+            glutInitWindowSize(self.width, self.height) 
+            glutInitWindowPosition(int((self.modes[0].width / 2) - (self.width / 2)), int((self.modes[0].height / 2) - (self.height / 2))) 
+            self.windowID = glutCreateWindow("Python Glut OpenGL Demo")
         if (self.debug1):
             print("\n\tWindow width:  ", glutGet(GLUT_WINDOW_WIDTH), "  Window height:  ", 
         glutGet(GLUT_WINDOW_HEIGHT), ".")
-        soundinfo = "sound thread"
-        self.sndthrd = Process(target=self.soundMaker, args=(soundinfo,))
-        self.sndthrd.start()
-        self.initProg()
+        with tracer.span("startup.opengl"):
+            self.initProg()
+        if (geometry is not None):
+            with tracer.span("startup.wait"):
+                geometry.result()
+        self.startup.shutdown(wait=False)
+        # The physics keeps the cubes in one volume, which an endless field has not.
+        if ((options is not None) and (options.physics) and (self.world is None)):
+            self.startPhysics()
     
     def initProg(self):
         """
@@ -175,27 +261,110 @@ class MultiCube:
         self.cube = cuby.createCube(True, False)
         self.skyboxverts = cuby.createCube(False, False)
         self.skyboxverts *= 2000.0
+        self.queue = RenderQueue(self.cube)
+        if (self.options is not None):
+            self.queue.depthSort = not self.options.no_depth_sort
+            if (self.options.overdraw):
+                from pymulticube.overdraw import OverdrawCounter
+                self.overdraw = OverdrawCounter()
+            if (self.options.animation == "gpu"):
+                from pymulticube.cubeshader import CubeShader, shadersSupported
+            if ((self.options.animation == "gpu") and (shadersSupported())):
+                try:
+                    self.queue.shader = CubeShader(self.queue.vertices, self.queue.texcoords)
+                except RuntimeError as error:
+                    print("\n\tSpinning the cubes on the CPU: ", error)
+            # The shader needs no per-frame vertex data.
+            if ((self.options.streaming != "off") and (self.queue.shader is None)):
+                from pymulticube.streambuffer import StreamBuffer
+                self.queue.stream = StreamBuffer(self.arraysize * 36 * 20,
+                    self.options.streaming == "persistent")
+            if (not self.options.no_collision):
+                from pymulticube.collision import CameraCollider
+                self.collider = CameraCollider()
+            if (self.options.frame_budget_ms > 0):
+                from pymulticube.resolution import ResolutionGovernor, framebuffersSupported
+                if (framebuffersSupported()):
+                    try:
+                        self.governor = ResolutionGovernor(self.options.frame_budget_ms, self.options.min_scale)
+                        self.governor.allocate(self.width, self.height)
+                    except RuntimeError as error:
+                        print("\n\tDrawing at the window size: ", error)
+                        self.governor = None
+                else:
+                    print("\n\tDrawing at the window size, frame buffer objects are not supported.")
+            if (self.options.occlusion != "off"):
+                from pymulticube.occlusion import OcclusionCuller
+                self.culler = OcclusionCuller(self.options.occlusion == "auto")
         if (self.debug1):
             print("\n\tType for sky box:  ", type(self.skyboxverts), ".")
             self.printCube(self.skyboxverts)
             print("\n\tType for cube:  ", type(self.cube), ".")
             self.printCube(self.cube)
         # Create a clock for timing events.
+        from sfml import sf
         self.clock = sf.Clock()
         self.image = CreateImage()
-        self.textureID = self.image.doubleImage(self.boximages, 0)
+        if (self.options is not None):
+            from pymulticube.compositor import Compositor
+            self.image.compositor = Compositor(self.options.blend_mode, self.options.fit)
+        # Start drawing at once with placeholders and upload as the images decode.
+        self.loader = TextureLoader(self.image)
+        self.textures = TextureManager(self.loader)
+        self.loader.manager = self.textures
+        if (self.options is not None):
+            self.loader.budgetMs = self.options.upload_budget_ms
+            self.loader.budgetBytes = self.options.upload_budget_kb * 1024
+            self.textures.budgetBytes = self.options.texture_budget_mb * 1024 * 1024
+            if (self.options.mipmaps != "gpu"):
+                from pymulticube.atlas import TextureAtlas
+                from pymulticube.mipmaps import MipBuilder
+                # A face never covers more than the full screen.
+                screen = max(self.modes[0].width, self.modes[0].height)
+                maxsize = min(self.options.max_texture_size, int(glGetIntegerv(GL_MAX_TEXTURE_SIZE)))
+                cachedir = None if (self.options.no_mip_cache) else TextureAtlas.cacheDir
+                self.loader.mipmaps = MipBuilder(maxsize, screen, self.options.mipmaps, cachedir)
+        if ((self.options is not None) and (self.options.atlas)):
+            from pymulticube.atlas import TextureAtlas
+            atlas = TextureAtlas(min(int(glGetIntegerv(GL_MAX_TEXTURE_SIZE)), 4096))
+            (self.textureID, self.queue.uvRects) = self.loader.loadAtlasImages(self.boximages, atlas, 0)
+        elif ((self.options is not None) and (self.options.pack)):
+            from pymulticube.imagepack import PackReader
+            self.textureID = self.loader.loadPackImages(self.boximages, PackReader(self.options.pack), 0)
+        else:
+            self.textureID = self.loader.loadDoubleImages(self.boximages, 0)
+        self.skyboxID = self.loader.loadSkyBox(self.skyfiles, max(self.textureID) + 1)
+        if ((self.options is not None) and (self.options.sync_textures)):
+            self.loader.finish()
         if (self.debug1):
             for x in range(len(self.textureID)):
                 print("\n\tTexture ", x, " with ID ", self.textureID[x], 
                 " from file ", self.boximages[x])
-        self.skyboxID = self.image.createSkyBoxTex(self.skyfiles, len(self.textureID))
         glDepthRange(0.1, 200.0)
+        if ((self.options is not None) and (self.options.capture)):
+            from pymulticube.framecapture import FrameCapture
+            try:
+                self.capture = FrameCapture(self.options.capture, self.width, self.height,
+                    self.options.capture_fps, self.options.encoder)
+                # Each frame stands for the same time in the recording, however long it took.
+                self.input.fixedStep = 1.0 / self.options.capture_fps
+            except OSError as error:
+                print("\n\tUnable to record to ", self.options.capture, ": ", error, ".")
         
     def eventLoop(self):
         """
         The display and animation of the cubes is handled here.
         """
+        with tracer.span("eventLoop"):
+            self.drawFrame()
+        
+    def drawFrame(self):
+        """
+        Draw the sky box and the cubes and advance the cube rotations.
+        """
         self.timestart = self.clock.elapsed_time.seconds
+        if (self.loader is not None):
+            self.loader.pump()
         
         # clear the depth buffer
         glClearColor(0.0, 0.0, 0.0, 1.0);
@@ -206,6 +375,25 @@ class MultiCube:
         # this is useless here because we have only one window which is
         # always the active one, but don't forget it if you use multiple self.windows
         self.framebufferSize(self.width, self.height)
+        (drawWidth, drawHeight) = (self.width, self.height)
+        if (self.governor is not None):
+            # Draw at the governor's scale, stretched over the window at the end.
+            (drawWidth, drawHeight) = self.governor.begin(self.width, self.height)
+        # One camera update for all the input since the last frame.
+        self.input.apply(self.camera)
+        if (self.world is not None):
+            if (self.world.update(self.camera.getPosition())):
+                # The chunks keep their angles, so bring them up to date first.
+                if (self.queue.shader is not None):
+                    self.queue.shader.settle(self.cubes)
+                self.world.compose(self.cubes)
+        if (self.physics is not None):
+            if (self.capture is not None):
+                self.physics.step(self.input.fixedStep)
+            self.physics.apply(self.cubes)
+        if (self.collider is not None):
+            steps = self.queue.shader.ticks if (self.queue.shader is not None) else 0.
+            self.collider.resolve(self.camera, self.cubes, steps)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
         self.camera.setGluPerspective()
@@ -214,59 +402,67 @@ class MultiCube:
         self.camera.setGluViewMatrix()
         position = self.camera.getPosition()
         (pitch, yaw) = self.camera.getPitchYaw()
-        if (self.debug1):
-            print("\n\tPosition: ", position.x, ",", position.y, ",", position.z, "  Yaw: ", yaw,
-            "  Front: ", self.camera.Front.x, ",", self.camera.Front.y, ",", self.camera.Front.z)
-        # draw a skybox
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self.skyboxID)
-        glEnable(GL_TEXTURE_CUBE_MAP)
-        glBegin(GL_TRIANGLES)
-        for z in range(36):
-            glTexCoord3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
-            glVertex3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
-        glEnd()
-        glDisable(GL_TEXTURE_CUBE_MAP)
-        # draw a cube
-        glEnable(GL_CULL_FACE)
-        glCullFace(GL_FRONT)
-        for x in range(2):
-            for y in range(0, len(self.boximages) - 1):
-                # apply some transformations
-                glMatrixMode(GL_MODELVIEW)
-                glLoadIdentity()
-                glRotatef(yaw, 0.0, 1.0, 0.0)
-                glRotatef(-pitch, 1.0, 0.0, 0.0)
-                index = (x * (len(self.boximages) - 1))  + y
-                glTranslate(self.distVals[index].locon.x - position.x, 
-                self.distVals[index].locon.y - position.y,
-                self.distVals[index].locon.z - position.z)
-                glRotatef(self.distVals[index].angles[0], self.distVals[index].xaxis.x,
-                self.distVals[index].xaxis.y, self.distVals[index].xaxis.z)
-                glRotatef(self.distVals[index].angles[1], self.distVals[index].yaxis.x,
-                self.distVals[index].yaxis.y, self.distVals[index].yaxis.z)
-                for z in range(6):
-                    self.textureID1 = self.textureID[self.distVals[index].indices[z]]
-                    if (self.debug1):
-                        print("\n\tTexture ", index, " with ID ", self.textureID1, ".")
-                    glBindTexture(GL_TEXTURE_2D, self.textureID1)
-                    glEnable(GL_TEXTURE_2D)
-                    glBegin(GL_TRIANGLES)
-                    for w in range(6):
-                        if (self.debug1):
-                            print("\n\tw", w, " z ", z, " y ", y, " x ", x)
-                        glTexCoord2d(self.cube[(z * 6) + w][3], self.cube[(z * 6) + w][4])
-                        glVertex3f(self.cube[(z * 6) + w][0], self.cube[(z * 6) + w][1], self.cube[(z * 6) + w][2])
-                    glEnd()
-                    self.distVals[index].angles[0] += self.distVals[index].angles[2]
-                    self.distVals[index].angles[1] += self.distVals[index].angles[3]
-                    self.distVals[index].angles[0] = fmod(self.distVals[index].angles[0], 360.0)
-                    self.distVals[index].angles[1] = fmod(self.distVals[index].angles[1], 360.0)
-                    glDisable(GL_TEXTURE_2D)
-                    glBindTexture(GL_TEXTURE_2D, 0)
-        glDisable(GL_CULL_FACE)
+        front = self.camera.Front
+        # Keep the view matrix for the sky box, which is drawn last.
+        glPushMatrix()
+        # draw the cubes, front to back within each texture batch
+        with tracer.span("cubes"):
+            glEnable(GL_CULL_FACE)
+            glCullFace(GL_FRONT)
+            # The cube vertices arrive in world space, so only the view is applied here.
+            glLoadIdentity()
+            glRotatef(yaw, 0.0, 1.0, 0.0)
+            glRotatef(-pitch, 1.0, 0.0, 0.0)
+            glTranslate(-position.x, -position.y, -position.z)
+            # A pick unprojects through the same view the cubes were drawn with.
+            self.cubeMatrices = (glGetDoublev(GL_MODELVIEW_MATRIX), glGetDoublev(GL_PROJECTION_MATRIX))
+            eye = (position.x, position.y, position.z)
+            visible = None
+            if (self.culler is not None):
+                visible = self.culler.visibility(self.cubes, eye)
+            if (self.overdraw is not None):
+                self.overdraw.begin()
+            self.queue.draw(self.cubes, self.textureID, 
+                eye, (front.x, front.y, front.z), visible)
+            self.textures.touch(self.queue.drawn)
+            if (self.overdraw is not None):
+                self.overdraw.end(drawWidth, drawHeight)
+            if (self.culler is not None):
+                self.culler.endFrame(self.cubes)
+            # The per-face loop stepped the angles once per face drawn.
+            if (self.queue.shader is not None):
+                self.queue.shader.advance(self.spinSteps)
+            else:
+                self.cubes.advance(self.spinSteps)
+            glDisable(GL_CULL_FACE)
+        glPopMatrix()
+        # draw a skybox behind the cubes, the depth test skips the covered pixels
+        with tracer.span("skybox"):
+            glDepthFunc(GL_LEQUAL)
+            glDepthMask(GL_FALSE)
+            glBindTexture(GL_TEXTURE_CUBE_MAP, self.skyboxID)
+            glEnable(GL_TEXTURE_CUBE_MAP)
+            glBegin(GL_TRIANGLES)
+            for z in range(36):
+                glTexCoord3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
+                glVertex3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
+            glEnd()
+            glDisable(GL_TEXTURE_CUBE_MAP)
+            glDepthMask(GL_TRUE)
+            glDepthFunc(GL_LESS)
+        if (self.governor is not None):
+            self.governor.end(self.width, self.height)
+        self.textures.endFrame()
         glMatrixMode(GL_MODELVIEW);
+        if (self.capture is not None):
+            self.capture.capture()
         self.timeend = self.clock.elapsed_time.seconds
         glutSwapBuffers();
+        if (self.profile is not None):
+            # The first frame is on the screen.
+            self.profile.report()
+            tracer.unsubscribe(self.profile)
+            self.profile = None
         
     def printCube(self, cube):
         """
@@ -287,44 +483,33 @@ class MultiCube:
     #---------------------------------------------------------------------------------------------------------
     def keyDown(self, key, x, y):
         """
-        Handle keyboard inputs.
+        Handle keyboard inputs.  The motion keys are noted as held
+        and move the camera each frame until they are released.
         """
         mods = glutGetModifiers()
         keyval = ord(key)
         s = self.modes[0]
-        # Use timing to create a cameraSpeed variable.
-        delta = self.timeend - self.timestart
-        cameraSpeed = 25.0 * delta
-        if (self.debug1):
-            print("\n\tdelta:  ", delta, " cameraSpeed:  ", cameraSpeed, ".")
+        tracer.event("keyDown", lambda: {"key": keyval})
+        if (self.input.keyDown(key.decode("latin-1"))):
+            return
         if (keyval == 0x001B):
+            if (self.capture is not None):
+                self.capture.finish()
             glutDestroyWindow(self.windowID);
-            self.sndthrd.terminate()
-        # Motion keys.
-        # Forward motion.
-        elif ((keyval == 0x77) or (keyval == 0x57)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("FORWARD"), cameraSpeed)
-        # Backwards motion.
-        elif ((keyval == 0x73) or (keyval == 0x53)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("BACKWARD"), cameraSpeed)
-        # Move left.
-        elif ((keyval == 0x61) or (keyval == 0x41)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("LEFT"), cameraSpeed)
-        # Move right.
-        elif ((keyval == 0x44) or (keyval == 0x64)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("RIGHT"), cameraSpeed)
-        # Move up.
-        elif ((keyval == 0x72) or (keyval == 0x52)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("UP"), cameraSpeed)
-        # Move down.
-        elif ((keyval == 0x46) or (keyval == 0x66)):
-            self.camera.processKeyboard(Camera.Camera_Movement.index("DOWN"), cameraSpeed)
+            self.audio.stop()
+            if (self.physics is not None):
+                self.physics.stop()
+            if (self.world is not None):
+                self.world.close()
         # Reset the self.camera.
         elif ((keyval == 0x7A) or (keyval == 0x5A)):
             self.camera.resetCamera()
         # Reverse the self.camera.
         elif ((keyval == 0x78) or (keyval == 0x58)):
             self.camera.reverseDirection()
+        # Save a snapshot of the scene.
+        elif ((keyval == 0x70) or (keyval == 0x50)):
+            self.saveState(self.options.snapshot_out if (self.options is not None) else "multicube.snapshot")
         elif (keyval == 0x000D):
             if (mods == GLUT_ACTIVE_ALT):
                 if (self.fullScreen):
@@ -335,6 +520,12 @@ class MultiCube:
                     glutPositionWindow(int((s.width / 2) - (self.Width / 2)), int((s.height / 2) - (self.Height / 2))); 
                     windowEvent(self.Width, self.Height);
             self.fullScreen = not self.fullScreen
+
+    def keyUp(self, key, x, y):
+        """
+        Release a held key.
+        """
+        self.input.keyUp(key.decode("latin-1"))
     
     def funcKeyDown(self, key, x, y):
         """ 
@@ -343,32 +534,65 @@ class MultiCube:
         # Zoom keys.
         # Zoom in.
         if (key == GLUT_KEY_UP):
-            self.camera.processMouseScroll(Camera.Camera_Movement.index("CLOSER"))
+            self.input.zoomDown("in")
         # Zoom out.
         elif (key == GLUT_KEY_DOWN):
-            self.camera.processMouseScroll(Camera.Camera_Movement.index("AWAY"))
-        
+            self.input.zoomDown("out")
+
+    def funcKeyUp(self, key, x, y):
+        """
+        Release a held zoom key.
+        """
+        if (key == GLUT_KEY_UP):
+            self.input.zoomUp("in")
+        elif (key == GLUT_KEY_DOWN):
+            self.input.zoomUp("out")
         
     def mouseMove(self, x, y):
         """  
-        Handle mouse motion.
+        Handle mouse motion, which turns the camera at the next frame.
+        """
+        self.input.mouseMove(x, y)
+
+    def mouseClick(self, button, state, x, y):
+        """
+        Name the cube under the pointer on a left click.
         """
-        if (self.firstMouse):
-            self.mousePos2.x = x
-            self.mousePos2.y = y
-            self.firstMouse = False;
+        if ((button == GLUT_LEFT_BUTTON) and (state == GLUT_DOWN)):
+            self.pickCube(x, y)
 
-        self.mousePos1.x = x
-        self.mousePos1.y = y
+    def pickCube(self, x, y):
+        """
+        Find the nearest cube under a window position and print it.
+        Returns the cube number, or None.
+        """
+        from pymulticube.bvh import CubeBVH
+        if (self.cubeMatrices is None):
+            return None
+        if ((self.queue is not None) and (self.queue.shader is not None)):
+            # The shader keeps the angles, bring the field up to date.
+            self.queue.shader.settle(self.cubes)
+        if (self.bvh is None):
+            self.bvh = CubeBVH(self.cubes)
+        else:
+            self.bvh.refit(self.cubes)
+        (origin, direction) = self.camera.mouseRay(x, y, *self.cubeMatrices)
+        (cube, distance) = self.bvh.pick(self.cubes, origin, direction)
+        tracer.event("pickCube", lambda: {"x": x, "y": y, "cube": cube, "distance": distance})
+        if (cube is None):
+            print("\n\tNo cube under the pointer.")
+        else:
+            print("\n\tCube ", cube, " at ", round(distance, 2), " showing ", 
+                self.boximages[self.cubes.indices[cube][0]], ".")
+        return cube
 
-        if (self.debug1):
-            print("\n\tIn mouseMove() Mouse X, Y:  ", self.mousePos1.x, ", ", self.mousePos1.y, 
-            " Old Mouse: ", self.mousePos2.x, ", ", self.mousePos2.y, " differences ",
-            self.mousePos1.x - self.mousePos2.x, ", ", self.mousePos1.y - self.mousePos2.y, ".")
- 
-        self.camera.processMouseMovement(self.mousePos1.x - self.mousePos2.x, self.mousePos1.y - self.mousePos2.y)
-        self.mousePos2.x = x
-        self.mousePos2.y = y
+    def mouseEntry(self, state):
+        """
+        Let go of the held keys when the pointer leaves the window,
+        which may then miss the key releases.
+        """
+        if (state == GLUT_LEFT):
+            self.input.release()
         
     # Whenever the window size changed (by OS or user resize) this callback function executes
     # ---------------------------------------------------------------------------------------------
@@ -380,30 +604,19 @@ class MultiCube:
         # height will be significantly larger than specified on retina displays.
         glViewport(0, 0, width, height)
         self.camera.resizeView(width, height)
-        if (self.debug1):
-            print("\n\tWindow Dimensions: ", width, ", ", height, ".")
         self.width = width
         self.height = height
+        if (self.capture is not None):
+            self.capture.resize(width, height)
 
-    def soundMaker(self, tinfo = ""):
+    def windowClosed(self):
         """
-        Create the background music.
+        Write out the last recorded frames as the window closes, while
+        its context is still current.
         """
-        uargv = ""
-        if (self.debug1):
-            print("\n\tThe thread", tinfo, "is starting.")
-        uargv = tinfo.upper()
-        buffer = sf.SoundBuffer.from_file(self.soundFile)
-        if (not buffer):
-            print("\n\tUnable to load the sound", self.soundFile, ".")
-        sound = sf.Sound(buffer)
-        sound.loop = True
-        while(True):
-            sound.play()
-            sf.sleep(sf.seconds(300))
-        if (self.debug1):    
-            print("\n\tThe thread", uargv, "is terminated.")
-    
+        if (self.capture is not None):
+            self.capture.finish()
+
     def permLoc(self):
         """
         Calculate the locations and orientations.
@@ -453,10 +666,107 @@ class MultiCube:
             
             # Add the item to the collection.
             self.distVals.append(locItem)
+        self.cubes = CubeField()
+        self.cubes.loadPosOrient(self.distVals)
         if (self.debug1):
             self.debugPrint()
+
+    def buildCubes(self):
+        """
+        Lay out the cubes from the scene, or at random.  It runs on a
+        startup thread while the window opens.
+        """
+        with tracer.span("startup.geometry", {"cubes": self.arraysize}):
+            if (self.world is not None):
+                self.cubes = CubeField()
+                self.world.prime(self.camera.getPosition(), self.cubes)
+            elif (self.scene is not None):
+                self.cubes = self.scene.createField()
+            else:
+                self.permLoc()
+
+    def startWorld(self):
+        """
+        Set up the endless field, its chunks laid out like the
+        scene's volume, or like the random layout.
+        """
+        from pymulticube.chunkworld import ChunkWorld
+        if (self.scene is not None):
+            self.world = ChunkWorld(self.scene.center, self.scene.size, self.scene.cubes,
+                len(self.scene.pictures), self.scene.spacing, (self.scene.spinMin, self.scene.spinMax),
+                self.scene.seed, self.options.chunk_reach, self.options.chunk_cache)
+        else:
+            self.world = ChunkWorld((0.0, 0.0, -15.0), (20.0, 20.0, 20.0), self.arraysize,
+                len(self.boximages) - 2, reach=self.options.chunk_reach, capacity=self.options.chunk_cache)
+
+    def startPhysics(self):
+        """
+        Start moving the cubes about within the scene's volume, or
+        the volume the random layout fills.
+        """
+        from pymulticube.physics import CubePhysics
+        if (self.scene is not None):
+            (center, size) = (self.scene.center, self.scene.size)
+        else:
+            (center, size) = ((0.0, 0.0, -15.0), (20.0, 20.0, 20.0))
+        self.physics = CubePhysics(self.cubes.positions, center, size, self.options.physics_speed)
+        # While recording the steps are taken once per frame instead.
+        if (self.capture is None):
+            self.physics.start()
+
+    def prefetchImages(self):
+        """
+        Decode the cube pictures into the image cache, as the texture
+        loader asks for them, while the window and OpenGL start.  The
+        loader waits for a picture still being decoded here.
+        """
+        with tracer.span("startup.prefetch", {"images": len(self.boximages)}):
+            imageCache.get(self.boximages[0])
+            # doubleImage() skips the last picture.
+            for filename in self.boximages[:-1]:
+                try:
+                    imageCache.get(filename, "RGBA", ("rotate", 180))
+                except (OSError, ValueError):
+                    # The texture loader reports it.
+                    pass
     
 
+    def saveState(self, filename):
+        """
+        Save the cubes, the camera and the picture lists to a snapshot file.
+        """
+        if ((self.queue is not None) and (self.queue.shader is not None)):
+            # The shader keeps the angles, bring the field up to date.
+            self.queue.shader.settle(self.cubes)
+        from pymulticube.snapshot import saveSnapshot
+        extra = {"boximages": self.boximages, "skyfiles": self.skyfiles, "soundFile": self.soundFile}
+        try:
+            with tracer.span("saveSnapshot", {"cubes": self.cubes.count}):
+                saveSnapshot(filename, self.cubes, self.camera, extra)
+            print("\n\tSaved the scene to ", filename, ".")
+        except OSError as error:
+            print("\n\tUnable to save the scene to ", filename, ": ", error, ".")
+
+    def loadState(self, filename):
+        """
+        Load the cubes and picture lists from a snapshot file, keeping
+        the camera state for when the camera is made.  Returns False,
+        leaving the scene to be made as usual, if the file cannot be used.
+        """
+        from pymulticube.snapshot import loadSnapshot
+        try:
+            with tracer.span("loadSnapshot"):
+                (self.cubes, self.savedView, extra) = loadSnapshot(filename)
+        except (OSError, ValueError, KeyError) as error:
+            print("\n\tUnable to load the snapshot ", filename, ": ", error, ".")
+            return False
+        self.boximages = extra.get("boximages", self.boximages)
+        self.skyfiles = extra.get("skyfiles", self.skyfiles)
+        self.soundFile = extra.get("soundFile", self.soundFile)
+        self.arraysize = self.cubes.count
+        print("\n\tLoaded ", self.cubes.count, " cubes from ", filename, ".")
+        return True
+
     def calcRand(self):
         """
         Random number for x,y,z values for cube location.
@@ -489,19 +799,145 @@ class MultiCube:
 def main():
     """ Start the program.
     """
-    glutwin = MultiCube()
+    parser = ArgumentParser(description="Display randomly placed, spinning cubes in a sky box.")
+    parser.add_argument("--scene", metavar="FILE",
+        help="read the pictures, cube count and layout and render settings from a "
+        "JSON or TOML scene file, see openglresources/scenes/default.json")
+    parser.add_argument("--snapshot", metavar="FILE",
+        help="start from a scene snapshot saved with the p key")
+    parser.add_argument("--snapshot-out", metavar="FILE", default="multicube.snapshot",
+        help="the file the p key saves the scene snapshot to (default multicube.snapshot)")
+    parser.add_argument("--trace", metavar="FILE", 
+        help="write a Chrome trace-format JSON file of the run on exit")
+    parser.add_argument("--trace-console", action="store_true",
+        help="print the trace events and counters on the console")
+    parser.add_argument("--no-depth-sort", action="store_true",
+        help="draw the cubes in texture order only, not front to back")
+    parser.add_argument("--overdraw", action="store_true",
+        help="count the fragments drawn per pixel for the cubes and report the average on exit")
+    parser.add_argument("--no-collision", action="store_true",
+        help="let the camera fly through the cubes")
+    parser.add_argument("--physics", action="store_true",
+        help="let the cubes drift and bounce off each other and the walls of their volume, "
+        "in a worker process, at full speed up to about 20,000 cubes")
+    parser.add_argument("--physics-speed", type=float, default=1.0, metavar="UNITS",
+        help="the speed the cubes start drifting at, in units per second (default 1)")
+    parser.add_argument("--infinite", action="store_true",
+        help="fill endless space with cubes, made in chunks as the camera comes near")
+    parser.add_argument("--chunk-reach", type=int, default=1, metavar="CHUNKS",
+        help="the chunks drawn on each side of the camera's chunk with --infinite (default 1)")
+    parser.add_argument("--chunk-cache", type=int, default=64, metavar="CHUNKS",
+        help="the most chunks kept in memory with --infinite (default 64)")
+    parser.add_argument("--capture", metavar="TARGET",
+        help="record the frames, as PNG pictures in a directory or as a video when "
+        "TARGET ends in .mp4, .mkv, .webm, .mov or .avi")
+    parser.add_argument("--capture-fps", type=float, default=30.0, metavar="FPS",
+        help="the frames per second of the recording (default 30)")
+    parser.add_argument("--encoder", default="ffmpeg", metavar="PROGRAM",
+        help="the ffmpeg compatible program that makes the videos (default ffmpeg)")
+    parser.add_argument("--frame-budget-ms", type=float, default=0.0, metavar="MS",
+        help="draw the scene at a lower resolution, stretched to the window, when the "
+        "frames take longer than this, 0 to always draw at the window size (default 0)")
+    parser.add_argument("--min-scale", type=float, default=0.5, metavar="SHARE",
+        help="the least share of the window's width and height drawn with --frame-budget-ms (default 0.5)")
+    parser.add_argument("--occlusion", choices=("auto", "hiz", "off"), default="auto",
+        help="skip hidden cubes using occlusion queries on groups of nearby cubes when available (auto), "
+        "the CPU hierarchical depth buffer (hiz), or not at all (off)")
+    parser.add_argument("--streaming", choices=("persistent", "orphan", "off"), default="persistent",
+        help="stream the per-frame cube vertices through a persistently mapped buffer "
+        "where supported (persistent), an orphaned buffer (orphan) or client arrays (off)")
+    parser.add_argument("--animation", choices=("gpu", "cpu"), default="gpu",
+        help="spin the cubes in a vertex shader where supported (gpu) or on the CPU (cpu)")
+    parser.add_argument("--sync-textures", action="store_true",
+        help="load every texture before the first frame instead of in the background")
+    parser.add_argument("--atlas", action="store_true",
+        help="pack the cube images into a few large atlas textures")
+    parser.add_argument("--upload-budget-ms", type=float, default=4.0, metavar="MS",
+        help="the time per frame allowed for texture uploads (default 4)")
+    parser.add_argument("--upload-budget-kb", type=int, default=8192, metavar="KB",
+        help="the texture data per frame allowed for uploads (default 8192)")
+    parser.add_argument("--texture-budget-mb", type=int, default=512, metavar="MB",
+        help="the video memory allowed for the cube textures before the least "
+        "recently seen are unloaded, 0 for no limit (default 512)")
+    parser.add_argument("--blend-mode", choices=("over", "multiply", "screen", "add", "darken", "lighten"),
+        default="over", help="how the cube pictures are blended over the background picture")
+    parser.add_argument("--fit", choices=("stretch", "letterbox"), default="stretch",
+        help="how pictures of another size are fitted to the background picture")
+    parser.add_argument("--image-cache-mb", type=int, default=256, metavar="MB",
+        help="the memory kept for decoded images shared between textures (default 256)")
+    parser.add_argument("--pack", metavar="FILE",
+        help="load the cube textures from an image pack built with "
+        "python3 -m pymulticube.imagepack --background <first image> and the same --blend-mode and --fit")
+    parser.add_argument("--mipmaps", choices=("box", "lanczos", "gpu"), default="box",
+        help="build the mipmaps on the worker threads with a box or Lanczos filter, "
+        "or on the GPU with glGenerateMipmap (gpu)")
+    parser.add_argument("--max-texture-size", type=int, default=1024, metavar="PIXELS",
+        help="scale larger images down to this size before upload (default 1024)")
+    parser.add_argument("--no-mip-cache", action="store_true",
+        help="do not keep the built mipmaps in ~/.cache/pymulticube")
+    parser.add_argument("--startup-profile", action="store_true",
+        help="print the time taken by each startup phase at the first frame")
+    (options, glutargs) = parser.parse_known_args()
+    sys.argv = sys.argv[:1] + glutargs
+    if (options.trace):
+        writer = tracer.subscribe(ChromeTraceWriter(options.trace))
+        # GLUT may end the process from inside glutMainLoop().
+        atexit.register(writer.save)
+    if (options.trace_console):
+        tracer.subscribe(ConsoleSubscriber())
+    profile = None
+    if (options.startup_profile):
+        profile = tracer.subscribe(StartupProfile(STARTED))
+        # The module imports ran before the profile existed.
+        profile.onSpan("startup.imports", STARTED, perf_counter() - STARTED, None)
+    scene = None
+    if (options.scene):
+        from pymulticube.scene import Scene, SceneError
+        try:
+            scene = Scene(options.scene)
+        except SceneError as error:
+            print("\n\tUnable to use the scene ", options.scene, ":\n", error)
+            return
+        scene.applyRender(options, parser)
+    glutwin = MultiCube(options, scene)
+    glutwin.profile = profile
+    if (glutwin.governor is not None):
+        atexit.register(lambda: print("\n\tRender scale ", glutwin.governor.scale, " at exit, changed ",
+            glutwin.governor.changes, " times."))
+    if (glutwin.capture is not None):
+        # Closing the window ends the process from inside glutMainLoop(),
+        # the frames in the buffers are kept if GLUT says so first.
+        try:
+            glutCloseFunc(glutwin.windowClosed)
+        except OpenGL.error.NullFunctionError:
+            pass
+        atexit.register(glutwin.capture.close)
+    if (glutwin.overdraw is not None):
+        atexit.register(lambda: print("\n\tAverage cube fragments per pixel: ", 
+            glutwin.overdraw.average(), "."))
     glutDisplayFunc(glutwin.eventLoop)
     glutIdleFunc(glutwin.eventLoop)
     glutReshapeFunc(glutwin.framebufferSize)
+    # Held keys are tracked with the key up events, not the key repeats.
+    glutIgnoreKeyRepeat(1)
     glutKeyboardFunc(glutwin.keyDown)
+    glutKeyboardUpFunc(glutwin.keyUp)
     glutSpecialFunc(glutwin.funcKeyDown)
+    glutSpecialUpFunc(glutwin.funcKeyUp)
     glutPassiveMotionFunc(glutwin.mouseMove)
+    glutMouseFunc(glutwin.mouseClick)
+    glutEntryFunc(glutwin.mouseEntry)
     glutMainLoop()
     print("\n\tEnd Program.\n\n")
-    glDeleteTextures(len(glutwin.textureID), glutwin.textureID)
-    glutwin.sndthrd.terminate()
+    glutwin.textures.delete()
+    glutwin.audio.stop()
+    if (glutwin.physics is not None):
+        glutwin.physics.stop()
+    if (glutwin.world is not None):
+        glutwin.world.close()
     return
 
 # Run it all.
-main()
+if (__name__ == "__main__"):
+    main()
     
@@ -0,0 +1,241 @@
+"""
+**********************************************************
+* TextureAtlas:  A class to pack many images into a few
+* large textures.  The images are placed with a skyline
+* packer, each one surrounded by a border of its own edge
+* pixels so the mipmaps do not bleed between neighbors,
+* and the texture coordinate rectangle of each image is
+* returned for remapping the cube texture coordinates.  The
+* layout is cached on disk so it is only packed once.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import hashlib
+import json
+import os
+from numpy import pad, zeros
+
+
+def remapTexCoords(coords, rects):
+    """
+    Map texture coordinates in the range 0 to 1 into atlas
+    rectangles (u0, v0, u1, v1).  The arrays broadcast, so one
+    face of coordinates may be mapped into many rectangles.
+    """
+    return rects[..., 0:2] + coords * (rects[..., 2:4] - rects[..., 0:2])
+
+
+class SkylinePacker:
+    """
+    SkylinePacker:  Places rectangles on a page by keeping the
+    top edge of the filled area as a list of [x, y, width]
+    segments and putting each rectangle where its top is lowest.
+    """
+    def __init__(self, width, height):
+        """
+        Start with an empty page.
+        """
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+
+    def fit(self, index, width):
+        """
+        The lowest y at which a rectangle of the given width can sit
+        starting at segment index, or None if it runs off the page.
+        """
+        x = self.skyline[index][0]
+        if (x + width > self.width):
+            return None
+        y = 0
+        remaining = width
+        while (remaining > 0):
+            if (index >= len(self.skyline)):
+                return None
+            y = max(y, self.skyline[index][1])
+            remaining -= self.skyline[index][2]
+            index += 1
+        return y
+
+    def insert(self, width, height):
+        """
+        Place a rectangle and return its (x, y) corner, or None if
+        it does not fit on the page.
+        """
+        best = None
+        for index in range(len(self.skyline)):
+            y = self.fit(index, width)
+            if ((y is None) or (y + height > self.height)):
+                continue
+            score = (y + height, self.skyline[index][0])
+            if ((best is None) or (score < best[0])):
+                best = (score, index, y)
+        if (best is None):
+            return None
+        (score, index, y) = best
+        x = self.skyline[index][0]
+        self.skyline.insert(index, [x, y + height, width])
+        # Trim the segments now under the new one.
+        after = index + 1
+        while (after < len(self.skyline)):
+            segment = self.skyline[after]
+            overlap = (x + width) - segment[0]
+            if (overlap <= 0):
+                break
+            if (overlap < segment[2]):
+                segment[0] += overlap
+                segment[2] -= overlap
+                break
+            del self.skyline[after]
+        # Merge neighbors at the same height.
+        index = 0
+        while (index < len(self.skyline) - 1):
+            if (self.skyline[index][1] == self.skyline[index + 1][1]):
+                self.skyline[index][2] += self.skyline[index + 1][2]
+                del self.skyline[index + 1]
+            else:
+                index += 1
+        return (x, y)
+
+
+class TextureAtlas:
+    """
+    TextureAtlas:  Call layout() with the image names and sizes to
+    get the page and rectangle of each image, then compose() with
+    the pixels to get the page images to upload.
+    """
+    VERSION = 1
+    # The cache file format version.
+    pageSize = 4096
+    # The width and height of each page in pixels.
+    padding = 16
+    # The border around each image, also its alignment.
+    cacheDir = os.path.join(os.path.expanduser("~"), ".cache", "pymulticube")
+    # The directory for the cached layouts.
+    entries = None
+    # For each image, [page, x, y, width, height] of the image proper.
+    pages = 0
+    # The number of pages.
+
+    def __init__(self, pageSize = 4096, padding = 16, cacheDir = None):
+        """
+        Set the page size, the padding and the cache directory.  A
+        cacheDir of False turns the cache off.
+        """
+        self.pageSize = pageSize
+        self.padding = padding
+        if (cacheDir is not None):
+            self.cacheDir = cacheDir
+        self.entries = list()
+
+    def cacheFile(self, names, sizes):
+        """
+        The cache file for a set of images.  The name hashes the file
+        names, sizes and modification times and the packing settings.
+        """
+        stamps = list()
+        for name in names:
+            try:
+                info = os.stat(name)
+                stamps.append([name, info.st_size, info.st_mtime])
+            except OSError:
+                stamps.append([name, 0, 0])
+        key = json.dumps([self.VERSION, self.pageSize, self.padding, stamps,
+            [list(size) for size in sizes]])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cacheDir, "atlas-" + digest + ".json")
+
+    def layout(self, names, sizes):
+        """
+        Place images of the given (width, height) sizes.  Returns the
+        texture coordinate rectangles as an (images, 4) numpy array.
+        """
+        cachefile = None
+        if (self.cacheDir):
+            cachefile = self.cacheFile(names, sizes)
+            if (os.path.exists(cachefile)):
+                try:
+                    with open(cachefile) as infile:
+                        saved = json.load(infile)
+                    self.entries = saved["entries"]
+                    self.pages = saved["pages"]
+                    return self.rects()
+                except (OSError, ValueError, KeyError):
+                    print("\n\tIgnoring the damaged atlas cache ", cachefile, ".")
+        self.pack(sizes)
+        if (cachefile is not None):
+            try:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                with open(cachefile, "w") as outfile:
+                    json.dump({"entries": self.entries, "pages": self.pages}, outfile)
+            except OSError as error:
+                print("\n\tUnable to save the atlas layout: ", error, ".")
+        return self.rects()
+
+    def pack(self, sizes):
+        """
+        Pack the images, largest first, opening pages as needed.
+        """
+        step = max(self.padding, 1)
+        order = sorted(range(len(sizes)), key=lambda x: (-sizes[x][1], -sizes[x][0]))
+        self.entries = [None] * len(sizes)
+        packers = list()
+        for index in order:
+            (width, height) = sizes[index]
+            # The padded size, rounded up to the alignment.
+            cellw = -((-(width + 2 * self.padding)) // step) * step
+            cellh = -((-(height + 2 * self.padding)) // step) * step
+            if ((cellw > self.pageSize) or (cellh > self.pageSize)):
+                raise ValueError("Image " + str(index) + " of size " + str(width) + "x"
+                    + str(height) + " does not fit an atlas page of " + str(self.pageSize) + ".")
+            spot = None
+            for page in range(len(packers)):
+                spot = packers[page].insert(cellw, cellh)
+                if (spot is not None):
+                    break
+            if (spot is None):
+                packers.append(SkylinePacker(self.pageSize, self.pageSize))
+                page = len(packers) - 1
+                spot = packers[page].insert(cellw, cellh)
+            self.entries[index] = [page, spot[0] + self.padding, spot[1] + self.padding, width, height]
+        self.pages = len(packers)
+
+    def rects(self):
+        """
+        The (u0, v0, u1, v1) texture coordinate rectangle of each image.
+        """
+        result = zeros((len(self.entries), 4), 'f')
+        for index in range(len(self.entries)):
+            (page, x, y, width, height) = self.entries[index]
+            result[index] = (x / self.pageSize, y / self.pageSize,
+                (x + width) / self.pageSize, (y + height) / self.pageSize)
+        return result
+
+    def pageOf(self, index):
+        """
+        The page holding image index.
+        """
+        return self.entries[index][0]
+
+    def compose(self, images, only = None):
+        """
+        Copy a list of (height, width, 4) byte arrays into the pages,
+        with their edge pixels extended into the padding.  Returns the
+        list of (pageSize, pageSize, 4) page arrays, or a list of just
+        one page if only is given.
+        """
+        wanted = range(self.pages) if (only is None) else [only]
+        pages = dict()
+        for page in wanted:
+            pages[page] = zeros((self.pageSize, self.pageSize, 4), "uint8")
+        border = self.padding
+        for index in range(len(images)):
+            (page, x, y, width, height) = self.entries[index]
+            if (page not in pages):
+                continue
+            pixels = images[index]
+            if (border > 0):
+                pixels = pad(pixels, ((border, border), (border, border), (0, 0)), mode="edge")
+            pages[page][y - border:y + height + border, x - border:x + width + border] = pixels
+        return [pages[page] for page in wanted]
@@ -0,0 +1,126 @@
+"""
+**********************************************************
+* AudioWorker:  A class to play the background music on a
+* small thread.  The sound file is streamed from disk a
+* second at a time with an SFML Music object rather than
+* loaded whole into a sound buffer, and the thread is told
+* to pause, resume, change volume or stop through a command
+* queue, so it shuts down cleanly with the program.  The
+* memory it uses is reported when the music starts.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import os
+import queue
+import threading
+from pymulticube.tracer import tracer
+
+
+def residentBytes():
+    """
+    The resident memory of the process in bytes, or 0 where
+    /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as infile:
+            return int(infile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class AudioWorker:
+    """
+    AudioWorker:  Call start() to loop a sound file in the
+    background, pause(), resume() and volume() to control it
+    and stop() to end it.
+    """
+    BUFFERS = 4
+    # SFML keeps three stream buffers of one second and a read buffer.
+    filename = None
+    # The sound file.
+    thread = None
+    # The thread that owns the music.
+    bufferBytes = 0
+    # The memory used for the stream buffers, once playing.
+    fileBytes = 0
+    # The memory the whole sound would take loaded into a buffer.
+
+    def __init__(self, filename):
+        """
+        Set the sound file, nothing is opened until start().
+        """
+        self.filename = filename
+        self.commands = queue.Queue()
+
+    def start(self):
+        """
+        Start the thread, which opens the file and plays it in a loop.
+        """
+        self.thread = threading.Thread(target=self.run, name="audio", daemon=True)
+        self.thread.start()
+
+    def pause(self):
+        self.commands.put(("pause",))
+
+    def resume(self):
+        self.commands.put(("play",))
+
+    def volume(self, percent):
+        self.commands.put(("volume", percent))
+
+    def stop(self, timeout = 2.0):
+        """
+        Ask the thread to stop the music and close the file, and
+        wait for it to finish.
+        """
+        if ((self.thread is not None) and (self.thread.is_alive())):
+            self.commands.put(("stop",))
+            self.thread.join(timeout)
+        self.thread = None
+
+    def run(self):
+        """
+        Thread body: open the stream, then carry out the commands
+        until told to stop.  SFML reads the file on its own
+        streaming thread, so this one only waits on the queue.
+        """
+        before = residentBytes()
+        try:
+            from sfml import sf
+            with tracer.span("AudioWorker.open", {"file": self.filename}):
+                music = sf.Music.from_file(self.filename)
+        except Exception as error:
+            print("\n\tUnable to play the sound ", self.filename, ": ", error, ".")
+            return
+        music.loop = True
+        music.play()
+        self.report(music, before)
+        while (True):
+            command = self.commands.get()
+            if (command[0] == "stop"):
+                break
+            elif (command[0] == "pause"):
+                music.pause()
+            elif (command[0] == "play"):
+                music.play()
+            elif (command[0] == "volume"):
+                music.volume = max(0.0, min(100.0, float(command[1])))
+        music.stop()
+        del music
+
+    def report(self, music, before):
+        """
+        Print the memory used by the stream next to what loading the
+        whole sound would take.
+        """
+        frameBytes = music.channel_count * 2
+        self.bufferBytes = self.BUFFERS * music.sample_rate * frameBytes
+        self.fileBytes = int(music.duration.seconds * music.sample_rate) * frameBytes
+        tracer.count("audioBufferBytes", self.bufferBytes)
+        print("\n\tStreaming the sound ", self.filename, " with ", self.bufferBytes // 1024,
+            " KB of buffers in place of ", self.fileBytes // 1024, " KB for the whole sound.")
+        after = residentBytes()
+        if (after > 0):
+            print("\n\tThe process grew ", max(after - before, 0) // 1024,
+                " KB starting the sound, to ", after // (1024 * 1024), " MB.")
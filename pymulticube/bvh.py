@@ -0,0 +1,255 @@
+"""
+**********************************************************
+* CubeBVH:  A class to keep a bounding volume hierarchy over
+* the cubes for ray picking and nearness queries.  The cubes
+* are sorted along a Morton curve and cut into leaves of a
+* few cubes each, and the leaves are the bottom row of a
+* complete binary tree held in numpy arrays.  As the cubes
+* turn or move only the boxes are refit, level by level, and
+* the tree is rebuilt when the refit boxes grow too loose.
+* Queries walk the tree a level at a time, testing every
+* node in the frontier with one numpy expression.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import heapq
+from numpy import (abs as absolute, arange, argsort, array, full, inf, maximum, minimum,
+    sqrt, uint64, where, zeros)
+from pymulticube.tracer import tracer
+
+HALFSIZE = 0.5
+# Half the edge of a cube, as CubeMaker builds it.
+
+
+def mortonCodes(points, bits = 10):
+    """
+    The Morton curve position of each point, shape (n, 3), within
+    the box around the points, with bits per axis.
+    """
+    lower = points.min(axis=0)
+    span = maximum(points.max(axis=0) - lower, 1e-9)
+    cells = ((points - lower) / span * ((1 << bits) - 1)).astype(uint64)
+    codes = zeros(len(points), uint64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((cells[:, axis] >> uint64(bit)) & uint64(1)) << uint64(3 * bit + axis)
+    return codes
+
+
+def rayBoxes(origin, inverse, lower, upper):
+    """
+    The entry distance of a ray into each box, or inf for the
+    boxes it misses and the empty boxes.  inverse is one over the
+    ray direction.
+    """
+    near = (lower - origin) * inverse
+    far = (upper - origin) * inverse
+    enter = minimum(near, far).max(axis=1)
+    leave = maximum(near, far).min(axis=1)
+    enter = maximum(enter, 0.0)
+    return where((enter <= leave) & (lower[..., 0] <= upper[..., 0]), enter, inf)
+
+
+class CubeBVH:
+    """
+    CubeBVH:  Build with build(field), call refit(field) after the
+    cubes turn or move, then pick(), nearest() and inBox().  Node
+    0 is the root and the children of node i are 2i + 1 and 2i + 2.
+    """
+    LEAFSIZE = 8
+    # The cubes in each leaf.
+    STARTLEVEL = 5
+    # The tree level queries start from.
+    STEP = 2
+    # The levels a query descends at a time.
+    REBUILDGROWTH = 2.0
+    # Rebuild when the leaf boxes' area passes this multiple of its built value.
+    order = None
+    # The cube indices in leaf order.
+    leaves = 0
+    # The number of leaves holding cubes.
+    first = 0
+    # The node index of the first leaf.
+    lower = None
+    # The lower corner of every node box, shape (nodes, 3).
+    upper = None
+    # The upper corner of every node box, shape (nodes, 3).
+    cubeLower = None
+    # The lower corner of every cube box, in leaf order.
+    cubeUpper = None
+    # The upper corner of every cube box, in leaf order.
+    builtArea = 0.
+    # The leaf boxes' area when the tree was built.
+    rebuilds = 0
+    # The number of times refit() rebuilt the tree.
+
+    def __init__(self, field = None):
+        """
+        Build the tree over a CubeField if one is given.
+        """
+        if (field is not None):
+            self.build(field)
+
+    def build(self, field):
+        """
+        Sort the cubes into leaves and fit the boxes.
+        """
+        with tracer.span("CubeBVH.build", {"cubes": field.count}):
+            if (field.count > 0):
+                self.order = argsort(mortonCodes(field.positions), kind="stable")
+            else:
+                self.order = zeros(0, int)
+            self.leaves = max((field.count + self.LEAFSIZE - 1) // self.LEAFSIZE, 1)
+            # A complete tree needs a power of two leaves, the spares stay empty.
+            self.first = (1 << (self.leaves - 1).bit_length()) - 1
+            self.lower = full((2 * self.first + 1, 3), inf, 'f')
+            self.upper = full((2 * self.first + 1, 3), -inf, 'f')
+            self.fit(field)
+            self.builtArea = self.leafArea()
+
+    def cubeBounds(self, field, rows):
+        """
+        The boxes around the cubes in rows as they are turned now.
+        """
+        rotations = field.rotations(rows)
+        extent = absolute(rotations).sum(axis=2) * HALFSIZE
+        centers = field.positions[rows]
+        return (centers - extent, centers + extent)
+
+    def fit(self, field):
+        """
+        Fit the cube, leaf and node boxes, bottom up.
+        """
+        (self.cubeLower, self.cubeUpper) = self.cubeBounds(field, self.order)
+        if (field.count > 0):
+            starts = arange(0, field.count, self.LEAFSIZE)
+            leaves = slice(self.first, self.first + self.leaves)
+            self.lower[leaves] = minimum.reduceat(self.cubeLower, starts)
+            self.upper[leaves] = maximum.reduceat(self.cubeUpper, starts)
+        level = self.first
+        while (level > 0):
+            # The nodes level // 2 .. level - 1 are the parents of level .. 2 * level.
+            parents = (level - 1) // 2
+            children = slice(level, 2 * level + 1)
+            self.lower[parents:level] = self.lower[children].reshape(-1, 2, 3).min(axis=1)
+            self.upper[parents:level] = self.upper[children].reshape(-1, 2, 3).max(axis=1)
+            level = parents
+
+    def leafArea(self):
+        """
+        The total surface area of the leaf boxes.
+        """
+        size = (self.upper - self.lower)[self.first:self.first + self.leaves]
+        size = maximum(size, 0.0)
+        return float((size[:, 0] * size[:, 1] + size[:, 1] * size[:, 2] + size[:, 2] * size[:, 0]).sum() * 2.0)
+
+    def refit(self, field):
+        """
+        Refit the boxes to the cubes as they are now.  The tree is
+        rebuilt if the count changed or the boxes grew too loose.
+        """
+        if ((self.order is None) or (len(self.order) != field.count)):
+            self.build(field)
+            return
+        with tracer.span("CubeBVH.refit", {"cubes": field.count}):
+            self.fit(field)
+        if (self.leafArea() > self.REBUILDGROWTH * max(self.builtArea, 1e-9)):
+            self.rebuilds += 1
+            self.build(field)
+
+    def leafCubes(self, leaves):
+        """
+        The leaf order positions of the cubes in leaf numbers.
+        """
+        slots = (leaves[:, None] * self.LEAFSIZE + arange(self.LEAFSIZE)).ravel()
+        return slots[slots < len(self.order)]
+
+    def walk(self, test):
+        """
+        Walk down the tree, keeping the nodes for which
+        test(lower, upper) is true.  The walk starts a few levels
+        down and steps two levels at a time, as each numpy call
+        costs more than the few extra boxes tested.  Returns the
+        leaf numbers reached.
+        """
+        depth = (self.first + 1).bit_length() - 1
+        level = min(self.STARTLEVEL, depth)
+        nodes = arange((1 << level) - 1, (2 << level) - 1)
+        while (True):
+            nodes = nodes[test(self.lower[nodes], self.upper[nodes])]
+            if ((len(nodes) == 0) or (level == depth)):
+                break
+            step = min(self.STEP, depth - level)
+            # The descendants of node i, step levels down.
+            nodes = ((nodes[:, None] + 1) * (1 << step) - 1 + arange(1 << step)).ravel()
+            level += step
+        return nodes - self.first
+
+    def pick(self, field, origin, direction):
+        """
+        The nearest cube hit by a ray, as (cube, distance), or
+        (None, inf) for a miss.  The boxes must be fit to the field.
+        """
+        with tracer.span("CubeBVH.pick"):
+            origin = array(origin, 'f')
+            direction = array(direction, 'f')
+            direction /= sqrt((direction * direction).sum())
+            inverse = 1.0 / where(direction != 0.0, direction, 1e-30)
+            leaves = self.walk(lambda lower, upper: rayBoxes(origin, inverse, lower, upper) < inf)
+            slots = self.leafCubes(leaves)
+            if (len(slots) == 0):
+                return (None, inf)
+            # Skip the cubes whose boxes the ray misses, then test the cubes themselves.
+            slots = slots[rayBoxes(origin, inverse, self.cubeLower[slots], self.cubeUpper[slots]) < inf]
+            cubes = self.order[slots]
+            rotations = field.rotations(cubes)
+            # The ray in each cube's own frame, where the cube is a box about the origin.
+            localOrigin = ((origin - field.positions[cubes])[:, None, :] @ rotations)[:, 0, :]
+            localDirection = direction @ rotations
+            localInverse = 1.0 / where(localDirection != 0.0, localDirection, 1e-30)
+            corner = full(3, HALFSIZE, 'f')
+            distances = rayBoxes(localOrigin, localInverse, -corner, corner)
+            if ((len(distances) == 0) or (distances.min() == inf)):
+                return (None, inf)
+            best = distances.argmin()
+            return (int(cubes[best]), float(distances[best]))
+
+    def nearest(self, field, point, count = 1):
+        """
+        The count cubes with centers nearest a point, nearest first,
+        as a list of (cube, distance).
+        """
+        with tracer.span("CubeBVH.nearest", {"count": count}):
+            point = array(point, 'f')
+            found = list()
+            heap = [(0.0, 0, 0)]
+            while ((len(heap) > 0) and (len(found) < count)):
+                (distance, kind, item) = heapq.heappop(heap)
+                if (kind == 1):
+                    found.append((int(item), float(sqrt(distance))))
+                elif (item >= self.first):
+                    # A leaf: queue its cubes by their true distance.
+                    slots = self.leafCubes(array([item - self.first]))
+                    offsets = field.positions[self.order[slots]] - point
+                    for (cube, squared) in zip(self.order[slots], (offsets * offsets).sum(axis=1)):
+                        heapq.heappush(heap, (float(squared), 1, cube))
+                else:
+                    children = array([2 * item + 1, 2 * item + 2])
+                    gap = maximum(maximum(self.lower[children] - point, point - self.upper[children]), 0.0)
+                    for (child, squared) in zip(children, (gap * gap).sum(axis=1)):
+                        if (squared < inf):
+                            heapq.heappush(heap, (float(squared), 0, int(child)))
+            return found
+
+    def inBox(self, lower, upper):
+        """
+        The cubes whose boxes overlap the box from lower to upper.
+        """
+        with tracer.span("CubeBVH.inBox"):
+            lower = array(lower, 'f')
+            upper = array(upper, 'f')
+            overlaps = lambda low, high: ((low <= upper) & (high >= lower)).all(axis=1)
+            slots = self.leafCubes(self.walk(overlaps))
+            slots = slots[overlaps(self.cubeLower[slots], self.cubeUpper[slots])]
+            return self.order[slots]
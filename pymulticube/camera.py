@@ -9,7 +9,8 @@
 from math import asin, sin, cos, fmod
 from glm import *
 from numpy import array, zeros
-from OpenGL.GLU import gluPerspective, gluLookAt
+from OpenGL.GLU import gluPerspective, gluLookAt, gluUnProject
+from pymulticube.tracer import tracer
 import os, sys
 class Camera:
     """ 
@@ -157,15 +158,7 @@ class Camera:
         """
         tmpVec = self.Position + self.Front
         self.Focus = tmpVec
-        if (self.debug1):
-            print("\n\t getGluViewMatrix() Vectors : Yaw:  ",
-            self.Yaw, "  Pitch:  ", self.Pitch,
-            " Position:  ", self.Position.x, ", ",
-            self.Position.y, ", ", self.Position.z,
-            " Focus:  ", self.Focus.x, ", ",
-            self.Focus.y, ", ", self.Focus.z,
-            " Front:  ", self.Front.x, ", ",
-            self.Front.y, ", ", self.Front.z)
+        tracer.event("Camera.setGluViewMatrix", self.traceVectors)
         gluLookAt(
             self.Position.x, self.Position.y, self.Position.z, 
             tmpVec.x, tmpVec.y, tmpVec.z, 
@@ -182,15 +175,7 @@ class Camera:
         Returns the LookAt Matrix using GLM.
         """
         tmpVec = self.Position + self.Front
-        if (self.debug1):
-            print("\n\t getViewMatrix() Vectors : Yaw:  ",
-            self.Yaw, "  Pitch:  ", self.Pitch,
-            " Position:  ", self.Position.x, ", ",
-            self.Position.y, ", ", self.Position.z,
-            " Focus:  ", self.Focus.x, ", ",
-            self.Focus.y, ", ", self.Focus.z,
-            " Front:  ", self.Front.x, ", ",
-            self.Front.y, ", ", self.Front.z)
+        tracer.event("Camera.getViewMatrix", self.traceVectors)
         tmpMat = lookAt(self.Position, tmpVec, self.Up)
         return self.mat4tonumpy(tmpMat)
     def getPerspective(self):
@@ -245,21 +230,11 @@ class Camera:
         Rotate the camera 180 degrees
         on the XZ plane.
         """
-        if (self.debug1):
-            print("\n\treverseDirection()  Yaw:  ", self.Yaw)
         self.Yaw += 180
         self.Yaw = fmod(self.Yaw, 360.0)
         if(isnan(self.Yaw)):
             self.Yaw = 0.
-        if (self.debug1):
-            print("\n\t reverseDirection() Vectors : Yaw:  ", 
-           self.Yaw, "  Pitch:  ", self.Pitch,
-           " Position:  ", self.Position.x, ", ", 
-           self.Position.y, ", ", self.Position.z,
-           " Focus:  ", self.Focus.x, ", ", 
-           self.Focus.y, ", ", self.Focus.z,
-           " Front:  ", self.Front.x, ", ", 
-           self.Front.y, ", ", self.Front.z)
+        tracer.event("Camera.reverseDirection", self.traceVectors)
         self.getFront()
         
     def processKeyboard(self, direction, deltaTime):
@@ -287,13 +262,19 @@ class Camera:
             self.Zoom -= 1.0
         elif (direction == self.Camera_Movement.index("AWAY")):
             self.Zoom += 1.0
-        if (self.debug1):
-            print("\n\tprocessKeyboard() : self.Position:  ", self.Position.x, ", ", 
-            self.Position.y, ", ", self.Position.z, " Zoom:  ",
-            self.Zoom, "  Right:  ", self.Right.x, ", ",
-            self.Right.y, ", ", self.Right.z) 
+        tracer.event("Camera.processKeyboard", self.traceVectors)
         self.Focus = self.Position + self.Front
 
+    def processMovement(self, forward, right, up, deltaTime):
+        """ 
+        Move the camera along several directions at once, as held
+        keys do: forward, right and up are the amounts along the
+        Front, Right and Up vectors, negative for back, left and down.
+        """
+        velocity = abs(self.MovementSpeed * deltaTime)
+        self.Position += (self.Front * forward + self.Right * right + self.Up * up) * velocity
+        tracer.event("Camera.processMovement", self.traceVectors)
+        self.Focus = self.Position + self.Front
     
     def processMouseMovement(self, xoffset, yoffset):
         """ 
@@ -303,18 +284,12 @@ class Camera:
         """
         xoffset *= self.MouseSensitivity
         yoffset *= self.MouseSensitivity
-        if (self.debug1):
-            print("\n\tMouse Offset Before x, y:  ", xoffset, 
-            ", ", yoffset, " Yaw:  ", self.Yaw, 
-            " Pitch:  ", self.Pitch)
         self.Yaw   += xoffset
         self.Pitch -= yoffset
         self.Yaw = fmod(self.Yaw, 180.0)
         self.Pitch  = fmod(self.Pitch, 90.0)
-        if (self.debug1):
-            print("\n\tMouse Offset After x, y:  ", xoffset, 
-            ", ", yoffset, " Yaw:  ", self.Yaw, 
-            " Pitch:  ", self.Pitch)
+        tracer.event("Camera.processMouseMovement", lambda: {"xoffset": xoffset, 
+            "yoffset": yoffset, "Yaw": self.Yaw, "Pitch": self.Pitch})
         #Update Front, Right and Up Vectors using the updated Euler angles
         self.getFront()
         
@@ -332,6 +307,13 @@ class Camera:
         if(self.Zoom >= 90.0):
             self.Zoom = 90.0
         
+    def processZoom(self, amount):
+        """ 
+        Change the zoom by a number of degrees, within the
+        limits processMouseScroll() keeps.
+        """
+        self.Zoom = min(max(self.Zoom + amount, 1.0), 90.0)
+        
     def getEulerAngles(self):
         """ 
         Calculates the Euler angles from the front vector.
@@ -347,15 +329,7 @@ class Camera:
             self.Yaw = degrees(acos(xzVec.z)) - 180.0
         else:
             self.Yaw = -(degrees(acos(xzVec.z)) - 180.0)
-        if (self.debug1):
-            print("\n\t getEulerAngles() Vectors : Yaw:  ",
-            self.Yaw, "  Pitch:  ", self.Pitch,
-            " Position:  ", self.Position.x, ", ",
-            self.Position.y, ", ", self.Position.z,
-            " Focus:  ", self.Focus.x, ", ",
-            self.Focus.y, ", ", self.Focus.z,
-            " Front:  ", self.Front.x, ", ",
-            self.Front.y, ", ", self.Front.z)
+        tracer.event("Camera.getEulerAngles", self.traceVectors)
         
     def getFront(self):
         """ 
@@ -370,19 +344,65 @@ class Camera:
         # Also re-calculate the Right and Up vector
         self.Right = normalize(self.crossProduct(self.Front, self.WorldUp))  # Normalize the vectors.
         self.Up    = normalize(self.crossProduct(self.Right, self.Front))
-        if (self.debug1):
-            print("\n\tgetFront() Vectors : Yaw:  ",
-            self.Yaw, "  Pitch:  ", self.Pitch,
-            " Position:  ", self.Position.x, ", ",
-            self.Position.y, ", ", self.Position.z,
-            " Focus:  ", self.Focus.x, ", ",
-            self.Focus.y, ", ", self.Focus.z,
-            " Front:  ", self.Front.x, ", ",
-            self.Front.y, ", ", self.Front.z,
-            " Up:  ", self.Up.x, ", ",
-            self.Up.y, ", ", self.Up.z,
-            " Right ", self.Right.x, ", ",
-            self.Right.y, ", ", self.Right.z)
+        tracer.event("Camera.getFront", self.traceVectors)
+
+    def mouseRay(self, x, y, modelview, projection):
+        """
+        The ray through a window position, as origin and unit
+        direction tuples, for picking.  The position is unprojected
+        at the near and far planes through the modelview and
+        projection matrices the cubes were drawn with, which need
+        not be the look at view of setGluViewMatrix().
+        """
+        viewport = (0, 0, self.Width, self.Height)
+        # Window rows count down from the top, OpenGL's up from the bottom.
+        row = self.Height - y
+        near = vec3(*gluUnProject(x, row, 0.0, modelview, projection, viewport))
+        far = vec3(*gluUnProject(x, row, 1.0, modelview, projection, viewport))
+        direction = normalize(far - near)
+        return ((near.x, near.y, near.z), (direction.x, direction.y, direction.z))
+
+    def tileBounds(self, x, y, tileWidth, tileHeight, width, height, near = 0.1, far = 10000.0):
+        """
+        The frustum bounds, as (right, left, bottom, top, near, far)
+        for CubeMaker.createFrustum(), of one tile of a picture width
+        by height pixels, the tile's lower left corner x, y pixels
+        from the picture's lower left.  The tiles side by side make
+        the view setGluPerspective() gives for the whole picture.
+        """
+        top = near * tan(radians(self.Zoom) * 0.5)
+        right = top * width / height
+        return (-right + 2.0 * right * (x + tileWidth) / width, -right + 2.0 * right * x / width,
+            -top + 2.0 * top * y / height, -top + 2.0 * top * (y + tileHeight) / height, near, far)
+
+    def getState(self):
+        """
+        The position, focus and zoom as a dictionary of plain
+        values, for saving the view.
+        """
+        return {"position": [self.Position.x, self.Position.y, self.Position.z],
+            "focus": [self.Focus.x, self.Focus.y, self.Focus.z], "zoom": self.Zoom}
+
+    def setState(self, state):
+        """
+        Restore a view saved with getState().
+        """
+        self.Position = vec3(*state["position"])
+        self.Focus = vec3(*state["focus"])
+        self.Zoom = state["zoom"]
+        self.getEulerAngles()
+
+    def traceVectors(self):
+        """
+        The camera state as a dictionary for the tracer.  It is 
+        passed uncalled so it only runs when a subscriber listens.
+        """
+        state = {"Yaw": self.Yaw, "Pitch": self.Pitch, "Zoom": self.Zoom}
+        for name in ("Position", "Focus", "Front", "Up", "Right"):
+            value = getattr(self, name)
+            if (value is not None):
+                state[name] = [value.x, value.y, value.z]
+        return state
 
     def mat4tonumpy(self, value):
         """ 
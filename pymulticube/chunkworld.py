@@ -0,0 +1,197 @@
+"""
+**********************************************************
+* ChunkWorld:  A class to fill endless space with cubes.
+* Space is cut into chunks the size of the scene's volume,
+* and each chunk is laid out like the scene, from a seed
+* made of the world's seed and the chunk's coordinates, so
+* a chunk looks the same every time it is made.  The chunks
+* around the camera are made on worker threads as it comes
+* near, the chunks it leaves are kept in a cache of a fixed
+* size and the least recently used are dropped, so the
+* memory and the cubes drawn stay the same however far the
+* camera goes.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from numpy import array, concatenate, floor, int64
+from numpy.random import SeedSequence, default_rng
+from pymulticube.cubefield import CubeField
+from pymulticube.scene import layCubes
+from pymulticube.tracer import tracer
+
+CHUNKOFFSET = 1 << 31
+# Added to the chunk coordinates so they seed as whole numbers of at least zero.
+
+
+class ChunkWorld:
+    """
+    ChunkWorld:  Call prime() with the starting camera position and
+    the CubeField to fill, then update() with the camera position
+    every frame and compose() when it returns True.
+    """
+    reach = 1
+    # The chunks drawn on each side of the camera's chunk.
+    capacity = 64
+    # The most chunks kept, drawn or not.
+    workers = 2
+    # The threads making chunks.
+    origin = None
+    # The lowest corner of chunk (0, 0, 0).
+    chunkSize = None
+    # The size of a chunk along each axis.
+    count = 0
+    # The cubes in each chunk.
+    seed = 0
+    # The world's seed, every chunk's seed starts with it.
+    chunks = None
+    # The chunks made, by coordinates, least recently wanted first.
+    pending = None
+    # The chunks being made, by coordinates, as futures.
+    drawn = None
+    # The coordinates of the chunks in the field, in field order.
+    offsets = None
+    # The steps from the camera's chunk to the chunks drawn, nearest first.
+    wanted = None
+    # The coordinates of the chunks around the camera, nearest first.
+    centerChunk = None
+    # The chunk the camera was in at the last update().
+    made = 0
+    # The number of chunks made.
+    dropped = 0
+    # The number of chunks dropped from the cache.
+
+    def __init__(self, center, size, count, pictures, spacing = 1.5, spin = (0.0, 2.0),
+            seed = None, reach = 1, capacity = 64):
+        """
+        Chunk (0, 0, 0) is the volume of a center and size, and each
+        chunk holds count cubes at least spacing apart, showing the
+        pictures 1 to pictures, spinning at rates within spin.
+        Without a seed the world is new each run.
+        """
+        self.chunkSize = array(size, 'f')
+        self.origin = array(center, 'f') - self.chunkSize * 0.5
+        self.count = count
+        self.pictures = pictures
+        self.spacing = spacing
+        self.spin = spin
+        if (seed is None):
+            seed = int(default_rng().integers(1 << 62))
+        self.seed = seed
+        self.reach = reach
+        # The cache must hold the chunks drawn and those still being made.
+        self.capacity = max(capacity, (2 * reach + 1) ** 3 + self.workers)
+        span = range(-reach, reach + 1)
+        self.offsets = sorted(((dx, dy, dz) for dx in span for dy in span for dz in span),
+            key=lambda offset: offset[0] * offset[0] + offset[1] * offset[1] + offset[2] * offset[2])
+        self.chunks = OrderedDict()
+        self.pending = dict()
+        self.drawn = list()
+        self.wanted = list()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chunks")
+
+    def chunkOf(self, position):
+        """
+        The coordinates of the chunk holding a position.
+        """
+        point = array((position[0], position[1], position[2]), 'f')
+        return tuple(int(value) for value in floor((point - self.origin) / self.chunkSize).astype(int64))
+
+    def makeChunk(self, key):
+        """
+        Lay out the cubes of a chunk, the same for the same world
+        seed and coordinates.  Runs on a worker thread.
+        """
+        with tracer.span("ChunkWorld.makeChunk", {"chunk": str(key)}):
+            rng = default_rng(SeedSequence([self.seed] + [value + CHUNKOFFSET for value in key]))
+            center = self.origin + (array(key, 'f') + 0.5) * self.chunkSize
+            return layCubes(rng, center, self.chunkSize, self.count, self.spacing,
+                self.spin[0], self.spin[1], self.pictures)
+
+    def around(self, key):
+        """
+        The coordinates of the chunks within reach of a chunk,
+        nearest first.
+        """
+        return [(key[0] + dx, key[1] + dy, key[2] + dz) for (dx, dy, dz) in self.offsets]
+
+    def keep(self, key, field):
+        """
+        Put a made chunk in the cache, dropping the least recently
+        wanted chunks past the capacity.
+        """
+        self.chunks[key] = field
+        self.chunks.move_to_end(key)
+        self.made += 1
+        while (len(self.chunks) > self.capacity):
+            self.chunks.popitem(last=False)
+            self.dropped += 1
+
+    def prime(self, position, field):
+        """
+        Make the chunks around a position at once and fill the field
+        with them, for the first frame.
+        """
+        self.centerChunk = self.chunkOf(position)
+        self.wanted = self.around(self.centerChunk)
+        for key in self.wanted:
+            if (key not in self.chunks):
+                self.keep(key, self.makeChunk(key))
+        self.compose(field)
+
+    def update(self, position):
+        """
+        Ask for the chunks around the camera, taking in the chunks
+        made since the last frame.  Returns True when the chunks to
+        draw have changed and compose() should be called.
+        """
+        key = self.chunkOf(position)
+        if (key != self.centerChunk):
+            self.centerChunk = key
+            self.wanted = self.around(key)
+            wanted = set(self.wanted)
+            # Chunks left behind before they were started are not made.
+            for (waiting, future) in list(self.pending.items()):
+                if ((waiting not in wanted) and (future.cancel())):
+                    del self.pending[waiting]
+        for (waiting, future) in list(self.pending.items()):
+            if (future.done()):
+                del self.pending[waiting]
+                if (not future.cancelled()):
+                    self.keep(waiting, future.result())
+        for key in self.wanted:
+            if (key in self.chunks):
+                self.chunks.move_to_end(key)
+            elif (key not in self.pending):
+                self.pending[key] = self.executor.submit(self.makeChunk, key)
+        tracer.count("chunksKept", len(self.chunks))
+        return [key for key in self.wanted if (key in self.chunks)] != self.drawn
+
+    def compose(self, field):
+        """
+        Fill the field with the chunks around the camera that are
+        made.  The field's angles must be up to date, they are kept
+        with the chunks so the cubes spin on without a jump.
+        """
+        with tracer.span("ChunkWorld.compose", {"chunks": len(self.wanted)}):
+            if (field.count == len(self.drawn) * self.count):
+                for (place, key) in enumerate(self.drawn):
+                    if (key in self.chunks):
+                        self.chunks[key].angles[:] = field.angles[place * self.count:(place + 1) * self.count]
+            self.drawn = [key for key in self.wanted if (key in self.chunks)]
+            parts = [self.chunks[key] for key in self.drawn]
+            if (len(parts) == 0):
+                parts = [CubeField(0)]
+            field.setArrays(concatenate([part.positions for part in parts]),
+                concatenate([part.xaxes for part in parts]),
+                concatenate([part.yaxes for part in parts]),
+                concatenate([part.angles for part in parts]),
+                concatenate([part.indices for part in parts]))
+
+    def close(self):
+        """
+        Stop making chunks.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
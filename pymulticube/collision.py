@@ -0,0 +1,117 @@
+"""
+**********************************************************
+* CameraCollider:  A class to keep the camera out of the
+* cubes.  The camera is a small sphere; after it moves, the
+* cubes near it are found through a SpatialGrid and the
+* sphere is pushed out of each turned cube it overlaps,
+* found by the closest point of the cube to the sphere's
+* center.  Only the few cubes near the camera are tested, so
+* the cost per frame stays the same for any number of cubes.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from glm import vec3
+from numpy import abs as absolute, arange, argmin, array, clip, flatnonzero, sqrt, where, zeros
+from pymulticube.spatialgrid import SpatialGrid
+from pymulticube.tracer import tracer
+
+HALFSIZE = 0.5
+# Half the edge of a cube, as CubeMaker builds it.
+
+
+def spherePushes(center, radius, positions, rotations):
+    """
+    The moves that take a sphere out of each of a set of turned
+    cubes, shape (n, 3), zero for the cubes it does not touch.
+    rotations take each cube's own frame to the world.
+    """
+    # The sphere's center in each cube's frame.
+    local = ((center - positions)[:, None, :] @ rotations)[:, 0, :]
+    closest = clip(local, -HALFSIZE, HALFSIZE)
+    outward = local - closest
+    distance = sqrt((outward * outward).sum(axis=1))
+    depth = radius - distance
+    push = outward * (depth / where(distance > 0.0, distance, 1.0))[:, None]
+    # A center inside a cube leaves through the nearest face.
+    inside = distance == 0.0
+    if (inside.any()):
+        rows = flatnonzero(inside)
+        room = HALFSIZE - absolute(local[rows])
+        axis = argmin(room, axis=1)
+        each = arange(len(rows))
+        facePush = zeros((len(rows), 3), 'f')
+        facePush[each, axis] = where(local[rows, axis] < 0.0, -1.0, 1.0) * (room[each, axis] + radius)
+        push[rows] = facePush
+    push[depth <= 0.0] = 0.0
+    # Back into the world frame.
+    return (rotations @ push[:, :, None])[:, :, 0]
+
+
+class CameraCollider:
+    """
+    CameraCollider:  Call resolve() after the camera moves each
+    frame to push it back out of any cube.
+    """
+    radius = 0.4
+    # The radius of the camera's sphere.
+    passes = 3
+    # The push passes, for a camera wedged between cubes.
+    grid = None
+    # The grid of the cube centers.
+    builtVersion = -1
+    # The CubeField version the grid was built for.
+    builtPositions = None
+    # The positions array the grid was built for.
+    contacts = 0
+    # The cubes pushed against in the last resolve().
+
+    def __init__(self, radius = 0.4):
+        """
+        Set the camera's radius.  A cell is as wide as the farthest
+        a cube's center can be from a sphere touching it, so a query
+        looks at no more than eight cells.
+        """
+        self.radius = radius
+        self.grid = SpatialGrid(HALFSIZE * 3.0 ** 0.5 + radius)
+
+    def update(self, field):
+        """
+        Rebuild the grid if the cubes were replaced.
+        """
+        if ((field.version != self.builtVersion) or (field.positions is not self.builtPositions)):
+            self.grid.build(field.positions)
+            self.builtVersion = field.version
+            self.builtPositions = field.positions
+
+    def resolve(self, camera, field, steps = 0.):
+        """
+        Push the camera out of the cubes it overlaps.  steps is the
+        animation the field's angles are behind, as with the shader.
+        Returns True if the camera was moved.
+        """
+        self.update(field)
+        position = camera.getPosition()
+        center = array((position.x, position.y, position.z), 'f')
+        reach = HALFSIZE * 3.0 ** 0.5 + self.radius
+        self.contacts = 0
+        moved = False
+        with tracer.span("CameraCollider.resolve"):
+            for attempt in range(self.passes):
+                # A push may carry the camera into cubes that were out of
+                # reach before, so the grid is asked again at each pass.
+                rows = self.grid.near(center, reach)
+                if (len(rows) == 0):
+                    break
+                pushes = spherePushes(center, self.radius, field.positions[rows],
+                    field.rotations(rows, steps))
+                touching = (pushes != 0.0).any(axis=1)
+                if (not touching.any()):
+                    break
+                self.contacts = max(self.contacts, int(touching.sum()))
+                center = center + pushes.sum(axis=0)
+                moved = True
+        if (moved):
+            tracer.event("CameraCollider.push", lambda: {"contacts": self.contacts})
+            camera.setPosition(vec3(float(center[0]), float(center[1]), float(center[2])))
+        return moved
@@ -0,0 +1,99 @@
+"""
+**********************************************************
+* Compositor:  A class to blend foreground pictures over a
+* background with numpy.  Each foreground is stretched or
+* letterboxed to the background size.  The default "over"
+* mode is the PIL Image.alpha_composite() method, and the
+* multiply, screen, add, darken and lighten modes blend the
+* colors before compositing, a whole batch of foregrounds
+* in one pass over a stacked array.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from PIL import Image
+from numpy import asarray, clip, empty, float32, maximum, minimum, stack, uint8
+
+# The separable blend functions of the colors, in the range 0 to 1.
+BLENDMODES = {
+    "multiply": lambda back, fore: back * fore,
+    "screen": lambda back, fore: back + fore - back * fore,
+    "add": lambda back, fore: minimum(back + fore, 1.0),
+    "darken": lambda back, fore: minimum(back, fore),
+    "lighten": lambda back, fore: maximum(back, fore),
+}
+
+
+def fitImage(image, size, fit = "stretch"):
+    """
+    Make an RGBA PIL image the given (width, height) size.  With fit
+    "stretch" it is resized to the size, with "letterbox" it is scaled
+    to fit inside and centered on a transparent border.
+    """
+    if (image.size == tuple(size)):
+        return image
+    if (fit == "letterbox"):
+        scale = min(size[0] / image.width, size[1] / image.height)
+        inner = (max(int(round(image.width * scale)), 1), max(int(round(image.height * scale)), 1))
+        canvas = Image.new("RGBA", tuple(size), (0, 0, 0, 0))
+        canvas.paste(image.resize(inner, Image.LANCZOS),
+            ((size[0] - inner[0]) // 2, (size[1] - inner[1]) // 2))
+        return canvas
+    return image.resize(tuple(size), Image.LANCZOS)
+
+
+def blendOver(back, fore, mode):
+    """
+    Composite uint8 RGBA arrays with a separable blend mode: where
+    both are opaque the colors are mode(back, fore), and the alpha
+    follows the "over" rule.  Computed in floating point.
+    """
+    back = back.astype(float32) / 255.0
+    fore = fore.astype(float32) / 255.0
+    backa = back[..., 3:4]
+    forea = fore[..., 3:4]
+    blended = BLENDMODES[mode](back[..., 0:3], fore[..., 0:3])
+    # The premultiplied colors of the three regions.
+    color = (forea * (1.0 - backa) * fore[..., 0:3] + forea * backa * blended
+        + (1.0 - forea) * backa * back[..., 0:3])
+    alpha = forea + backa * (1.0 - forea)
+    color = color / maximum(alpha, 1e-6)
+    result = empty(color.shape[0:-1] + (4,), uint8)
+    result[..., 0:3] = clip(color * 255.0 + 0.5, 0, 255)
+    result[..., 3:4] = clip(alpha * 255.0 + 0.5, 0, 255)
+    return result
+
+
+class Compositor:
+    """
+    Compositor:  Blends lists of foreground pictures over one
+    background picture and returns the results as a stacked
+    (images, height, width, 4) numpy byte array.
+    """
+    mode = "over"
+    # The blend mode, "over" or a key of BLENDMODES.
+    fit = "stretch"
+    # How foregrounds are sized to the background, "stretch" or "letterbox".
+
+    def __init__(self, mode = "over", fit = "stretch"):
+        """
+        Set the blend mode and the fit.
+        """
+        if ((mode != "over") and (mode not in BLENDMODES)):
+            raise ValueError("Unknown blend mode " + str(mode) + ".")
+        self.mode = mode
+        self.fit = fit
+
+    def composite(self, background, foregrounds):
+        """
+        Blend RGBA PIL images over an RGBA PIL background in one batch.
+        """
+        fitted = [fitImage(image, background.size, self.fit) for image in foregrounds]
+        if (self.mode == "over"):
+            # PIL blends one picture several times quicker than the same
+            # integer math over a stacked numpy batch, so it is kept here.
+            return stack([asarray(Image.alpha_composite(background, image), uint8)
+                for image in fitted])
+        back = asarray(background, uint8)
+        fore = stack([asarray(image, uint8) for image in fitted])
+        return blendOver(back[None], fore, self.mode)
@@ -16,7 +16,10 @@
 from PIL import Image
 import sys, os
 from OpenGL.GL import *
-from numpy import zeros, array
+from numpy import zeros, array, asarray
+from pymulticube.tracer import tracer
+from pymulticube.imagecache import imageCache
+from pymulticube.compositor import Compositor
 
 class CreateImage:
     """ 
@@ -36,6 +39,10 @@ class CreateImage:
     # Image data.
     debug1 = False
     # Debug flag.
+    cache = imageCache
+    # The decoded image cache, shared with every other user.
+    compositor = Compositor()
+    # The blend mode and fit for the double images.
     
     def __init__(self):
         """ 
@@ -61,51 +68,93 @@ class CreateImage:
         if (self.debug1):
             print("\n\tType of textureID ", type(textureID), " with size ", 
             len(textureID), "\n")
-        # The PIL Image loads a standard picture.
-        tmpImage1 = Image.open(imagearray[0])
-        if (not tmpImage1):
-            print("\n\tImage file ", imagearray[0], " failed to load in createimage.")
-        else:
-            print("\n\tImage file ", imagearray[0], " successfully loaded.")
-        self.size = 0
         # Convert the image to four 8 bit fields RGBA.
-        txtImage1 = tmpImage1.convert("RGBA")
+        txtImage1 = self.loadImage(imagearray[0])
+        self.size = 0
+        # Composite the whole batch at once, then upload each image.
+        with tracer.span("CreateImage.decode", {"files": len(imagearray) - 1}):
+            foregrounds = [self.loadImage(imagearray[x], ("rotate", 180))
+                for x in range(len(imagearray) - 1)]
+            batch = self.compositor.composite(txtImage1, foregrounds)
+        (self.height, self.width) = batch.shape[1:3]
         for x in range(len(imagearray) - 1):
-            self.pixels = None
-            # The PIL Image loads a standard picture.
-            tmpImage2 = Image.open(imagearray[x])
-            if (not tmpImage2):
-                print("\n\tImage file ", imagearray[x], " failed to load in createimage.")
-            else:
-                print("\n\tImage file ", imagearray[x], " successfully loaded.")
-            self.size = 0
-            # Convert image to four 8 bit fields RGBA.
-            txtImage2 = tmpImage2.convert("RGBA")
-            tmpImage2 = txtImage2.rotate(180)
-            # Combine the two images using the alpha_composite method.
-            finalImage = Image.alpha_composite(txtImage1, tmpImage2)
-            if (self.debug1):
-                # View the result.
-                finalImage.save("blendImage.png")
-            (self.width, self.height) = finalImage.size
-            # Load the image into a byte array.
-            tmpdata = list(finalImage.getdata())
-            self.pixels = array(tmpdata, "byte")
-            # Bind the texture ID and load texture data 
-            glBindTexture(GL_TEXTURE_2D, textureID[x])
-            glPixelStorei(GL_UNPACK_ALIGNMENT,1)
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, self.pixels)
-            glGenerateMipmap(GL_TEXTURE_2D)    
-            #  Parameters
-            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT )
-            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT )
-            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR )
-            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-            glBindTexture(GL_TEXTURE_2D, 0)
-            if (self.debug1):
-                print("\n\tDouble Image texture ID", textureID)
+            self.pixels = batch[x]
+            with tracer.span("CreateImage.upload", {"textureID": textureID[x]}):
+                self.uploadTexture(textureID[x], self.width, self.height, self.pixels)
+        tracer.event("CreateImage.doubleImage", {"textureID": textureID})
         return textureID
 
+    def loadImage(self, filename, transform = None):
+        """
+        Load a picture with PIL and convert it to four 8 bit fields RGBA,
+        through the image cache.  The optional transform is a PIL Image
+        method name and arguments, as ("rotate", 180).  The image is
+        shared with the cache and must not be changed in place.
+        """
+        return self.cache.get(filename, "RGBA", transform)
+
+    def compositeImage(self, background, filename):
+        """
+        Combine a picture, turned 180 degrees, with an RGBA background
+        image as doubleImage() does.  Returns the width, the height and
+        the pixels as a numpy byte array.  It does not touch the OpenGL
+        state, so it may run on any thread.
+        """
+        # Convert image to four 8 bit fields RGBA.
+        tmpImage2 = self.loadImage(filename, ("rotate", 180))
+        # Combine the two images, fitting the picture to the background.
+        pixels = self.compositor.composite(background, [tmpImage2])[0]
+        if (self.debug1):
+            # View the result.
+            Image.fromarray(pixels, "RGBA").save("blendImage.png")
+        (width, height) = background.size
+        return (width, height, pixels)
+
+    def uploadTexture(self, textureID, width, height, pixels, maxLevel = None):
+        """
+        Load RGBA pixels into a mipmapped 2D texture.  The optional
+        maxLevel limits the mipmap levels used, as an atlas needs.
+        """
+        # Bind the texture ID and load texture data 
+        glBindTexture(GL_TEXTURE_2D, textureID)
+        glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        glGenerateMipmap(GL_TEXTURE_2D)    
+        #  Parameters
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        if (maxLevel is not None):
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, maxLevel)
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE )
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE )
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def uploadMipmaps(self, textureID, levels, maxLevel = None):
+        """
+        Load a mipmap chain built on the CPU, largest level first, into
+        a 2D texture in place of glGenerateMipmap.  The optional
+        maxLevel is applied as in uploadTexture().
+        """
+        glBindTexture(GL_TEXTURE_2D, textureID)
+        glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+        for level in range(len(levels)):
+            (height, width) = levels[level].shape[0:2]
+            glTexImage2D(GL_TEXTURE_2D, level, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, levels[level])
+        # Only the levels given are sampled.
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_BASE_LEVEL, 0)
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR )
+        glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        if (maxLevel is not None):
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, min(maxLevel, len(levels) - 1))
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE )
+            glTexParameteri( GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE )
+        glBindTexture(GL_TEXTURE_2D, 0)
+
     """
     Accessor functions for the given image's dimensions and data.
     """
@@ -173,35 +222,62 @@ class CreateImage:
         """
         if (self.debug1):
             print("\n\tIn createSkyBoxTex().\n")
+         # Six images, one texture ID.
+        faces = list()
+        for i in range(6):
+            faces.append(self.skyBoxFace(filenames[i], i))
+        return self.uploadSkyBox(index, faces)
+
+    def skyBoxFace(self, filename, i):
+        """
+        Load face i of a sky box as a 512 by 512 RGBA numpy byte array,
+        or None if it fails to load.  It does not touch the OpenGL state.
+        """
+        txtImage = Image.open(filename)
+        if (not txtImage):
+            print("\n\tImage load failure for image ", filename,
+            "Only a partial load is present.")
+            return None
+        else:
+            print("\n\tLoaded sky box image: ", filename, ".")
+        # Align the ceiling and the floor.
+        if (i == 2):
+            tmpImage = txtImage.rotate(90)
+            txtImage = tmpImage
+        if (i == 3):
+            tmpImage = txtImage.rotate(-90)
+            txtImage = tmpImage
+        tmpImage = txtImage.transpose(Image.FLIP_LEFT_RIGHT)
+        txtImage = tmpImage.convert("RGBA")
+        tmpImage = txtImage.resize((512,512))
+        if (self.debug1):
+            print("\n\tImage size: ", tmpImage.size[0], ",", tmpImage.size[1], "\n")
+        return asarray(tmpImage, "uint8")
+
+    def uploadSkyBox(self, index, faces):
+        """
+        Load six face arrays, in the order given for createSkyBoxTex(),
+        into a cube map texture.  Faces that are None are skipped.  A
+        face may also be a list of mipmap levels built on the CPU, in
+        which case every face must be, and glGenerateMipmap is skipped.
+        """
         textureID = index
         glBindTexture(GL_TEXTURE_CUBE_MAP, textureID)
         glPixelStorei(GL_UNPACK_ALIGNMENT,1)
-         # Six images, one texture ID.
+        chained = None
         for i in range(6):
-            txtImage = Image.open(filenames[i])
-            if (not txtImage):
-                print("\n\tImage load failure for image ", filenames[i],
-                "Only a partial load is present.")
+            if (faces[i] is None):
                 continue
-            else:
-                print("\n\tLoaded sky box image: ", filenames[i], ".")
-            # Align the ceiling and the floor.
-            if (i == 2):
-                tmpImage = txtImage.rotate(90)
-                txtImage = tmpImage
-            if (i == 3):
-                tmpImage = txtImage.rotate(-90)
-                txtImage = tmpImage
-            tmpImage = txtImage.transpose(Image.FLIP_LEFT_RIGHT)
-            txtImage = tmpImage.convert("RGBA")
-            tmpImage = txtImage.resize((512,512))
-            tmpdata = list(tmpImage.getdata())
-            self.pixels = array(tmpdata, "byte")
-            (self.width, self.height) = tmpImage.size
-            if (self.debug1):
-                print("\n\tImage size: ", self.width, ",", self.height, "\n")
-            glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGBA, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, self.pixels)
-        glGenerateMipmap(GL_TEXTURE_CUBE_MAP)    
+            levels = faces[i] if isinstance(faces[i], list) else [faces[i]]
+            chained = len(levels) if (chained is None) else min(chained, len(levels))
+            for level in range(len(levels)):
+                self.pixels = levels[level]
+                (self.height, self.width) = levels[level].shape[0:2]
+                glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, level, GL_RGBA, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, self.pixels)
+        if ((chained is not None) and (chained > 1)):
+            glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAX_LEVEL, chained - 1)
+        else:
+            glGenerateMipmap(GL_TEXTURE_CUBE_MAP)    
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
         glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
@@ -217,22 +293,19 @@ class CreateImage:
         using a provided file name list and a buffer handle.
         """
         textureID = index
-        count = 0
         glBindTexture(GL_TEXTURE_2D_ARRAY, textureID)
-        self.pixels = self.getData(filename[0])
-        # The overall data store.
-        pixel_data = zeros((size * len(filenames)), "byte")
-        for x in range(size):
-            pixel_data[count] = pixels[x]
-            count += 1
-        for i in range(1, len(filenames)):
+        # The overall data store, one layer per picture, each read through the image cache.
+        pixel_data = None
+        for i in range(len(filenames)):
             self.pixels = self.getData(filenames[i])
-            for x in range(size):
-                pixel_data[count] = pixels[x]
-                count += 1
+            if (pixel_data is None):
+                pixel_data = zeros((len(filenames), self.size), "uint8")
+            elif (len(self.pixels) * 4 != pixel_data.shape[1]):
+                raise ValueError("The picture " + filenames[i] + " is not the size of " + filenames[0] + ".")
+            pixel_data[i] = self.pixels.reshape(-1)
         if (self.debug1):
-            print("\n\n\tPixels loaded:  ", count, 
-            "  Pixels calculated:  ", len(filenames) * size, "\n\n")
+            print("\n\n\tPixels loaded:  ", pixel_data.size // 4,
+            "  Pixels calculated:  ", len(filenames) * self.width * self.height, "\n\n")
         glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_RGBA, self.width, self.height, len(filenames), 0, GL_RGBA, GL_UNSIGNED_BYTE, pixel_data)
         glGenerateMipmap(GL_TEXTURE_2D_ARRAY)
         glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
@@ -245,23 +318,14 @@ class CreateImage:
 
     def getData(self, filename):
         """
-        The PIL Image class loads standard picture
-        and it is returned as a numpy byte array.
+        The PIL Image class loads standard picture, through the image
+        cache, and it is returned as a numpy byte array of RGBA pixels.
         """
-        txtImage = Image.open(filename)
-        if (not txtImage):
-            print("\n\tImage file ", filename, " failed to load in createimage.")
-        else:
-            print("\n\tImage file ", filename, " successfully loaded.")
-        self.size = 0
         # Convert the image to four 8 bit fields RGBA.
-        tmpImage = txtImage.convert("RGBA")
+        tmpImage = self.loadImage(filename)
         # The image size in pixels.
         (self.width, self.height) = tmpImage.size
         # The overall image size in bytes.
         self.size = self.width * self.height * 4
         # Load the image into a numpy byte array.
-        tmpdata = list(tmpImage.getdata())
-        return array(tmpdata, "byte")
-        
-        
+        return asarray(tmpImage, "uint8").reshape(-1, 4)
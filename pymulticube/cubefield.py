@@ -0,0 +1,154 @@
+"""
+**********************************************************
+* CubeField:  A class to hold the location and orientation
+* data for every cube as numpy arrays, one row per cube, so
+* the animation and the vertex transformations can be done
+* for all the cubes at once.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from numpy import array, zeros, cos, sin, radians, fmod, einsum, sqrt, where
+
+
+class CubeField:
+    """
+    CubeField:  The cube data as numpy arrays.  Row i of each
+    array describes cube i.  The first two columns of angles are
+    the current rotation angles about xaxes and yaxes, the last
+    two are the increments per animation step, as in PosOrient.
+    """
+    count = 0
+    # The number of cubes.
+    positions = None
+    # The cube locations, shape (count, 3).
+    xaxes = None
+    # The first spin axis of each cube, normalized, shape (count, 3).
+    yaxes = None
+    # The second spin axis of each cube, normalized, shape (count, 3).
+    angles = None
+    # The angles and the angle increments, shape (count, 4).
+    indices = None
+    # The image index for each of the six faces, shape (count, 6).
+    version = 0
+    # Incremented whenever the set of cubes or their images change.
+    motion = 0
+    # Incremented whenever the cubes are moved.
+
+    def __init__(self, count = 0):
+        """
+        Create the arrays for a number of cubes.
+        """
+        self.resize(count)
+
+    def resize(self, count):
+        """
+        Replace the arrays with zeroed arrays for count cubes.
+        """
+        self.count = count
+        self.positions = zeros((count, 3), 'f')
+        self.xaxes = zeros((count, 3), 'f')
+        self.yaxes = zeros((count, 3), 'f')
+        self.angles = zeros((count, 4), 'f')
+        self.indices = zeros((count, 6), 'i')
+        self.version += 1
+
+    def setArrays(self, positions, xaxes, yaxes, angles, indices):
+        """
+        Use the given arrays, which may be memory mapped, in place
+        of the current ones.  They are not copied.
+        """
+        self.count = len(positions)
+        self.positions = positions
+        self.xaxes = xaxes
+        self.yaxes = yaxes
+        self.angles = angles
+        self.indices = indices
+        self.version += 1
+
+    def loadPosOrient(self, items):
+        """
+        Copy a list of PosOrient items into the arrays.  Each item's
+        angles array is replaced by a view of its row, so changes made
+        through either one are seen by the other.
+        """
+        self.resize(len(items))
+        for x in range(self.count):
+            item = items[x]
+            self.positions[x] = (item.locon.x, item.locon.y, item.locon.z)
+            self.xaxes[x] = (item.xaxis.x, item.xaxis.y, item.xaxis.z)
+            self.yaxes[x] = (item.yaxis.x, item.yaxis.y, item.yaxis.z)
+            self.angles[x] = item.angles
+            self.indices[x] = item.indices
+            item.angles = self.angles[x]
+        self.normalizeAxes()
+
+    def normalizeAxes(self):
+        """
+        Make the spin axes unit length, as glRotatef does.
+        """
+        for axes in (self.xaxes, self.yaxes):
+            length = sqrt((axes * axes).sum(axis=1, keepdims=True))
+            axes /= where(length > 0.0, length, 1.0)
+
+    def advance(self, steps = 1):
+        """
+        Advance every cube's rotation by a number of animation steps.
+        """
+        self.angles[:, :2] = fmod(self.angles[:, :2] + (steps * self.angles[:, 2:]), 360.0)
+
+    def viewDepths(self, origin, direction):
+        """
+        The distance of each cube along a view direction from an
+        origin, both given as three element sequences.
+        """
+        return (self.positions - array(origin, 'f')) @ array(direction, 'f')
+
+    def axisRotations(self, axes, degrees):
+        """
+        The rotation matrices for angles in degrees about unit
+        axes, one matrix per row, matching glRotatef.
+        """
+        theta = radians(degrees)
+        c = cos(theta)
+        s = sin(theta)
+        t = 1.0 - c
+        x = axes[:, 0]
+        y = axes[:, 1]
+        z = axes[:, 2]
+        result = zeros((len(axes), 3, 3), 'f')
+        result[:, 0, 0] = x * x * t + c
+        result[:, 0, 1] = x * y * t - z * s
+        result[:, 0, 2] = x * z * t + y * s
+        result[:, 1, 0] = y * x * t + z * s
+        result[:, 1, 1] = y * y * t + c
+        result[:, 1, 2] = y * z * t - x * s
+        result[:, 2, 0] = x * z * t - y * s
+        result[:, 2, 1] = y * z * t + x * s
+        result[:, 2, 2] = z * z * t + c
+        return result
+
+    def rotations(self, rows = None, steps = 0):
+        """
+        The current rotation of each cube, the xaxes rotation
+        followed by the yaxes rotation, shape (count, 3, 3).  With
+        an index array in rows only those cubes are worked out, and
+        steps gives the rotation that many animation steps ahead.
+        """
+        if (rows is None):
+            rows = slice(None)
+        angles = self.angles[rows]
+        if (steps):
+            angles = angles[:, :2] + (steps * angles[:, 2:])
+        return einsum('nij,njk->nik',
+            self.axisRotations(self.xaxes[rows], angles[:, 0]),
+            self.axisRotations(self.yaxes[rows], angles[:, 1]))
+
+    def transform(self, vertices):
+        """
+        Place a set of model space vertices, shape (v, 3), at
+        every cube.  Returns world space vertices, shape (count, v, 3).
+        """
+        result = einsum('nij,vj->nvi', self.rotations(), vertices)
+        result += self.positions[:, None, :]
+        return result
@@ -11,6 +11,7 @@
 import sys, os
 from glm import *
 from numpy import array, zeros
+from pymulticube.tracer import tracer
 
 class CubeMaker:
     """
@@ -88,7 +89,8 @@ class CubeMaker:
             columns = 8
             if (self.debug1):
                 print("\n\tNormals and textures.\n")
-        self.rotateMatrix()
+        with tracer.span("CubeMaker.createCube"):
+            self.rotateMatrix()
         if (self.debug1):
             print("\n\tCube size:  ", len(self.cube) * len(self.cube[0]), " compare to size:  ", 36 * columns, "\n")
             self.printCube()
@@ -130,18 +132,15 @@ class CubeMaker:
         
     def createFrustum(self, right, left, bottom, top, near, far):
         """
-        A convenience method to create a frustum matrix.
+        A convenience method to create a frustum matrix, the same
+        matrix glFrustum() makes.  GLM matrices are indexed by column.
         """
         frustumBase = mat4x4(1.0) 
-        frustumRow = vec4(0) 
-        frustumRow = vec4(near /(right - left), 0.0, (right + left) / (right - left), 0.0)
-        frustumBase[0] = frustumRow
-        frustumRow = vec4(0.0, (2.0 * near) / (top - bottom), (top + bottom) / (top - bottom), 0.0)
-        frustumBase[1] = frustumRow
-        frustumRow = vec4(0.0, 0.0, (near + far)/(near - far), (2.0 * near * far) / (near - far))
-        frustumBase[2] = frustumRow
-        frustumRow = vec4(0.0, 0.0, -1.0, 0.0)
-        frustumBase[3] = frustumRow
+        frustumBase[0] = vec4((2.0 * near) / (right - left), 0.0, 0.0, 0.0)
+        frustumBase[1] = vec4(0.0, (2.0 * near) / (top - bottom), 0.0, 0.0)
+        frustumBase[2] = vec4((right + left) / (right - left), (top + bottom) / (top - bottom), 
+            (near + far) / (near - far), -1.0)
+        frustumBase[3] = vec4(0.0, 0.0, (2.0 * near * far) / (near - far), 0.0)
         return frustumBase
 
     def rotateMatrix(self):
@@ -0,0 +1,259 @@
+"""
+**********************************************************
+* CubeShader:  A class to spin the cubes on the GPU.  The
+* place, spin axes, angles and spin rates of every cube are
+* uploaded once to a floating point texture, and a vertex
+* shader builds each cube's rotation from them and a time
+* uniform counted in animation steps.  Each frame the CPU
+* only sends the draw order of the faces, one number per
+* face, and draws each texture batch with one instanced call.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import ctypes
+from OpenGL.GL import *
+from numpy import arange, ascontiguousarray, zeros
+from pymulticube.tracer import tracer
+
+VERTEXSHADER = """
+#version 130
+const int ROWS = 4096;
+uniform vec3 corners[36];
+uniform vec2 uvs[36];
+uniform float ticks;
+uniform sampler2D cubeData;
+in float corner;
+in float item;
+out vec2 texcoord;
+
+// The rotation of glRotatef(degrees, axis) for a unit axis.
+mat3 rotation(vec3 axis, float degrees)
+{
+    float theta = radians(degrees);
+    float c = cos(theta);
+    float s = sin(theta);
+    float t = 1.0 - c;
+    return mat3(
+        axis.x * axis.x * t + c, axis.y * axis.x * t + axis.z * s, axis.x * axis.z * t - axis.y * s,
+        axis.x * axis.y * t - axis.z * s, axis.y * axis.y * t + c, axis.y * axis.z * t + axis.x * s,
+        axis.x * axis.z * t + axis.y * s, axis.y * axis.z * t - axis.x * s, axis.z * axis.z * t + c);
+}
+
+void main()
+{
+    int cube = int(item) / 6;
+    int face = int(item) - cube * 6;
+    ivec2 base = ivec2((cube / ROWS) * 10, cube - (cube / ROWS) * ROWS);
+    vec4 place = texelFetch(cubeData, base, 0);
+    vec4 first = texelFetch(cubeData, base + ivec2(1, 0), 0);
+    vec4 second = texelFetch(cubeData, base + ivec2(2, 0), 0);
+    vec4 rates = texelFetch(cubeData, base + ivec2(3, 0), 0);
+    vec4 rect = texelFetch(cubeData, base + ivec2(4 + face, 0), 0);
+    float anglex = mod(place.w + second.w * ticks, 360.0);
+    float angley = mod(first.w + rates.x * ticks, 360.0);
+    int index = face * 6 + int(corner);
+    vec3 world = rotation(first.xyz, anglex) * (rotation(second.xyz, angley) * corners[index]) + place.xyz;
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(world, 1.0);
+    texcoord = rect.xy + uvs[index] * (rect.zw - rect.xy);
+}
+"""
+# Texels per cube: place and x angle, x axis and y angle, y axis and
+# x rate, y rate, then the texture rectangle of each face.
+
+FRAGMENTSHADER = """
+#version 130
+uniform sampler2D picture;
+in vec2 texcoord;
+
+void main()
+{
+    gl_FragColor = texture(picture, texcoord);
+}
+"""
+
+
+def shadersSupported():
+    """
+    True if the current context has shaders and instanced drawing.
+    """
+    try:
+        return bool(glCreateShader) and bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor)
+    except Exception:
+        return False
+
+
+def compileShader(kind, source):
+    """
+    Compile one shader, raising RuntimeError with the log on failure.
+    """
+    shader = glCreateShader(kind)
+    glShaderSource(shader, source)
+    glCompileShader(shader)
+    if (not glGetShaderiv(shader, GL_COMPILE_STATUS)):
+        log = glGetShaderInfoLog(shader)
+        glDeleteShader(shader)
+        raise RuntimeError("Shader compile failed: " + str(log))
+    return shader
+
+
+class CubeShader:
+    """
+    CubeShader:  Call draw() in place of the vertex arrays with the
+    draw order and the texture batches from the RenderQueue, and
+    advance() once per frame in place of CubeField.advance().
+    """
+    ROWS = 4096
+    # The rows of the cube data texture, must match the vertex shader.
+    TEXELS = 10
+    # The texels per cube in the cube data texture.
+    SETTLE = 3600.0
+    # The steps after which draw() settles the angles, so rate times ticks stays exact in a float.
+    program = 0
+    # The shader program.
+    ticks = 0.0
+    # The animation steps taken since the cube data was uploaded.
+    builtVersion = -1
+    # The CubeField version in the cube data texture.
+    builtRects = None
+    # The atlas rectangles in the cube data texture.
+    builtMotion = -1
+    # The CubeField motion count in the cube data texture.
+
+    def __init__(self, vertices, texcoords):
+        """
+        Build the program for the (36, 3) cube vertices and (36, 2)
+        texture coordinates.  Raises RuntimeError if it fails.  A
+        current OpenGL context is required.
+        """
+        vertex = compileShader(GL_VERTEX_SHADER, VERTEXSHADER)
+        fragment = compileShader(GL_FRAGMENT_SHADER, FRAGMENTSHADER)
+        self.program = glCreateProgram()
+        glAttachShader(self.program, vertex)
+        glAttachShader(self.program, fragment)
+        # A per vertex array on attribute 0 keeps older drivers drawing.
+        glBindAttribLocation(self.program, 0, "corner")
+        glBindAttribLocation(self.program, 1, "item")
+        glLinkProgram(self.program)
+        glDeleteShader(vertex)
+        glDeleteShader(fragment)
+        if (not glGetProgramiv(self.program, GL_LINK_STATUS)):
+            log = glGetProgramInfoLog(self.program)
+            glDeleteProgram(self.program)
+            self.program = 0
+            raise RuntimeError("Shader link failed: " + str(log))
+        self.ticksLocation = glGetUniformLocation(self.program, "ticks")
+        glUseProgram(self.program)
+        glUniform3fv(glGetUniformLocation(self.program, "corners"), 36,
+            ascontiguousarray(vertices, 'f'))
+        glUniform2fv(glGetUniformLocation(self.program, "uvs"), 36,
+            ascontiguousarray(texcoords, 'f'))
+        glUniform1i(glGetUniformLocation(self.program, "picture"), 0)
+        glUniform1i(glGetUniformLocation(self.program, "cubeData"), 1)
+        glUseProgram(0)
+        (self.cornerBuffer, self.itemBuffer) = [int(name) for name in glGenBuffers(2)]
+        glBindBuffer(GL_ARRAY_BUFFER, self.cornerBuffer)
+        glBufferData(GL_ARRAY_BUFFER, arange(6, dtype='f'), GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.dataTexture = int(glGenTextures(1))
+        print("\n\tSpinning the cubes in a vertex shader.")
+
+    def advance(self, steps = 1):
+        """
+        Advance every cube's rotation by a number of animation steps.
+        """
+        self.ticks += steps
+
+    def settle(self, field):
+        """
+        Bring the field's angles up to date, for code that reads them,
+        and upload them again on the next draw.
+        """
+        field.advance(self.ticks)
+        self.ticks = 0.0
+        self.builtVersion = -1
+
+    def cubeData(self, field, uvRects = None):
+        """
+        The cube data texture contents, shape (rows, columns, 4).
+        """
+        columns = max((field.count + self.ROWS - 1) // self.ROWS, 1)
+        rows = min(max(field.count, 1), self.ROWS)
+        cubes = zeros((columns * rows, self.TEXELS, 4), 'f')
+        count = field.count
+        cubes[:count, 0, 0:3] = field.positions
+        cubes[:count, 0, 3] = field.angles[:, 0]
+        cubes[:count, 1, 0:3] = field.xaxes
+        cubes[:count, 1, 3] = field.angles[:, 1]
+        cubes[:count, 2, 0:3] = field.yaxes
+        cubes[:count, 2, 3] = field.angles[:, 2]
+        cubes[:count, 3, 0] = field.angles[:, 3]
+        if (uvRects is not None):
+            cubes[:count, 4:10] = uvRects[field.indices]
+        else:
+            cubes[:count, 4:10] = (0.0, 0.0, 1.0, 1.0)
+        # Cube c sits in row c % ROWS of column block c // ROWS.
+        return ascontiguousarray(cubes.reshape(columns, rows, self.TEXELS, 4)
+            .transpose(1, 0, 2, 3).reshape(rows, columns * self.TEXELS, 4))
+
+    def upload(self, field, uvRects = None):
+        """
+        Load the cube data texture, done once per set of cubes.
+        """
+        with tracer.span("CubeShader.upload", {"cubes": field.count}):
+            data = self.cubeData(field, uvRects)
+            glBindTexture(GL_TEXTURE_2D, self.dataTexture)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA32F, data.shape[1], data.shape[0], 0, GL_RGBA, GL_FLOAT, data)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glBindTexture(GL_TEXTURE_2D, 0)
+        self.builtVersion = field.version
+        self.builtMotion = field.motion
+        self.builtRects = uvRects
+
+    def draw(self, field, order, batches, uvRects = None):
+        """
+        Draw the face items in order, one instanced call per
+        (texture ID, first item, item count) batch.
+        """
+        if (self.ticks >= self.SETTLE):
+            self.settle(field)
+        if ((field.version != self.builtVersion) or (field.motion != self.builtMotion)
+                or (uvRects is not self.builtRects)):
+            self.upload(field, uvRects)
+        glUseProgram(self.program)
+        glUniform1f(self.ticksLocation, self.ticks)
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_2D, self.dataTexture)
+        glActiveTexture(GL_TEXTURE0)
+        glBindBuffer(GL_ARRAY_BUFFER, self.cornerBuffer)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 1, GL_FLOAT, GL_FALSE, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.itemBuffer)
+        glBufferData(GL_ARRAY_BUFFER, ascontiguousarray(order, 'f'), GL_STREAM_DRAW)
+        glEnableVertexAttribArray(1)
+        glVertexAttribDivisor(1, 1)
+        for (texture, first, count) in batches:
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glVertexAttribPointer(1, 1, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(first * 4))
+            glDrawArraysInstanced(GL_TRIANGLES, 0, 6, count)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glVertexAttribDivisor(1, 0)
+        glDisableVertexAttribArray(1)
+        glDisableVertexAttribArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glActiveTexture(GL_TEXTURE0)
+        glUseProgram(0)
+
+    def delete(self):
+        """
+        Release the program, the buffers and the texture.
+        """
+        if (self.program):
+            glDeleteProgram(self.program)
+            glDeleteBuffers(2, [self.cornerBuffer, self.itemBuffer])
+            glDeleteTextures([self.dataTexture])
+        self.program = 0
@@ -0,0 +1,205 @@
+"""
+**********************************************************
+* FrameCapture:  A class to record the frames drawn, as a
+* numbered set of PNG pictures or as a video made by an
+* encoder program such as ffmpeg.  Each frame is read into
+* one of a ring of pixel buffer objects, which the GPU fills
+* while the next frames are drawn, and is only mapped and
+* copied out when its buffer comes round again, so reading
+* back does not wait on the GPU.  The pictures are written,
+* or piped to the encoder, on a writer thread.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import ctypes
+import os
+import subprocess
+import threading
+from queue import Queue
+from OpenGL.GL import *
+from numpy import frombuffer
+from PIL import Image
+from pymulticube.tracer import tracer
+
+VIDEOTYPES = (".mp4", ".mkv", ".webm", ".mov", ".avi")
+# The file name endings recorded as a video rather than pictures.
+
+
+class FrameCapture:
+    """
+    FrameCapture:  Call capture() after drawing each frame, before
+    the buffers are swapped, resize() when the window changes size,
+    and finish() with the context still current to write out the
+    last frames.
+    """
+    RING = 3
+    # The pixel buffer objects, one being filled and two waiting.
+    QUEUED = 8
+    # The frames waiting for the writer before capture() waits.
+    target = None
+    # The directory of pictures or the video file.
+    width = 0
+    # The frame width in pixels.
+    height = 0
+    # The frame height in pixels.
+    fps = 30.0
+    # The frames per second of the recording.
+    process = None
+    # The encoder process, or None when writing pictures.
+    buffers = None
+    # The pixel buffer objects.
+    frames = 0
+    # The frames read so far.
+    first = 0
+    # The first frame read into the buffers at their current size.
+    written = 0
+    # The frames written by the writer thread.
+    waits = 0
+    # The times capture() waited for the writer.
+    closed = False
+    # True once the writer is stopped.
+
+    def __init__(self, target, width, height, fps = 30.0, encoder = "ffmpeg"):
+        """
+        Record frames of a width and height to a directory of
+        pictures, or to a video file through the encoder.  Raises
+        OSError if the directory or the encoder cannot be used.
+        A current OpenGL context is required.
+        """
+        self.target = target
+        self.width = width
+        self.height = height
+        self.fps = fps
+        if (os.path.splitext(target)[1].lower() in VIDEOTYPES):
+            # The rows come bottom up from OpenGL, the encoder flips them.
+            self.process = subprocess.Popen([encoder, "-loglevel", "error", "-y",
+                "-f", "rawvideo", "-pix_fmt", "rgba", "-s", str(width) + "x" + str(height),
+                "-r", str(fps), "-i", "-", "-vf", "vflip", "-pix_fmt", "yuv420p", target],
+                stdin=subprocess.PIPE)
+        else:
+            os.makedirs(target, exist_ok=True)
+        self.buffers = [int(buffer) for buffer in glGenBuffers(self.RING)]
+        self.allocate()
+        self.queue = Queue(self.QUEUED)
+        self.writer = threading.Thread(target=self.write, name="capture", daemon=True)
+        self.writer.start()
+        print("\n\tRecording", width, "x", height, "frames to", target,
+            "with " + encoder + "." if (self.process is not None) else "as PNG pictures.")
+
+    def allocate(self):
+        """
+        Size the buffers to hold a frame of the current size.
+        """
+        self.frameBytes = self.width * self.height * 4
+        for buffer in self.buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frameBytes, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def resize(self, width, height):
+        """
+        Record frames of a new size from now on.  The frames in the
+        buffers are handed on first, at the old size.  A video cannot
+        change size, so its recording is finished instead.
+        """
+        if ((self.closed) or ((width, height) == (self.width, self.height))):
+            return
+        if (self.process is not None):
+            print("\n\tThe window is now", width, "x", height, "and the video", self.width, "x",
+                self.height, ", so the recording stops.")
+            self.finish()
+            return
+        self.drain()
+        self.width = width
+        self.height = height
+        self.allocate()
+        self.first = self.frames
+
+    def capture(self):
+        """
+        Start reading the frame just drawn into the next buffer,
+        first handing on the frame that buffer was holding.
+        """
+        if (self.closed):
+            return
+        with tracer.span("FrameCapture.capture", {"frame": self.frames}):
+            slot = self.frames % self.RING
+            if (self.frames - self.first >= self.RING):
+                self.collect(slot)
+            glPixelStorei(GL_PACK_ALIGNMENT, 1)
+            glReadBuffer(GL_BACK)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+            # With a pack buffer bound the last argument is an offset and the call returns at once.
+            glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+            self.frames += 1
+
+    def collect(self, slot):
+        """
+        Copy the frame out of a buffer and queue it for the writer.
+        """
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        pointer = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        address = ctypes.cast(pointer, ctypes.c_void_p).value
+        pixels = frombuffer((ctypes.c_ubyte * self.frameBytes).from_address(address), 'B').copy()
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        if (self.queue.full()):
+            self.waits += 1
+            tracer.count("captureWaits", self.waits)
+        self.queue.put((pixels, self.width, self.height))
+
+    def write(self):
+        """
+        Thread body: write the queued frames in order until None.
+        """
+        while (True):
+            frame = self.queue.get()
+            if (frame is None):
+                break
+            (pixels, width, height) = frame
+            with tracer.span("FrameCapture.write", {"frame": self.written}):
+                if (self.process is not None):
+                    self.process.stdin.write(pixels.data)
+                else:
+                    # A negative stride turns the bottom up rows over.
+                    picture = Image.frombuffer("RGBA", (width, height), pixels,
+                        "raw", "RGBA", 0, -1)
+                    picture.save(os.path.join(self.target, "frame%06d.png" % self.written),
+                        compress_level=1)
+            self.written += 1
+
+    def drain(self):
+        """
+        Hand on the frames still in the buffers.
+        """
+        for frame in range(max(self.frames - self.RING, self.first), self.frames):
+            self.collect(frame % self.RING)
+        self.first = self.frames
+
+    def finish(self):
+        """
+        Hand on the frames still in the buffers, then close.
+        """
+        if (self.closed):
+            return
+        self.drain()
+        glDeleteBuffers(len(self.buffers), self.buffers)
+        self.close()
+
+    def close(self):
+        """
+        Stop the writer once the queued frames are written and let
+        the encoder finish the video.  Frames still in the buffers
+        are lost, finish() keeps them.
+        """
+        if (self.closed):
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+        if (self.process is not None):
+            self.process.stdin.close()
+            self.process.wait()
+        print("\n\tRecorded", self.written, "frames to", self.target, ".")
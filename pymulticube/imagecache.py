@@ -0,0 +1,117 @@
+"""
+**********************************************************
+* ImageCache:  A class to keep decoded pictures in memory
+* so an image used by many textures is decoded only once.
+* Images are kept by file name, color mode and transform,
+* the least recently used are dropped when the cache passes
+* its memory cap, and the cache may be shared by any number
+* of threads.  A thread asking for an image another thread
+* is decoding waits for that decode instead of repeating it.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import threading
+from collections import OrderedDict
+from PIL import Image
+from pymulticube.tracer import tracer
+
+
+class ImageCache:
+    """
+    ImageCache:  Call get() with a file name, a PIL mode and an
+    optional transform to receive a PIL image.  The images are
+    shared, so callers must not change them in place.
+    """
+    capBytes = 256 * 1024 * 1024
+    # The memory allowed for the decoded images.
+    usedBytes = 0
+    # The memory used by the decoded images.
+    hits = 0
+    # The number of requests served from the cache.
+    misses = 0
+    # The number of requests that decoded or transformed an image.
+
+    def __init__(self, capBytes = 256 * 1024 * 1024):
+        """
+        Set the memory cap.
+        """
+        self.capBytes = capBytes
+        self.lock = threading.Lock()
+        # The images, least recently used first.
+        self.images = OrderedDict()
+        # The decodes in progress, each with an event set when done.
+        self.loading = dict()
+
+    def get(self, filename, mode = "RGBA", transform = None):
+        """
+        Return the image in a file converted to mode.  A transform
+        is a tuple of a PIL Image method name and its arguments, as
+        ("rotate", 180), applied to the converted image.  The plain
+        converted image is cached too and shared with other transforms.
+        """
+        key = (filename, mode, transform)
+        while (True):
+            with self.lock:
+                image = self.images.get(key)
+                if (image is not None):
+                    self.images.move_to_end(key)
+                    self.hits += 1
+                    return image
+                waiting = self.loading.get(key)
+                if (waiting is None):
+                    self.loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is making this image, wait and look again.
+            waiting.wait()
+        try:
+            image = self.make(filename, mode, transform)
+            self.store(key, image)
+        finally:
+            with self.lock:
+                self.loading.pop(key).set()
+        return image
+
+    def make(self, filename, mode, transform):
+        """
+        Decode and convert a file, or transform the cached plain image.
+        """
+        if (transform is not None):
+            return getattr(self.get(filename, mode), transform[0])(*transform[1:])
+        with tracer.span("ImageCache.decode", {"file": filename}):
+            image = Image.open(filename)
+            if (not image):
+                print("\n\tImage file ", filename, " failed to load in createimage.")
+            else:
+                print("\n\tImage file ", filename, " successfully loaded.")
+            return image.convert(mode)
+
+    def store(self, key, image):
+        """
+        Keep an image, dropping the least recently used over the cap.
+        """
+        nbytes = image.width * image.height * len(image.getbands())
+        if (nbytes > self.capBytes):
+            return
+        with self.lock:
+            if (key in self.images):
+                return
+            self.images[key] = image
+            self.usedBytes += nbytes
+            while (self.usedBytes > self.capBytes):
+                (oldkey, oldimage) = self.images.popitem(last=False)
+                self.usedBytes -= oldimage.width * oldimage.height * len(oldimage.getbands())
+            tracer.count("imageCacheBytes", self.usedBytes)
+
+    def clear(self):
+        """
+        Drop every image.
+        """
+        with self.lock:
+            self.images.clear()
+            self.usedBytes = 0
+
+
+imageCache = ImageCache()
+# The cache shared by the whole program.
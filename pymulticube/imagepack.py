@@ -0,0 +1,219 @@
+"""
+**********************************************************
+* ImagePack:  A single file holding a whole gallery of
+* textures ready for OpenGL, so the program starts with one
+* sequential read in place of hundreds of picture decodes.
+* The file is a fixed header, the RGBA mipmap levels of
+* every image at aligned offsets, and a JSON index at the
+* end holding the settings the pack was built with and the
+* images by their path under the pictures directory.
+* PackReader memory maps the file and hands out numpy views
+* of the levels, which glTexImage2D reads without a copy.
+* Build a pack of cube textures with:
+*     python3 -m pymulticube.imagepack --background
+*         images/planks.jpg gallery.pack images/
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+from numpy import frombuffer, uint8
+from pymulticube.compositor import Compositor
+from pymulticube.mipmaps import MipBuilder
+from pymulticube.createimage import CreateImage
+
+MAGIC = b"PMCPACK\0"
+# The first bytes of every pack file.
+VERSION = 2
+# The pack format version.
+HEADER = struct.Struct("<8sIIQQ")
+# Magic, version, image count, index offset and index length.
+ALIGNMENT = 64
+# The byte alignment of every level in the file.
+
+
+def packName(filename, directory):
+    """
+    The name an image file is kept under in a pack, its path under
+    the pictures directory, so files of the same name in different
+    directories are kept apart.
+    """
+    return os.path.relpath(os.path.abspath(filename), directory).replace(os.sep, "/")
+
+
+class PackWriter:
+    """
+    PackWriter:  Call add() with each image's mipmap levels and
+    close() to write the index.
+    """
+    def __init__(self, filename, settings = None):
+        """
+        Open the file and leave room for the header.  The settings
+        dictionary, the pictures directory, background, blend mode
+        and fit, is kept in the index for readers to check.
+        """
+        self.filename = filename
+        self.outfile = open(filename, "wb")
+        self.outfile.write(b"\0" * HEADER.size)
+        self.settings = settings or dict()
+        self.index = dict()
+
+    def align(self):
+        """
+        Pad the file to the next level boundary.
+        """
+        offset = self.outfile.tell()
+        padding = (-offset) % ALIGNMENT
+        if (padding > 0):
+            self.outfile.write(b"\0" * padding)
+        return offset + padding
+
+    def add(self, name, levels):
+        """
+        Store the (height, width, 4) byte arrays of an image, largest first.
+        """
+        entry = list()
+        for level in levels:
+            offset = self.align()
+            self.outfile.write(level.astype(uint8, copy=False).tobytes())
+            entry.append([offset, int(level.shape[1]), int(level.shape[0])])
+        self.index[name] = entry
+
+    def close(self):
+        """
+        Write the index and the header and close the file.
+        """
+        text = json.dumps({"settings": self.settings, "images": self.index}).encode("utf-8")
+        offset = self.align()
+        self.outfile.write(text)
+        self.outfile.seek(0)
+        self.outfile.write(HEADER.pack(MAGIC, VERSION, len(self.index), offset, len(text)))
+        self.outfile.close()
+
+
+class PackReader:
+    """
+    PackReader:  Memory maps a pack file.  levels() returns the
+    mipmap levels of an image as read only numpy views of the file.
+    """
+    def __init__(self, filename):
+        """
+        Map the file and read its index.
+        """
+        self.filename = filename
+        with open(filename, "rb") as infile:
+            if (os.fstat(infile.fileno()).st_size < HEADER.size):
+                raise ValueError("Image pack " + filename + " is too short.")
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = frombuffer(self.map, uint8)
+        (magic, version, count, offset, length) = HEADER.unpack(self.data[0:HEADER.size].tobytes())
+        if (magic != MAGIC):
+            raise ValueError(filename + " is not an image pack.")
+        if (version != VERSION):
+            raise ValueError("Image pack " + filename + " has version " + str(version)
+                + ", expected " + str(VERSION) + ".")
+        index = json.loads(self.data[offset:offset + length].tobytes().decode("utf-8"))
+        self.settings = index["settings"]
+        self.index = index["images"]
+        if (len(self.index) != count):
+            raise ValueError("Image pack " + filename + " has a damaged index.")
+
+    def prefetch(self):
+        """
+        Ask the system to read the whole file ahead, in one sequential pass.
+        """
+        if (hasattr(mmap, "MADV_WILLNEED")):
+            self.map.madvise(mmap.MADV_WILLNEED)
+
+    def builtFor(self, background, compositor):
+        """
+        True if the pack's images were composited over a background
+        file with a Compositor's blend mode and fit.
+        """
+        return ((self.settings.get("background") == os.path.abspath(background))
+            and (self.settings.get("mode") == compositor.mode)
+            and (self.settings.get("fit") == compositor.fit))
+
+    def names(self):
+        """
+        The names of the images in the pack.
+        """
+        return list(self.index.keys())
+
+    def levels(self, name):
+        """
+        The (height, width, 4) levels of an image, largest first, or
+        None if the pack does not hold it.
+        """
+        entry = self.index.get(packName(name, self.settings.get("directory", "")))
+        if (entry is None):
+            return None
+        return [self.data[offset:offset + width * height * 4].reshape(height, width, 4)
+            for (offset, width, height) in entry]
+
+    def close(self):
+        """
+        Unmap the file.  Views from levels() still held keep it mapped
+        until they are freed.
+        """
+        self.data = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+
+def main():
+    """
+    Build a pack from the pictures in a directory.
+    """
+    parser = ArgumentParser(prog="python3 -m pymulticube.imagepack",
+        description="Build an image pack from the pictures in a directory.")
+    parser.add_argument("output", help="the pack file to write")
+    parser.add_argument("directory", help="the directory of pictures")
+    parser.add_argument("--background", metavar="FILE",
+        help="composite every picture over this one, as the cube textures are")
+    parser.add_argument("--blend-mode", choices=("over", "multiply", "screen", "add", "darken", "lighten"),
+        default="over", help="how the pictures are blended over the background, as multicube.py")
+    parser.add_argument("--fit", choices=("stretch", "letterbox"), default="stretch",
+        help="how the pictures are sized to the background, as multicube.py")
+    parser.add_argument("--max-texture-size", type=int, default=1024, metavar="PIXELS",
+        help="scale larger pictures down to this size (default 1024)")
+    parser.add_argument("--mipmaps", choices=("box", "lanczos"), default="box",
+        help="the filter for the mipmap levels")
+    options = parser.parse_args()
+    image = CreateImage()
+    image.compositor = Compositor(options.blend_mode, options.fit)
+    builder = MipBuilder(options.max_texture_size, 0, options.mipmaps)
+    background = None
+    if (options.background):
+        background = image.loadImage(options.background)
+    directory = os.path.abspath(options.directory)
+    writer = PackWriter(options.output, {"directory": directory,
+        "background": os.path.abspath(options.background) if (options.background) else None,
+        "mode": options.blend_mode, "fit": options.fit})
+    filenames = [os.path.join(path, name) for (path, dirs, names) in os.walk(directory) for name in names]
+    count = 0
+    for filename in sorted(filenames):
+        try:
+            if (background is not None):
+                pixels = image.compositeImage(background, filename)[2]
+            else:
+                pixels = image.getData(filename).reshape(image.height, image.width, 4)
+        except (OSError, ValueError) as error:
+            print("\n\tSkipping ", filename, ": ", error, ".")
+            continue
+        writer.add(packName(filename, directory), builder.chain(pixels))
+        count += 1
+    writer.close()
+    print("\n\tWrote ", count, " images to ", options.output, ".")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
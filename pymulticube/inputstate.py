@@ -0,0 +1,125 @@
+"""
+**********************************************************
+* InputState:  A class to gather the keyboard and mouse
+* input between frames.  Mouse motion is summed and the
+* motion keys are kept as a set of held keys, and once per
+* frame apply() turns them into a single camera update
+* scaled by the time since the last frame, so the camera
+* moves smoothly at any frame rate and its vectors are
+* worked out once per frame however fast the mouse reports.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from time import perf_counter
+from pymulticube.tracer import tracer
+
+
+class InputState:
+    """
+    InputState:  Hand keyDown(), keyUp() and mouseMove() the GLUT
+    events and call apply() with the camera once per frame.
+    """
+    MOVES = {"w": (1.0, 0.0, 0.0), "s": (-1.0, 0.0, 0.0), "d": (0.0, 1.0, 0.0),
+        "a": (0.0, -1.0, 0.0), "r": (0.0, 0.0, 1.0), "f": (0.0, 0.0, -1.0)}
+    # The forward, right and up motion of each motion key.
+    ZOOMS = {"in": -1.0, "out": 1.0}
+    # The zoom direction of each zoom key.
+    moveSpeed = 25.0
+    # The camera speed factor per second a motion key is held.
+    zoomSpeed = 30.0
+    # The zoom change in degrees per second a zoom key is held.
+    maxStep = 0.1
+    # The longest time in seconds one frame may move the camera, so a stall does not jump.
+    pressed = None
+    # The motion and zoom keys held down.
+    mouseX = 0.
+    # The mouse motion across since the last frame.
+    mouseY = 0.
+    # The mouse motion up and down since the last frame.
+    lastMouse = None
+    # The last mouse position, None until the first motion event.
+    lastTick = None
+    # The time of the last apply().
+    fixedStep = None
+    # The time each frame stands for while recording, or None for the time taken.
+
+    def __init__(self):
+        """
+        Start with no keys held and no mouse motion.
+        """
+        self.pressed = set()
+
+    def keyDown(self, key):
+        """
+        Note a key press.  Returns True for a motion key, which
+        needs no other handling.
+        """
+        key = key.lower()
+        if (key in self.MOVES):
+            self.pressed.add(key)
+            return True
+        return False
+
+    def keyUp(self, key):
+        """
+        Note a key release.
+        """
+        self.pressed.discard(key.lower())
+
+    def zoomDown(self, zoom):
+        """
+        Note a zoom key press, "in" or "out".
+        """
+        self.pressed.add(zoom)
+
+    def zoomUp(self, zoom):
+        """
+        Note a zoom key release.
+        """
+        self.pressed.discard(zoom)
+
+    def release(self):
+        """
+        Let go of every key, as when the window loses the keyboard.
+        """
+        self.pressed.clear()
+
+    def mouseMove(self, x, y):
+        """
+        Add a mouse position to the motion for this frame.
+        """
+        if (self.lastMouse is not None):
+            self.mouseX += x - self.lastMouse[0]
+            self.mouseY += y - self.lastMouse[1]
+        self.lastMouse = (x, y)
+        tracer.event("mouseMove", lambda: {"x": x, "y": y,
+            "dx": self.mouseX, "dy": self.mouseY})
+
+    def apply(self, camera):
+        """
+        Move the camera by the input gathered since the last frame.
+        """
+        now = perf_counter()
+        elapsed = 0. if (self.lastTick is None) else min(now - self.lastTick, self.maxStep)
+        if (self.fixedStep is not None):
+            elapsed = self.fixedStep
+        self.lastTick = now
+        if ((self.mouseX != 0.) or (self.mouseY != 0.)):
+            camera.processMouseMovement(self.mouseX, self.mouseY)
+            self.mouseX = self.mouseY = 0.
+        if (len(self.pressed) == 0):
+            return
+        (forward, right, up, zoom) = (0., 0., 0., 0.)
+        for key in self.pressed:
+            if (key in self.MOVES):
+                motion = self.MOVES[key]
+                forward += motion[0]
+                right += motion[1]
+                up += motion[2]
+            else:
+                zoom += self.ZOOMS[key]
+        if ((forward != 0.) or (right != 0.) or (up != 0.)):
+            camera.processMovement(forward, right, up, self.moveSpeed * elapsed)
+        if (zoom != 0.):
+            camera.processZoom(zoom * self.zoomSpeed * elapsed)
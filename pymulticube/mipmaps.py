@@ -0,0 +1,155 @@
+"""
+**********************************************************
+* MipBuilder:  A class to build texture mipmap chains on
+* the CPU with numpy, in place of glGenerateMipmap, which
+* is slow with software OpenGL.  Images larger than the
+* maximum texture size, or than the screen needs, are
+* scaled down before the chain is built, so only the levels
+* that can be seen are uploaded.  Chains can be cached on
+* disk.  The builder holds no OpenGL state, so the chains
+* of many images can be built at once on worker threads.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import hashlib
+import json
+import os
+from PIL import Image
+from numpy import asarray, load, savez, uint16, uint8
+
+
+def boxDownsample(pixels):
+    """
+    Halve a (height, width, channels) byte image by averaging
+    each 2x2 block.  A dimension of one pixel stays at one.
+    """
+    (height, width) = pixels.shape[0:2]
+    total = pixels.astype(uint16)
+    if (height > 1):
+        rows = (height // 2) * 2
+        total = total[0:rows:2] + total[1:rows:2]
+    else:
+        total = total * 2
+    if (width > 1):
+        columns = (width // 2) * 2
+        total = total[:, 0:columns:2] + total[:, 1:columns:2]
+    else:
+        total = total * 2
+    return ((total + 2) // 4).astype(uint8)
+
+
+def lanczosDownsample(pixels, width, height):
+    """
+    Resize a (height, width, 4) byte image with a Lanczos filter.
+    """
+    return asarray(Image.fromarray(pixels, "RGBA").resize((width, height), Image.LANCZOS), "uint8")
+
+
+class MipBuilder:
+    """
+    MipBuilder:  Turns an RGBA numpy image into a list of mipmap
+    levels, largest first, ready for glTexImage2D.
+    """
+    VERSION = 1
+    # The cache file format version.
+    maxSize = 1024
+    # The largest width or height uploaded.
+    targetSize = 0
+    # The largest size the screen can show, zero for no limit.
+    filter = "box"
+    # The filter for the levels, "box" or "lanczos".
+    cacheDir = None
+    # The directory for cached chains, None for no cache.
+
+    def __init__(self, maxSize = 1024, targetSize = 0, filter = "box", cacheDir = None):
+        """
+        Set the size limits, the filter and the cache directory.
+        """
+        self.maxSize = maxSize
+        self.targetSize = targetSize
+        self.filter = filter
+        self.cacheDir = cacheDir
+
+    def limit(self):
+        """
+        The largest base level size wanted.
+        """
+        limit = self.maxSize
+        if (self.targetSize > 0):
+            # The smallest power of two that covers the screen.
+            limit = min(limit, 1 << max(int(self.targetSize - 1).bit_length(), 0))
+        return limit
+
+    def cacheFile(self, key, sources):
+        """
+        The cache file for a chain.  The name hashes the key, the
+        size and modification time of each source file and the settings.
+        """
+        stamps = list()
+        for name in sources:
+            try:
+                info = os.stat(name)
+                stamps.append([name, info.st_size, info.st_mtime])
+            except OSError:
+                stamps.append([name, 0, 0])
+        text = json.dumps([self.VERSION, key, stamps, self.limit(), self.filter])
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return os.path.join(self.cacheDir, "mips-" + digest + ".npz")
+
+    def build(self, pixels, key = None, sources = (), levels = 0, clamp = True):
+        """
+        Build the chain for a (height, width, 4) byte image, or for a
+        callable returning one, which is only called when the chain is
+        not cached.  With a key and a cache directory the chain is read
+        from or saved to the cache; sources are the files the image
+        came from.  A levels value above zero stops the chain early,
+        and clamp False keeps the full size, as an atlas page needs.
+        """
+        cachefile = None
+        if ((key is not None) and (self.cacheDir)):
+            cachefile = self.cacheFile([key, levels, clamp], sources)
+            if (os.path.exists(cachefile)):
+                try:
+                    with load(cachefile) as saved:
+                        return [saved["level" + str(x)] for x in range(len(saved.files))]
+                except (OSError, ValueError, KeyError):
+                    print("\n\tIgnoring the damaged mipmap cache ", cachefile, ".")
+        if (callable(pixels)):
+            pixels = pixels()
+        chain = self.chain(pixels, levels, clamp)
+        if (cachefile is not None):
+            try:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                # Write then rename, so other threads never read half a file.
+                partial = cachefile + "." + str(os.getpid()) + ".part"
+                with open(partial, "wb") as outfile:
+                    savez(outfile, **{"level" + str(x): chain[x] for x in range(len(chain))})
+                os.replace(partial, cachefile)
+            except OSError as error:
+                print("\n\tUnable to save the mipmap cache: ", error, ".")
+        return chain
+
+    def chain(self, pixels, levels = 0, clamp = True):
+        """
+        Scale the image down to the size limit and build the levels.
+        """
+        (height, width) = pixels.shape[0:2]
+        if (clamp):
+            limit = self.limit()
+            while ((width > limit) or (height > limit)):
+                width = max(width // 2, 1)
+                height = max(height // 2, 1)
+            if ((width, height) != pixels.shape[1::-1]):
+                pixels = lanczosDownsample(pixels, width, height)
+        chain = [pixels]
+        while (((width > 1) or (height > 1)) and ((levels <= 0) or (len(chain) < levels))):
+            if (self.filter == "lanczos"):
+                width = max(width // 2, 1)
+                height = max(height // 2, 1)
+                pixels = lanczosDownsample(pixels, width, height)
+            else:
+                pixels = boxDownsample(pixels)
+                (height, width) = pixels.shape[0:2]
+            chain.append(pixels)
+        return chain
@@ -0,0 +1,357 @@
+"""
+**********************************************************
+* OcclusionCuller:  A class to skip the cubes hidden behind
+* other cubes.  Where the OpenGL context supports occlusion
+* queries, the cubes are grouped by the cells of a coarse
+* grid and the bounding box of each group is tested against
+* the depth buffer after the cubes are drawn, one query per
+* group, and the results are used on the next frame, so the
+* queries never stall the pipeline.  Otherwise a small hierarchical depth buffer is
+* built on the CPU from the nearest cubes and the bounding
+* spheres of the others are tested against it.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from OpenGL.GL import *
+from numpy import (array, ascontiguousarray, atleast_1d, bincount, ceil, clip, cumsum, full, inf, int64,
+    log2, maximum, minimum, ones, zeros, argsort, flatnonzero)
+from pymulticube.tracer import tracer
+
+CUBERADIUS = 0.8660254
+# The radius of the sphere holding a unit cube at any rotation.
+INNERRADIUS = 0.5
+# The radius of the sphere inside a unit cube at any rotation.
+
+# A unit box as 36 triangle vertices, scaled to the bounding radius on use.
+BOXVERTS = array(([
+    [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, -1, 1], [1, 1, 1], [-1, 1, 1],
+    [1, -1, -1], [-1, -1, -1], [-1, 1, -1], [1, -1, -1], [-1, 1, -1], [1, 1, -1],
+    [-1, -1, -1], [-1, -1, 1], [-1, 1, 1], [-1, -1, -1], [-1, 1, 1], [-1, 1, -1],
+    [1, -1, 1], [1, -1, -1], [1, 1, -1], [1, -1, 1], [1, 1, -1], [1, 1, 1],
+    [-1, 1, 1], [1, 1, 1], [1, 1, -1], [-1, 1, 1], [1, 1, -1], [-1, 1, -1],
+    [-1, -1, -1], [1, -1, -1], [1, -1, 1], [-1, -1, -1], [1, -1, 1], [-1, -1, 1]
+]), 'f')
+
+
+def queriesSupported():
+    """
+    True if the current context can run GL_SAMPLES_PASSED queries.
+    """
+    try:
+        if (not bool(glGenQueries)):
+            return False
+        bits = zeros(1, 'int32')
+        glGetQueryiv(GL_SAMPLES_PASSED, GL_QUERY_COUNTER_BITS, bits)
+        return bits[0] > 0
+    except Exception:
+        return False
+
+
+class HiZBuffer:
+    """
+    HiZBuffer:  A low resolution depth buffer with a pyramid of
+    coarser levels, each texel holding the farthest depth of the
+    four below it.  Depths are view space distances (clip w).
+    """
+    width = 128
+    # The width of the finest level in texels.
+    height = 64
+    # The height of the finest level in texels.
+    maxOccluders = 256
+    # The number of nearest cubes drawn as occluders.
+    levels = None
+    # The depth pyramid, finest level first.
+
+    def __init__(self, width = 128, height = 64):
+        """
+        Set the size of the finest level.
+        """
+        self.width = width
+        self.height = height
+        self.levels = list()
+
+    def project(self, positions, modelview, projection):
+        """
+        Project cube centers.  The matrices are in the OpenGL column
+        major layout as returned by glGetFloatv.  Returns the texel
+        coordinates, the view depth and the texels per unit of
+        radius at unit depth for each cube.
+        """
+        homogeneous = ones((len(positions), 4), 'f')
+        homogeneous[:, 0:3] = positions
+        clipped = homogeneous @ modelview @ projection
+        depth = clipped[:, 3]
+        safe = maximum(depth, 1e-6)
+        x = ((clipped[:, 0] / safe) * 0.5 + 0.5) * self.width
+        y = ((clipped[:, 1] / safe) * 0.5 + 0.5) * self.height
+        scale = (abs(projection[0][0]) * 0.5 * self.width, abs(projection[1][1]) * 0.5 * self.height)
+        return (x, y, depth, scale)
+
+    def rasterize(self, x, y, depth, scale):
+        """
+        Draw the nearest cubes into the finest level as the squares
+        inside the projections of their inner spheres, at the depth
+        of the far side of those spheres, then build the pyramid.
+        """
+        level = full((self.height, self.width), inf, 'f')
+        nearest = argsort(depth, kind='stable')
+        nearest = nearest[depth[nearest] > INNERRADIUS][:self.maxOccluders]
+        for index in nearest:
+            halfx = (INNERRADIUS * scale[0] / depth[index]) * 0.7071
+            halfy = (INNERRADIUS * scale[1] / depth[index]) * 0.7071
+            # Only whole texels inside the square are covered.
+            left = int(ceil(x[index] - halfx))
+            right = int(x[index] + halfx)
+            bottom = int(ceil(y[index] - halfy))
+            top = int(y[index] + halfy)
+            left = max(left, 0)
+            bottom = max(bottom, 0)
+            right = min(right, self.width)
+            top = min(top, self.height)
+            if ((right > left) and (top > bottom)):
+                area = level[bottom:top, left:right]
+                minimum(area, depth[index] + INNERRADIUS, out=area)
+        self.levels = [level]
+        while ((level.shape[0] > 1) or (level.shape[1] > 1)):
+            rows = (level.shape[0] + 1) // 2
+            cols = (level.shape[1] + 1) // 2
+            padded = full((rows * 2, cols * 2), inf, 'f')
+            padded[:level.shape[0], :level.shape[1]] = level
+            level = maximum(maximum(padded[0::2, 0::2], padded[0::2, 1::2]),
+                maximum(padded[1::2, 0::2], padded[1::2, 1::2]))
+            self.levels.append(level)
+
+    def test(self, x, y, depth, scale):
+        """
+        Test the bounding spheres of the cubes against the pyramid.
+        Returns True for the cubes that may be visible.
+        """
+        count = len(depth)
+        visible = ones(count, bool)
+        # Cubes near or behind the camera are always drawn.
+        inFront = depth > (CUBERADIUS + 0.1)
+        near = maximum(depth - CUBERADIUS, 1e-6)
+        halfx = CUBERADIUS * scale[0] / near
+        halfy = CUBERADIUS * scale[1] / near
+        left = x - halfx
+        right = x + halfx
+        bottom = y - halfy
+        top = y + halfy
+        onScreen = (right >= 0) & (left < self.width) & (top >= 0) & (bottom < self.height)
+        candidates = flatnonzero(inFront & onScreen)
+        if (len(candidates) == 0):
+            return visible
+        left = clip(left[candidates], 0, self.width - 1)
+        right = clip(right[candidates], 0, self.width - 1)
+        bottom = clip(bottom[candidates], 0, self.height - 1)
+        top = clip(top[candidates], 0, self.height - 1)
+        # At this level the rectangle spans at most three texels each way,
+        # so its corner and middle texels cover it.
+        span = maximum(right - left, top - bottom)
+        lod = clip(ceil(log2(maximum(span * 0.5, 1.0))), 0, len(self.levels) - 1).astype(int)
+        farthest = zeros(len(candidates), 'f')
+        for step in range(len(self.levels)):
+            chosen = flatnonzero(lod == step)
+            if (len(chosen) == 0):
+                continue
+            level = self.levels[step]
+            x0 = (left[chosen].astype(int) >> step)
+            x2 = (right[chosen].astype(int) >> step)
+            y0 = (bottom[chosen].astype(int) >> step)
+            y2 = (top[chosen].astype(int) >> step)
+            x1 = minimum(x0 + 1, x2)
+            y1 = minimum(y0 + 1, y2)
+            result = farthest[chosen]
+            for row in (y0, y1, y2):
+                for column in (x0, x1, x2):
+                    result = maximum(result, level[row, column])
+            farthest[chosen] = result
+        visible[candidates] = near[candidates] <= farthest
+        return visible
+
+
+class OcclusionCuller:
+    """
+    OcclusionCuller:  Call visibility() before drawing the cubes to
+    get the cubes worth drawing, and endFrame() after drawing them to
+    issue the queries for the next frame.
+    """
+    GROUPSIZE = 4.0
+    # The least edge of the grid cells whose cubes share one query.
+    MAXGROUPS = 256
+    # The cells are made larger to keep about this many in the cubes' volume.
+    hardware = False
+    # True when occlusion queries are used.
+    queries = None
+    # The query object IDs, one per group, more are made as needed.
+    groups = None
+    # The group of each cube.
+    groupCount = 0
+    # The number of groups.
+    groupedFor = None
+    # The CubeField (version, motion) the groups were made for.
+    queried = None
+    # The group of each cube when the outstanding queries were issued.
+    issued = 0
+    # The number of outstanding queries.
+    lower = None
+    # The lowest corner of each group's box.
+    upper = None
+    # The highest corner of each group's box.
+    visible = None
+    # The visibility of each cube from the latest results.
+    hiz = None
+    # The CPU hierarchical depth buffer for the fallback.
+    boxes = None
+    # The bounding box vertices of every group for the queries.
+    pending = False
+    # True while query results from the last frame are outstanding.
+    builtVersion = -1
+    # The CubeField version the visibility and the queries are for.
+
+    def __init__(self, useQueries = True):
+        """
+        Use hardware queries when asked and supported, otherwise
+        fall back on the CPU hierarchical depth buffer.  A current
+        OpenGL context is required.
+        """
+        self.hardware = useQueries and queriesSupported()
+        self.queries = list()
+        self.result = zeros(1, 'uint32')
+        if (not self.hardware):
+            self.hiz = HiZBuffer()
+        print("\n\tOcclusion culling using",
+            "hardware queries." if self.hardware else "a CPU hierarchical depth buffer.")
+
+    def resize(self, count):
+        """
+        Match the visibility array to the cube count.
+        """
+        if ((self.visible is not None) and (len(self.visible) == count)):
+            return
+        self.visible = ones(count, bool)
+        self.pending = False
+
+    def group(self, field):
+        """
+        Sort the cubes into the cells of the grid and make the box
+        around each cell holding cubes, when the cubes have changed or
+        moved.
+        """
+        if (self.groupedFor == (field.version, field.motion)):
+            return
+        positions = field.positions
+        # Each column is reduced on its own, far quicker than along axis 0.
+        low = array([positions[:, axis].min() for axis in range(3)], 'f')
+        high = array([positions[:, axis].max() for axis in range(3)], 'f')
+        extent = maximum(high - low, self.GROUPSIZE)
+        size = max(self.GROUPSIZE, float(extent.prod() / self.MAXGROUPS) ** (1.0 / 3.0))
+        cells = ((positions - low) / size).astype(int64)
+        span = array([cells[:, axis].max() for axis in range(3)], int64) + 1
+        keys = (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+        # Number the cells holding cubes, so there is no query for an empty cell.
+        used = bincount(keys, minlength=int(span.prod())) > 0
+        self.groups = (cumsum(used) - 1)[keys]
+        self.groupCount = int(used.sum())
+        # Each box is its cell grown by a cube's reach, which holds every cube in it.
+        occupied = used.nonzero()[0]
+        cell = array((occupied // (span[1] * span[2]), (occupied // span[2]) % span[1], occupied % span[2]), 'f').T
+        lower = low + cell * size - CUBERADIUS
+        upper = low + (cell + 1.0) * size + CUBERADIUS
+        (self.lower, self.upper) = (lower, upper)
+        center = (lower + upper) * 0.5
+        half = (upper - lower) * 0.5
+        self.boxes = ascontiguousarray((center[:, None, :] + half[:, None, :] * BOXVERTS[None, :, :])
+            .reshape(-1, 3), 'f')
+        if (len(self.queries) < self.groupCount):
+            self.queries += [int(x) for x in atleast_1d(glGenQueries(self.groupCount - len(self.queries)))]
+        self.groupedFor = (field.version, field.motion)
+
+    def visibility(self, field, eye):
+        """
+        Return the visibility of each cube for this frame.  The current
+        modelview and projection matrices must be the ones used to draw
+        the cubes.  The eye is the camera position.
+        """
+        with tracer.span("OcclusionCuller.visibility"):
+            self.resize(field.count)
+            if (field.version != self.builtVersion):
+                # A result belongs to the cube that was at its index, so
+                # when the cubes change every one is drawn until retested.
+                self.visible = ones(field.count, bool)
+                self.pending = False
+                self.builtVersion = field.version
+            if (self.hardware):
+                self.collect()
+            else:
+                modelview = glGetFloatv(GL_MODELVIEW_MATRIX)
+                projection = glGetFloatv(GL_PROJECTION_MATRIX)
+                viewport = glGetIntegerv(GL_VIEWPORT)
+                self.hiz.height = max(int(self.hiz.width * viewport[3] / max(viewport[2], 1)), 1)
+                projected = self.hiz.project(field.positions, modelview, projection)
+                self.hiz.rasterize(*projected)
+                self.visible = self.hiz.test(*projected)
+            # Always draw the cubes the camera is inside of.
+            offset = field.positions - array(eye, 'f')
+            self.visible |= (offset * offset).sum(axis=1) < ((CUBERADIUS + 0.1) ** 2)
+            if ((self.hardware) and (self.groupedFor == (field.version, field.motion))):
+                # A box around the camera is seen from inside, where its faces may be hidden.
+                point = array(eye, 'f')
+                around = ((self.lower <= point) & (point <= self.upper)).all(axis=1)
+                self.visible |= around[self.groups]
+        return self.visible
+
+    def collect(self):
+        """
+        Read the query results issued on the previous frame and give
+        each cube its group's result.  The queries finish in order, so
+        only the last is asked whether it is ready, and if it is not
+        the cubes keep their last visibility.
+        """
+        if (not self.pending):
+            return
+        self.pending = False
+        glGetQueryObjectuiv(self.queries[self.issued - 1], GL_QUERY_RESULT_AVAILABLE, self.result)
+        if (not self.result[0]):
+            return
+        seen = zeros(self.issued, bool)
+        for index in range(self.issued):
+            glGetQueryObjectuiv(self.queries[index], GL_QUERY_RESULT, self.result)
+            seen[index] = self.result[0] > 0
+        self.visible = seen[self.queried]
+
+    def endFrame(self, field):
+        """
+        With hardware queries, test the bounding box of every group of
+        cubes against the depth buffer just drawn, without touching the
+        color or depth buffers.  Must be called with the cube modelview
+        matrix.
+        """
+        if ((not self.hardware) or (field.count == 0)):
+            return
+        with tracer.span("OcclusionCuller.endFrame", {"cubes": field.count}):
+            self.group(field)
+            glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+            glDepthMask(GL_FALSE)
+            glDisable(GL_CULL_FACE)
+            glEnableClientState(GL_VERTEX_ARRAY)
+            glVertexPointer(3, GL_FLOAT, 0, self.boxes)
+            for index in range(self.groupCount):
+                glBeginQuery(GL_SAMPLES_PASSED, self.queries[index])
+                glDrawArrays(GL_TRIANGLES, index * 36, 36)
+                glEndQuery(GL_SAMPLES_PASSED)
+            glDisableClientState(GL_VERTEX_ARRAY)
+            glDepthMask(GL_TRUE)
+            glColorMask(GL_TRUE, GL_TRUE, GL_TRUE, GL_TRUE)
+            self.issued = self.groupCount
+            self.queried = self.groups
+            self.pending = True
+
+    def delete(self):
+        """
+        Release the query objects.
+        """
+        if (len(self.queries) > 0):
+            glDeleteQueries(len(self.queries), self.queries)
+        self.queries = list()
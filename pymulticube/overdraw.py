@@ -0,0 +1,98 @@
+"""
+**********************************************************
+* OverdrawCounter:  A class to count the fragments that
+* pass the depth test while a pass is drawn, using OpenGL
+* GL_SAMPLES_PASSED queries.  A ring of queries is used in
+* turn and each result is read a few frames late, only once
+* the GPU says it is ready, so reading it never waits.  Dividing by the window area gives the
+* average number of fragments written per pixel.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from OpenGL.GL import *
+from numpy import zeros
+from pymulticube.tracer import tracer
+
+
+class OverdrawCounter:
+    """
+    OverdrawCounter:  Wrap a pass with begin() and end() and read
+    the fragments per pixel for the previous frame from overdraw.
+    """
+    QUERIES = 3
+    # The queries used in turn, each read two frames late.
+    queries = None
+    # The query object IDs.
+    current = 0
+    # The query used this frame.
+    issued = None
+    # The pixel count of each query waiting for its result, or 0.
+    samples = 0
+    # The fragments that passed the depth test in the last measured frame.
+    overdraw = 0.
+    # The fragments per pixel in the last measured frame.
+    frames = 0
+    # The number of frames measured.
+    total = 0.
+    # The sum of the overdraw values, for the average.
+
+    def __init__(self):
+        """
+        Create the query objects.  A current OpenGL context is required.
+        """
+        self.queries = [int(x) for x in glGenQueries(self.QUERIES)]
+        self.issued = [0] * self.QUERIES
+        self.result = zeros(1, 'uint32')
+        self.available = zeros(1, 'int32')
+
+    def begin(self):
+        """
+        Start counting the fragments of a pass.
+        """
+        glBeginQuery(GL_SAMPLES_PASSED, self.queries[self.current])
+
+    def end(self, width, height):
+        """
+        Stop counting and collect the oldest result if it is ready.
+        """
+        glEndQuery(GL_SAMPLES_PASSED)
+        self.issued[self.current] = max(width * height, 1)
+        self.current = (self.current + 1) % self.QUERIES
+        self.collect()
+
+    def collect(self):
+        """
+        Read the oldest query if the GPU has finished it, so reading
+        never waits.  A frame whose query is reused before it is
+        ready is not measured.
+        """
+        query = self.current
+        pixels = self.issued[query]
+        if (pixels == 0):
+            return
+        glGetQueryObjectiv(self.queries[query], GL_QUERY_RESULT_AVAILABLE, self.available)
+        if (not self.available[0]):
+            return
+        glGetQueryObjectuiv(self.queries[query], GL_QUERY_RESULT, self.result)
+        self.issued[query] = 0
+        self.samples = int(self.result[0])
+        self.overdraw = self.samples / pixels
+        self.frames += 1
+        self.total += self.overdraw
+        tracer.count("samplesPassed", self.samples)
+        tracer.count("overdraw", self.overdraw)
+
+    def average(self):
+        """
+        The mean fragments per pixel over all the measured frames.
+        """
+        if (self.frames == 0):
+            return 0.
+        return self.total / self.frames
+
+    def delete(self):
+        """
+        Release the query objects.
+        """
+        glDeleteQueries(self.QUERIES, self.queries)
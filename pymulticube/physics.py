@@ -0,0 +1,292 @@
+"""
+**********************************************************
+* CubePhysics:  A class to let the cubes drift and bounce
+* off each other and the walls of their box.  Each cube is
+* a ball as wide as the cube's corners, and every step
+* moves all the balls with numpy, bounces them off the
+* walls, finds the touching pairs through a uniform grid of
+* cells as wide as a ball, pushes the pairs apart and swaps
+* their speeds along the line between them.  The steps run
+* in a worker process at a fixed rate, so they do not share
+* the renderer's interpreter lock, and each finished step is
+* written to shared memory and handed to the renderer as a
+* new positions array.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import threading
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, sleep
+from numpy import (absolute, arange, argsort, array, bincount, ceil, clip, concatenate, cumsum,
+    einsum, empty, floor, int64, maximum, minimum, ndarray, repeat, sqrt, zeros)
+from numpy.random import default_rng
+from pymulticube.tracer import tracer
+
+RADIUS = 0.5 * 3.0 ** 0.5
+# The radius of the ball around a cube, reaching its corners.
+
+
+def simulate(physics, name, lock, steps, halting):
+    """
+    Worker process body: run a CubePhysics, handed over pickled,
+    writing each step's positions to the shared memory block.
+    """
+    shared = SharedMemory(name=name)
+    try:
+        physics.run(ndarray((2,) + physics.positions.shape, 'f', shared.buf), lock, steps, halting)
+    finally:
+        shared.close()
+
+
+class CubePhysics:
+    """
+    CubePhysics:  Call start() to run the simulation in its own
+    process, apply() once per frame to give a CubeField the latest
+    positions and stop() to end it.  step() may also be called
+    directly instead.
+    """
+    rate = 60.0
+    # The simulation steps per second.
+    restitution = 1.0
+    # The share of the speed kept by a bounce, 1 for no loss.
+    positions = None
+    # The ball centers, shape (count, 3).
+    velocities = None
+    # The ball velocities in units per second, shape (count, 3).
+    lower = None
+    # The lowest corner the ball centers may reach.
+    upper = None
+    # The highest corner the ball centers may reach.
+    steps = 0
+    # The steps taken.
+    contacts = 0
+    # The touching pairs found in the last step.
+    stepTime = 0.
+    # The time the last step took, in seconds.
+    published = None
+    # The positions of the last finished step, never changed once handed out.
+    applied = 0
+    # The step the renderer's field was last given.
+    process = None
+    # The simulation process.
+    shared = None
+    # The shared memory of the two positions buffers the process writes in turn.
+
+    def __init__(self, positions, center = (0.0, 0.0, -15.0), size = (20.0, 20.0, 20.0), speed = 1.0, seed = None):
+        """
+        Start from the cube positions, shape (count, 3), in a box of
+        a center and size, with random headings at a speed in units
+        per second.
+        """
+        self.guard = threading.Lock()
+        center = array(center, 'f')
+        half = array(size, 'f') * 0.5
+        self.lower = center - half + RADIUS
+        self.upper = center + half - RADIUS
+        self.positions = clip(array(positions, 'f'), self.lower, self.upper)
+        headings = default_rng(seed).normal(size=self.positions.shape).astype('f')
+        headings /= maximum(sqrt((headings * headings).sum(axis=1, keepdims=True)), 1e-9)
+        self.velocities = headings * speed
+        # The grid: a layer of empty cells on every side keeps the neighbors in range.
+        self.cellSize = 2.0 * RADIUS
+        self.origin = self.lower - self.cellSize
+        self.cells = (ceil((self.upper - self.lower) / self.cellSize).astype(int64) + 3)
+        self.published = self.positions.copy()
+
+    def __getstate__(self):
+        """
+        The state handed to the worker process, without the locks
+        and the shared memory, which do not pickle.
+        """
+        state = self.__dict__.copy()
+        for key in ("guard", "process", "shared", "buffers", "lock", "stepCount", "halting"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Take the state in the worker process, with new locks.
+        """
+        self.__dict__.update(state)
+        self.guard = threading.Lock()
+
+    def cellIndices(self, positions):
+        """
+        The grid cell of each position, numbered with z fastest so a
+        column of cells has consecutive numbers.
+        """
+        cell = floor((positions - self.origin) / self.cellSize).astype(int64)
+        cell = clip(cell, 1, self.cells - 2)
+        return (cell[:, 0] * self.cells[1] + cell[:, 1]) * self.cells[2] + cell[:, 2]
+
+    def pairs(self, positions):
+        """
+        Every pair of balls in the same or neighboring cells, once,
+        as two index arrays.
+        """
+        (order, first, second) = self.sortedPairs(positions)
+        return (order[first], order[second])
+
+    def sortedPairs(self, positions):
+        """
+        The order of the balls by cell, and every pair of balls in the
+        same or neighboring cells, once, as two index arrays into that
+        order.  The balls are counted into the cells, so each cell's
+        balls are one run of the sorted order and the three cells of
+        a column are one run too.
+        """
+        count = len(positions)
+        index = self.cellIndices(positions)
+        order = argsort(index)
+        index = index[order]
+        starts = zeros(int(self.cells.prod()) + 1, int64)
+        starts[1:] = cumsum(bincount(index, minlength=int(self.cells.prod())))
+        column = self.cells[2]
+        # Five runs per ball: its own column, the later balls in its cell and
+        # the cell above, then the four columns after it, each from the cell
+        # below to the cell above.
+        first = empty((count, 5), int64)
+        last = empty((count, 5), int64)
+        first[:, 0] = arange(1, count + 1)
+        last[:, 0] = starts[index + 2]
+        for (run, (dx, dy)) in enumerate(((0, 1), (1, -1), (1, 0), (1, 1)), 1):
+            offset = (dx * self.cells[1] + dy) * column
+            first[:, run] = starts[index + offset - 1]
+            last[:, run] = starts[index + offset + 2]
+        counts = maximum(last - first, 0).ravel()
+        total = int(counts.sum())
+        if (total == 0):
+            return (order, zeros(0, int64), zeros(0, int64))
+        # The place of each pair within its run.
+        within = repeat(first.ravel() - cumsum(counts) + counts, counts) + arange(total)
+        return (order, repeat(arange(count), counts.reshape(count, 5).sum(axis=1)), within)
+
+    def step(self, dt = None):
+        """
+        Advance the simulation by dt seconds, one step at the rate
+        by default, and publish the new positions.
+        """
+        if (dt is None):
+            dt = 1.0 / self.rate
+        start = perf_counter()
+        positions = self.positions
+        velocities = self.velocities
+        positions += velocities * dt
+        # Bounce off the walls.
+        for (wall, outward) in ((self.lower, -1.0), (self.upper, 1.0)):
+            over = (positions - wall) * outward > 0.0
+            if (over.any()):
+                (rows, axes) = over.nonzero()
+                positions[rows, axes] = 2.0 * wall[axes] - positions[rows, axes]
+                velocities[rows, axes] = -outward * absolute(velocities[rows, axes]) * self.restitution
+        (order, first, second) = self.sortedPairs(positions)
+        # Neighbors sit close together in the cell order, so the pairs are
+        # gathered from the sorted positions and only the touching ones
+        # are taken back to the cube numbers.
+        ordered = positions.take(order, axis=0)
+        between = ordered.take(second, axis=0) - ordered.take(first, axis=0)
+        squared = einsum("ij,ij->i", between, between)
+        touching = ((squared < 4.0 * RADIUS * RADIUS) & (squared > 0.0)).nonzero()[0]
+        (first, second, between) = (order[first[touching]], order[second[touching]], between[touching])
+        distance = sqrt(squared[touching])
+        self.contacts = len(first)
+        if (self.contacts > 0):
+            count = len(positions)
+            normal = between / distance[:, None]
+            # Push each pair apart by half the overlap each.
+            push = normal * ((2.0 * RADIUS - distance) * 0.5)[:, None]
+            # Swap the speeds along the normal of the pairs closing in.
+            closing = ((velocities[second] - velocities[first]) * normal).sum(axis=1)
+            closing = minimum(closing, 0.0) * (1.0 + self.restitution) * 0.5
+            impulse = normal * closing[:, None]
+            # The changes to both balls of every pair summed in one pass, the
+            # position in the first three columns and the velocity in the rest.
+            change = concatenate((push, -impulse), axis=1)
+            rows = concatenate((second, first))[:, None] * 6 + arange(6)
+            totals = bincount(rows.ravel(), concatenate((change, -change)).ravel(), count * 6)
+            totals = totals.reshape(count, 6)
+            positions += totals[:, 0:3]
+            velocities += totals[:, 3:6]
+        maximum(positions, self.lower, out=positions)
+        minimum(positions, self.upper, out=positions)
+        with self.guard:
+            self.published = positions.copy()
+            self.steps += 1
+        self.stepTime = perf_counter() - start
+        tracer.count("physicsContacts", self.contacts)
+
+    def start(self):
+        """
+        Run the steps in a worker process at the rate.
+        """
+        context = get_context("spawn")
+        self.shared = SharedMemory(create=True, size=max(2 * self.positions.nbytes, 1))
+        self.buffers = ndarray((2,) + self.positions.shape, 'f', self.shared.buf)
+        self.buffers[:] = self.positions
+        self.lock = context.Lock()
+        self.stepCount = context.Value('q', self.steps, lock=False)
+        self.halting = context.Event()
+        self.process = context.Process(target=simulate, name="physics", daemon=True,
+            args=(self, self.shared.name, self.lock, self.stepCount, self.halting))
+        self.process.start()
+
+    def run(self, buffers, lock, steps, halting):
+        """
+        Process body: step at a fixed rate, skipping ahead rather
+        than catching up after a stall.  Each step is written to the
+        buffer not being read, which is then made the latest.
+        """
+        period = 1.0 / self.rate
+        due = perf_counter()
+        while (not halting.is_set()):
+            self.step(period)
+            buffers[(steps.value + 1) % 2] = self.positions
+            with lock:
+                steps.value += 1
+            due += period
+            now = perf_counter()
+            if (due > now):
+                sleep(due - now)
+            else:
+                due = now
+
+    def stop(self):
+        """
+        End the worker process, keeping the positions it reached.
+        """
+        if (self.process is None):
+            return
+        self.halting.set()
+        self.process.join(1.0)
+        if (self.process.is_alive()):
+            self.process.terminate()
+        self.steps = self.stepCount.value
+        self.positions = self.buffers[self.steps % 2].copy()
+        self.published = self.positions.copy()
+        self.buffers = None
+        self.shared.close()
+        self.shared.unlink()
+        self.shared = None
+        self.process = None
+
+    def apply(self, field):
+        """
+        Give a CubeField the positions of the last finished step, if
+        it is newer than the last one given.  Returns True if it was.
+        """
+        if (self.process is not None):
+            # The process only writes the other buffer while this one is copied.
+            with self.lock:
+                steps = self.stepCount.value
+                positions = self.buffers[steps % 2].copy() if (steps != self.applied) else None
+        else:
+            with self.guard:
+                (positions, steps) = (self.published, self.steps)
+        if (steps == self.applied):
+            return False
+        self.applied = steps
+        field.positions = positions
+        field.motion += 1
+        return True
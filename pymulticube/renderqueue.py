@@ -0,0 +1,249 @@
+"""
+**********************************************************
+* RenderQueue:  A class to draw the cube faces sorted by
+* their texture and material state.  Each face of each cube
+* becomes a draw item with a sort key, the items are radix
+* sorted, and every run of items sharing a texture is drawn
+* with a single texture bind and a single vertex array draw.
+* The vertex data can be streamed through a StreamBuffer.
+* The sort is only redone when the set of cubes changes,
+* except for the depth order inside each run, which is
+* refreshed every frame so the opaque cubes are drawn front
+* to back and the depth test rejects the hidden fragments early.
+* The runs of each material state are drawn in the order of
+* their nearest cube, so the near cubes of later textures
+* also hide the far cubes of earlier ones.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import ctypes
+from OpenGL.GL import *
+from numpy import (arange, argsort, array, ascontiguousarray, flatnonzero, lexsort, take, unique,
+    int64, uint8)
+from pymulticube.tracer import tracer
+
+
+def radixSort(keys, bits = 32):
+    """
+    Return the order that sorts non-negative integer keys, using
+    a least significant digit radix sort on 8 bit digits.  Each
+    pass is a stable counting sort of one byte.
+    """
+    order = arange(len(keys))
+    for shift in range(0, bits, 8):
+        digits = ((keys[order] >> shift) & 0xFF).astype(uint8)
+        if (not digits.any()):
+            continue
+        order = order[argsort(digits, kind='stable')]
+    return order
+
+
+class RenderQueue:
+    """
+    RenderQueue:  Sorts the draw items, one per cube face, by
+    (material state, texture) and submits one batch per texture.
+    The number of texture state changes per frame is the number
+    of distinct textures rather than six per cube.
+    """
+    OPAQUE = 0
+    # The material state of a plain textured face.
+    STATESHIFT = 16
+    # The bit position of the material state in the sort key.
+    vertices = None
+    # The model space vertices of one cube, shape (36, 3).
+    texcoords = None
+    # The texture coordinates of one cube, shape (36, 2).
+    keys = None
+    # The sort key for each draw item.
+    order = None
+    # The draw items in sorted order, as item numbers.
+    batches = None
+    # The list of (texture ID, first item, item count) runs.
+    ids = None
+    # The texture ID for each texture rank in the keys.
+    builtVersion = -1
+    # The CubeField version the order was built for.
+    depthSort = True
+    # Draw the items of each batch front to back, and the batches by their nearest cube.
+    depths = None
+    # The view depth of each cube at the last depth sort.
+    stream = None
+    # The StreamBuffer for the per-frame vertex data, or None for client arrays.
+    uvRects = None
+    # The atlas texture coordinate rectangle of each image index, or None.
+    drawn = None
+    # The texture IDs drawn on the last frame.
+    shader = None
+    # The CubeShader spinning the cubes on the GPU, or None to transform them here.
+
+    def __init__(self, cube):
+        """
+        Take the cube vertex and texture array from
+        CubeMaker.createCube(True, False).
+        """
+        self.vertices = ascontiguousarray(cube[:, 0:3], 'f')
+        self.texcoords = ascontiguousarray(cube[:, 3:5], 'f')
+        self.batches = list()
+
+    def invalidate(self):
+        """
+        Force the items to be sorted again on the next frame.
+        """
+        self.builtVersion = -1
+
+    def build(self, field, textureID, states = None):
+        """
+        Create the draw items and sort them.  The textureID list maps
+        the image indices in field.indices to OpenGL texture IDs.  The
+        optional states array holds a material state per cube.
+        """
+        with tracer.span("RenderQueue.build", {"cubes": field.count}):
+            textures = array(textureID, int64)[field.indices.reshape(-1)]
+            # Dense texture ranks keep the keys small and the passes few.
+            (ids, ranks) = unique(textures, return_inverse=True)
+            self.keys = ranks.reshape(-1).astype(int64)
+            if (states is not None):
+                self.keys |= array(states, int64).repeat(6) << self.STATESHIFT
+            self.ids = ids
+            self.order = radixSort(self.keys)
+            self.batches = self.makeBatches(self.order)
+            self.builtVersion = field.version
+
+    def makeBatches(self, order):
+        """
+        Find the runs of equal keys in a sorted item order and
+        return them as (texture ID, first item, item count) batches.
+        """
+        sortedKeys = self.keys[order]
+        starts = flatnonzero(sortedKeys[1:] != sortedKeys[:-1]) + 1
+        starts = [0] + list(starts)
+        stops = starts[1:] + [len(sortedKeys)]
+        batches = list()
+        for (first, last) in zip(starts, stops):
+            if (last > first):
+                rank = sortedKeys[first] & ((1 << self.STATESHIFT) - 1)
+                batches.append((int(self.ids[rank]), int(first), int(last - first)))
+        return batches
+
+    def update(self, field, textureID):
+        """
+        Sort again only if the cubes or their images changed.
+        """
+        if (self.builtVersion != field.version):
+            self.build(field, textureID)
+
+    def sortByDepth(self, field, origin, front):
+        """
+        Reorder the items front to back by view depth while keeping
+        them grouped by key.  The radix sort is stable, so sorting the
+        depth ordered items by key leaves each batch front to back and
+        the batch boundaries unchanged.
+        """
+        self.depths = field.viewDepths(origin, front)
+        cubeOrder = argsort(self.depths, kind='stable')
+        items = ((cubeOrder * 6)[:, None] + arange(6)).reshape(-1)
+        self.order = items[radixSort(self.keys[items])]
+
+    def nearestFirst(self, order, batches):
+        """
+        Put the batches of each material state in the order of their
+        nearest cube.  After sortByDepth() a batch's first item is its
+        nearest, and the batches only name slices of the order, so
+        they may be drawn in any sequence.
+        """
+        firsts = order[[first for (texture, first, count) in batches]]
+        states = self.keys[firsts] >> self.STATESHIFT
+        nearest = self.depths[firsts // 6]
+        return [batches[index] for index in lexsort((nearest, states))]
+
+    def vertexArrays(self, field, order, verts = None, coords = None):
+        """
+        Transform all the cubes and gather the face vertices and
+        texture coordinates for the items in the given order.  When
+        the verts and coords arrays are given they are filled in place.
+        """
+        world = field.transform(self.vertices).reshape(-1, 3)
+        # Item i is face (i % 6) of cube (i // 6); each face has six vertices.
+        cubes = order // 6
+        faces = order % 6
+        rows = (((cubes * 36) + (faces * 6))[:, None] + arange(6)).reshape(-1)
+        faceRows = ((faces * 6)[:, None] + arange(6)).reshape(-1)
+        if (verts is None):
+            verts = ascontiguousarray(world[rows], 'f')
+            coords = ascontiguousarray(self.texcoords[faceRows], 'f')
+        else:
+            take(world, rows, axis=0, out=verts)
+            take(self.texcoords, faceRows, axis=0, out=coords)
+        if (self.uvRects is not None):
+            from pymulticube.atlas import remapTexCoords
+            # Move each face's coordinates into its image's atlas rectangle.
+            rects = self.uvRects[field.indices.reshape(-1)[order]]
+            faceCoords = coords.reshape(-1, 6, 2)
+            faceCoords[:] = remapTexCoords(faceCoords, rects[:, None, :])
+        return (verts, coords)
+
+    def streamArrays(self, field, order):
+        """
+        Write the vertex data straight into the stream buffer and
+        point the vertex and texture coordinate arrays at it.
+        """
+        count = len(order) * 6
+        coordOffset = self.stream.align(count * 12)
+        self.stream.reserve(coordOffset + self.stream.align(count * 8))
+        verts = self.stream.map('f', (count, 3))
+        coords = self.stream.map('f', (count, 2))
+        self.vertexArrays(field, order, verts, coords)
+        offset = self.stream.commit()
+        glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(offset))
+        glTexCoordPointer(2, GL_FLOAT, 0, ctypes.c_void_p(offset + coordOffset))
+
+    def draw(self, field, textureID, origin = None, front = None, visible = None):
+        """
+        Draw the cubes of the field, one batch per texture.  The
+        modelview matrix must hold the view transformation only.
+        Given the camera origin and front vector the items of each
+        batch are drawn front to back.  The optional visible array
+        of booleans, one per cube, skips the cubes marked False.
+        """
+        self.update(field, textureID)
+        self.drawn = list()
+        if (field.count == 0):
+            return
+        depthSorted = (self.depthSort) and (origin is not None)
+        if (depthSorted):
+            self.sortByDepth(field, origin, front)
+        order = self.order
+        batches = self.batches
+        if (visible is not None):
+            order = order[visible[order // 6]]
+            batches = self.makeBatches(order)
+            tracer.count("culledCubes", field.count - int(visible.sum()))
+        if ((depthSorted) and (len(batches) > 1)):
+            batches = self.nearestFirst(order, batches)
+        self.drawn = [texture for (texture, first, count) in batches]
+        if (len(order) == 0):
+            return
+        if (self.shader is not None):
+            self.shader.draw(field, order, batches, self.uvRects)
+            tracer.count("textureBinds", len(batches))
+            return
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        if (self.stream is not None):
+            self.streamArrays(field, order)
+        else:
+            (verts, coords) = self.vertexArrays(field, order)
+            glVertexPointer(3, GL_FLOAT, 0, verts)
+            glTexCoordPointer(2, GL_FLOAT, 0, coords)
+        glEnable(GL_TEXTURE_2D)
+        for (texture, first, count) in batches:
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glDrawArrays(GL_TRIANGLES, first * 6, count * 6)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glDisable(GL_TEXTURE_2D)
+        if (self.stream is not None):
+            self.stream.fence()
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        tracer.count("textureBinds", len(batches))
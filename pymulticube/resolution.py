@@ -0,0 +1,216 @@
+"""
+**********************************************************
+* ResolutionGovernor:  A class to hold the frame time to a
+* budget by drawing the scene at a lower resolution when
+* the frames run long.  The scene is drawn into a frame
+* buffer object at a share of the window size, the scale,
+* and stretched over the window.  The time of each frame,
+* the longer of the CPU time and the GPU time read from
+* timer queries a few frames late, is kept for the last
+* frames, and the scale is lowered when their mean passes
+* the budget and raised when it falls well under it.  The
+* gap between the two and a wait after each change keep the
+* scale from swinging back and forth.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from collections import deque
+from math import sqrt
+from time import perf_counter
+from OpenGL.GL import *
+from numpy import zeros
+from pymulticube.tracer import tracer
+
+
+def timerQueriesSupported():
+    """
+    True if the current context can time the GPU with queries.
+    """
+    try:
+        return bool(glGetQueryObjectui64v)
+    except Exception:
+        return False
+
+
+def framebuffersSupported():
+    """
+    True if the current context has frame buffer objects and blits.
+    """
+    try:
+        return bool(glGenFramebuffers) and bool(glBlitFramebuffer)
+    except Exception:
+        return False
+
+
+class ResolutionGovernor:
+    """
+    ResolutionGovernor:  Call begin() before drawing the scene, which
+    binds the scaled frame buffer, and end() after, which stretches it
+    over the window and updates the scale.  scale is the current share
+    of the window's width and height drawn.
+    """
+    HISTORY = 30
+    # The frames whose mean time sets the scale.
+    LOWER = 1.05
+    # Lower the scale when the mean passes this share of the budget.
+    RAISE = 0.8
+    # Raise the scale when the mean falls under this share of the budget.
+    HOLD = 15
+    # The frames after a change before the times count again.
+    STEP = 0.05
+    # The scale moves in steps of this size.
+    QUERIES = 3
+    # The timer queries used in turn, read two frames late.
+    budgetMs = 16.6
+    # The frame time aimed for in milliseconds.
+    minScale = 0.5
+    # The lowest scale.
+    maxScale = 1.0
+    # The highest scale.
+    scale = 1.0
+    # The share of the window's width and height drawn.
+    frameMs = 0.
+    # The mean frame time in the history in milliseconds.
+    changes = 0
+    # The number of times the scale has changed.
+    framebuffer = 0
+    # The frame buffer object drawn into.
+    renderbuffers = None
+    # The color and depth render buffers, the size of the window.
+    size = (0, 0)
+    # The window size the render buffers were made for.
+    drawSize = (0, 0)
+    # The size drawn at this frame.
+
+    def __init__(self, budgetMs = 16.6, minScale = 0.5, maxScale = 1.0):
+        """
+        Set the budget and the range of the scale.  A current OpenGL
+        context with frame buffer objects is required.
+        """
+        self.budgetMs = budgetMs
+        self.minScale = minScale
+        self.maxScale = maxScale
+        self.scale = maxScale
+        self.history = deque(maxlen=self.HISTORY)
+        self.held = 0
+        self.framebuffer = int(glGenFramebuffers(1))
+        self.renderbuffers = [int(x) for x in glGenRenderbuffers(2)]
+        self.queries = None
+        if (timerQueriesSupported()):
+            self.queries = [int(x) for x in glGenQueries(self.QUERIES)]
+            self.issued = [False] * self.QUERIES
+            self.current = 0
+            self.result = zeros(1, 'uint64')
+            self.available = zeros(1, 'int32')
+        self.gpuMs = 0.
+        self.started = 0.
+
+    def allocate(self, width, height):
+        """
+        Size the render buffers to the window, the most drawn.
+        """
+        glBindRenderbuffer(GL_RENDERBUFFER, self.renderbuffers[0])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.renderbuffers[1])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.renderbuffers[0])
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.renderbuffers[1])
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if (status != GL_FRAMEBUFFER_COMPLETE):
+            raise RuntimeError("The scaled frame buffer is not complete, status " + hex(int(status)) + ".")
+        self.size = (width, height)
+
+    def begin(self, width, height):
+        """
+        Bind and clear the frame buffer and set the viewport to the
+        scaled size, which is returned.
+        """
+        self.started = perf_counter()
+        if ((width, height) != self.size):
+            self.allocate(width, height)
+        self.drawSize = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        if (self.queries is not None):
+            glBeginQuery(GL_TIME_ELAPSED, self.queries[self.current])
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glViewport(0, 0, self.drawSize[0], self.drawSize[1])
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        return self.drawSize
+
+    def end(self, width, height):
+        """
+        Stretch the drawing over the window, whose frame buffer is
+        bound again, and record the frame's time.
+        """
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+        glBlitFramebuffer(0, 0, self.drawSize[0], self.drawSize[1], 0, 0, width, height,
+            GL_COLOR_BUFFER_BIT, GL_LINEAR)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glViewport(0, 0, width, height)
+        if (self.queries is not None):
+            glEndQuery(GL_TIME_ELAPSED)
+            self.issued[self.current] = True
+            self.current = (self.current + 1) % self.QUERIES
+            self.collect()
+        self.record(max((perf_counter() - self.started) * 1000.0, self.gpuMs))
+
+    def collect(self):
+        """
+        Read the oldest timer query if the GPU has finished it, so
+        reading never waits.  The last GPU time is kept otherwise.
+        """
+        query = self.current
+        if (not self.issued[query]):
+            return
+        glGetQueryObjectiv(self.queries[query], GL_QUERY_RESULT_AVAILABLE, self.available)
+        if (self.available[0]):
+            glGetQueryObjectui64v(self.queries[query], GL_QUERY_RESULT, self.result)
+            self.gpuMs = int(self.result[0]) / 1000000.0
+            self.issued[query] = False
+
+    def record(self, milliseconds):
+        """
+        Add a frame's time and change the scale if the mean of the
+        history is out of the band around the budget.
+        """
+        if (self.held > 0):
+            self.held -= 1
+            return
+        self.history.append(milliseconds)
+        if (len(self.history) < self.HISTORY):
+            return
+        self.frameMs = sum(self.history) / len(self.history)
+        tracer.count("frameMs", self.frameMs)
+        if (((self.frameMs > self.budgetMs * self.LOWER) and (self.scale > self.minScale))
+                or ((self.frameMs < self.budgetMs * self.RAISE) and (self.scale < self.maxScale))):
+            # The cost goes with the area drawn, the square of the scale.
+            scale = self.scale * sqrt(self.budgetMs / max(self.frameMs, 1e-3))
+            scale = round(scale / self.STEP) * self.STEP
+            # Move at least one step.
+            if (self.frameMs > self.budgetMs):
+                scale = min(scale, self.scale - self.STEP)
+            else:
+                scale = max(scale, self.scale + self.STEP)
+            scale = round(min(max(scale, self.minScale), self.maxScale), 2)
+            if (scale != self.scale):
+                tracer.event("ResolutionGovernor.scale", lambda: {"from": self.scale, "to": scale,
+                    "frameMs": self.frameMs})
+                self.scale = scale
+                self.changes += 1
+                tracer.count("renderScale", self.scale)
+                # The times at the old scale no longer count.
+                self.history.clear()
+                self.held = self.HOLD
+
+    def delete(self):
+        """
+        Release the frame buffer, render buffers and queries.
+        """
+        glDeleteFramebuffers(1, [self.framebuffer])
+        glDeleteRenderbuffers(2, self.renderbuffers)
+        if (self.queries is not None):
+            glDeleteQueries(self.QUERIES, self.queries)
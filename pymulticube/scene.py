@@ -0,0 +1,299 @@
+"""
+**********************************************************
+* Scene:  A class to read a scene description file, in JSON
+* or TOML, naming the cube pictures, the sky box, the sound,
+* the number of cubes, the volume they are placed in, the
+* range of their spin rates and the render settings.  The
+* file is checked against a schema, with every problem
+* reported by its path in the file, and the cubes are placed
+* with numpy so large scenes are quick to set up.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import glob
+import json
+import os
+from numpy import arange, array, ceil, floor, maximum
+from numpy.random import default_rng
+from pymulticube.cubefield import CubeField
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+# The layout of a scene file.  A type is a value of that type, a list
+# holds the type of its items, a dict holds the layout of its keys and a
+# tuple holds the values allowed.  Keys marked required in REQUIRED must
+# be given, the rest take the defaults in DEFAULTS.
+SCHEMA = {
+    "images": {"background": str, "pictures": [str]},
+    "cubes": int,
+    "seed": int,
+    "volume": {"center": [float], "size": [float], "spacing": float},
+    "spin": {"min": float, "max": float},
+    "skybox": [str],
+    "sound": str,
+    "render": {
+        "animation": ("gpu", "cpu"),
+        "occlusion": ("auto", "hiz", "off"),
+        "streaming": ("persistent", "orphan", "off"),
+        "mipmaps": ("box", "lanczos", "gpu"),
+        "depthSort": bool,
+        "atlas": bool,
+    },
+}
+REQUIRED = ("images", "images.background", "images.pictures", "skybox")
+# The keys a scene must give.
+DEFAULTS = {
+    "volume": {"center": [0.0, 0.0, -15.0], "size": [20.0, 20.0, 20.0], "spacing": 1.5},
+    "spin": {"min": 0.0, "max": 2.0},
+    "render": {},
+}
+# The values of the optional keys.
+RENDEROPTIONS = {"animation": "animation", "occlusion": "occlusion", "streaming": "streaming",
+    "mipmaps": "mipmaps", "atlas": "atlas", "depthSort": "no_depth_sort"}
+# The command line option for each render setting.
+
+
+class SceneError(ValueError):
+    """
+    SceneError:  Raised for a scene file that cannot be used.
+    """
+
+
+def checkValue(value, layout, path, problems):
+    """
+    Check a value against its layout, adding a message for each
+    problem found to the problems list.
+    """
+    if (isinstance(layout, dict)):
+        if (not isinstance(value, dict)):
+            problems.append(path + ": expected a table of settings.")
+            return
+        for key in value:
+            if (key not in layout):
+                problems.append(path + "." + key + ": unknown setting.")
+            else:
+                checkValue(value[key], layout[key], path + "." + key, problems)
+    elif (isinstance(layout, list)):
+        if (not isinstance(value, list)):
+            problems.append(path + ": expected a list.")
+            return
+        for index in range(len(value)):
+            checkValue(value[index], layout[0], path + "[" + str(index) + "]", problems)
+    elif (isinstance(layout, tuple)):
+        if (value not in layout):
+            problems.append(path + ": expected one of " + ", ".join(layout) + ".")
+    elif (layout is float):
+        if ((not isinstance(value, (int, float))) or (isinstance(value, bool))):
+            problems.append(path + ": expected a number.")
+    elif (layout is int):
+        if ((not isinstance(value, int)) or (isinstance(value, bool))):
+            problems.append(path + ": expected a whole number.")
+    elif (not isinstance(value, layout)):
+        problems.append(path + ": expected a " + layout.__name__ + ".")
+
+
+def validate(data):
+    """
+    Check a parsed scene, raising SceneError listing every problem.
+    """
+    problems = list()
+    checkValue(data, SCHEMA, "scene", problems)
+    if (isinstance(data, dict)):
+        for required in REQUIRED:
+            value = data
+            for key in required.split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            if (value is None):
+                problems.append("scene." + required + ": required.")
+        if (len(problems) == 0):
+            if (len(data["skybox"]) != 6):
+                problems.append("scene.skybox: expected six pictures.")
+            if (len(data["images"]["pictures"]) == 0):
+                problems.append("scene.images.pictures: expected at least one picture.")
+            if (data.get("cubes", 1) < 1):
+                problems.append("scene.cubes: expected at least one cube.")
+            volume = data.get("volume", {})
+            for key in ("center", "size"):
+                if ((key in volume) and (len(volume[key]) != 3)):
+                    problems.append("scene.volume." + key + ": expected three numbers.")
+            if (("size" in volume) and (min(volume["size"], default=1.0) <= 0)):
+                problems.append("scene.volume.size: expected sizes more than zero.")
+            if (volume.get("spacing", 1.0) <= 0):
+                problems.append("scene.volume.spacing: expected more than zero.")
+            spin = data.get("spin", {})
+            if (spin.get("min", 0.0) > spin.get("max", 2.0)):
+                problems.append("scene.spin: min is more than max.")
+    if (len(problems) > 0):
+        raise SceneError("\n".join(problems))
+
+
+def placeCubes(rng, center, size, count, spacing):
+    """
+    Place count cubes in the volume of a center and size at least
+    spacing apart: the volume is split into cells, the cubes take
+    random cells and each is moved at random within its cell,
+    keeping clear of the neighboring cells.
+    """
+    center = array(center, 'f')
+    size = array(size, 'f')
+    cell = 2.0 * spacing
+    cells = maximum(floor(size / cell), 1).astype(int)
+    total = int(cells.prod())
+    if (total < count):
+        # Shrink the cells, down to the spacing, to make room.
+        cell = max(float((size.prod() / count) ** (1.0 / 3.0)), spacing)
+        cells = maximum(floor(size / cell), 1).astype(int)
+        total = int(cells.prod())
+        if (total < count):
+            cells = ceil(cells * (count / total) ** (1.0 / 3.0)).astype(int)
+            total = int(cells.prod())
+            print("\n\tThe scene volume is too small for", count,
+                "cubes", spacing, "apart, they will be closer.")
+    chosen = rng.choice(total, count, replace=False)
+    (ix, rest) = (chosen // (cells[1] * cells[2]), chosen % (cells[1] * cells[2]))
+    (iy, iz) = (rest // cells[2], rest % cells[2])
+    step = size / cells
+    corner = center - size * 0.5
+    slack = maximum(step - spacing, 0.0) * 0.5
+    jitter = rng.uniform(-1.0, 1.0, (count, 3)) * slack
+    return corner + (array([ix, iy, iz]).T + 0.5) * step + jitter
+
+
+def layCubes(rng, center, size, count, spacing, spinMin, spinMax, pictures):
+    """
+    Lay out count cubes in the volume of a center and size in a new
+    CubeField, with random spin axes and rates, the faces taking
+    the pictures 1 to pictures in turn.
+    """
+    field = CubeField(count)
+    field.positions[:] = placeCubes(rng, center, size, count, spacing)
+    field.xaxes[:] = rng.normal(size=(count, 3))
+    field.yaxes[:] = rng.normal(size=(count, 3))
+    field.normalizeAxes()
+    field.angles[:, 2:4] = rng.uniform(spinMin, spinMax, (count, 2))
+    # The faces take the pictures in turn, picture 1 onward, as permLoc() does.
+    faces = arange(count * 6).reshape(count, 6)
+    field.indices[:] = (faces % pictures) + 1
+    return field
+
+
+class Scene:
+    """
+    Scene:  Load a scene file with Scene(filename), then use
+    boxImages(), skybox, sound and createField() in place of the
+    built in pictures and cube layout.
+    """
+    filename = None
+    # The scene file.
+    background = None
+    # The background picture for every cube face.
+    pictures = None
+    # The pictures for the cube faces, with the patterns expanded.
+    cubes = 0
+    # The number of cubes.
+    seed = None
+    # The random seed for the layout, or None for a new layout each run.
+    center = None
+    # The center of the volume the cubes are placed in.
+    size = None
+    # The size of that volume along each axis.
+    spacing = 1.5
+    # The least distance between cube centers.
+    spinMin = 0.0
+    # The least spin rate in degrees per animation step.
+    spinMax = 2.0
+    # The greatest spin rate in degrees per animation step.
+    skybox = None
+    # The six sky box pictures.
+    sound = None
+    # The sound file, or None for the built in one.
+    render = None
+    # The render settings.
+
+    def __init__(self, filename):
+        """
+        Read and check a .json or .toml scene file.
+        """
+        self.filename = filename
+        if ((filename.endswith(".toml")) and (tomllib is None)):
+            raise SceneError("TOML scene files need Python 3.11 or later.")
+        try:
+            if (filename.endswith(".toml")):
+                with open(filename, "rb") as infile:
+                    data = tomllib.load(infile)
+            else:
+                with open(filename) as infile:
+                    data = json.load(infile)
+        except OSError as error:
+            raise SceneError("Unable to read the scene " + filename + ": " + str(error))
+        except ValueError as error:
+            raise SceneError("The scene " + filename + " is not valid: " + str(error))
+        validate(data)
+        self.load(data)
+
+    def path(self, name):
+        """
+        A file name from the scene, relative to the scene file.
+        """
+        return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(self.filename)),
+            os.path.expanduser(name)))
+
+    def load(self, data):
+        """
+        Take the settings from a checked scene.
+        """
+        volume = dict(DEFAULTS["volume"], **data.get("volume", {}))
+        spin = dict(DEFAULTS["spin"], **data.get("spin", {}))
+        self.background = self.path(data["images"]["background"])
+        self.pictures = list()
+        for pattern in data["images"]["pictures"]:
+            matches = sorted(glob.glob(self.path(pattern)))
+            if (len(matches) == 0):
+                raise SceneError("scene.images.pictures: nothing matches " + pattern + ".")
+            self.pictures.extend(matches)
+        self.cubes = data.get("cubes", 2 * len(self.pictures))
+        self.seed = data.get("seed")
+        self.center = array(volume["center"], 'f')
+        self.size = array(volume["size"], 'f')
+        self.spacing = float(volume["spacing"])
+        self.spinMin = float(spin["min"])
+        self.spinMax = float(spin["max"])
+        self.skybox = [self.path(name) for name in data["skybox"]]
+        self.sound = self.path(data["sound"]) if ("sound" in data) else None
+        self.render = dict(data.get("render", {}))
+
+    def boxImages(self):
+        """
+        The image list for CreateImage.doubleImage(): the background
+        first, then the pictures.  doubleImage() skips the last entry,
+        so the background is repeated at the end.
+        """
+        return [self.background] + self.pictures + [self.background]
+
+    def applyRender(self, options, parser):
+        """
+        Copy the render settings into the command line options that
+        were left at their defaults, so the command line wins.
+        """
+        for (key, value) in self.render.items():
+            dest = RENDEROPTIONS[key]
+            if (key == "depthSort"):
+                value = not value
+            if (getattr(options, dest) == parser.get_default(dest)):
+                setattr(options, dest, value)
+
+    def placements(self, rng):
+        """
+        Place the cubes in the volume at least spacing apart.
+        """
+        return placeCubes(rng, self.center, self.size, self.cubes, self.spacing)
+
+    def createField(self):
+        """
+        Lay out the cubes in a new CubeField.
+        """
+        return layCubes(default_rng(self.seed), self.center, self.size, self.cubes, self.spacing,
+            self.spinMin, self.spinMax, len(self.pictures))
@@ -0,0 +1,84 @@
+"""
+**********************************************************
+* Snapshot:  Functions to save the state of a scene, the
+* cube places, spin axes, angles and pictures, the camera
+* and the picture lists, to one binary file, and to load it
+* again by memory mapping, so a scene comes back exactly and
+* at once.  The file is a fixed header, the cube arrays at
+* aligned offsets and a JSON index at the end.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import json
+import os
+import struct
+from numpy import ascontiguousarray, dtype as numpytype, memmap, uint8
+from pymulticube.cubefield import CubeField
+
+MAGIC = b"PMCSNAP\0"
+# The first bytes of every snapshot file.
+VERSION = 1
+# The snapshot format version.
+HEADER = struct.Struct("<8sIIQQ")
+# Magic, version, cube count, index offset and index length.
+ALIGNMENT = 64
+# The byte alignment of every array in the file.
+ARRAYS = (("positions", 'f'), ("xaxes", 'f'), ("yaxes", 'f'), ("angles", 'f'), ("indices", 'i'))
+# The CubeField arrays saved and their types.
+
+
+def saveSnapshot(filename, field, camera = None, extra = None):
+    """
+    Save a CubeField, the state of a Camera and a dictionary of
+    extra JSON values.  The file is replaced in one step.
+    """
+    index = {"arrays": dict(), "camera": None, "extra": extra or dict()}
+    if (camera is not None):
+        index["camera"] = camera.getState()
+    partial = filename + ".part"
+    with open(partial, "wb") as outfile:
+        outfile.write(b"\0" * HEADER.size)
+        for (name, kind) in ARRAYS:
+            data = ascontiguousarray(getattr(field, name), numpytype(kind).newbyteorder("<"))
+            outfile.write(b"\0" * ((-outfile.tell()) % ALIGNMENT))
+            index["arrays"][name] = [outfile.tell(), data.dtype.str, list(data.shape)]
+            outfile.write(data.tobytes())
+        text = json.dumps(index).encode("utf-8")
+        offset = outfile.tell()
+        outfile.write(text)
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, VERSION, field.count, offset, len(text)))
+    os.replace(partial, filename)
+
+
+def loadSnapshot(filename):
+    """
+    Map a snapshot file.  Returns a CubeField whose arrays are copy
+    on write views of the file, the saved camera state or None, and
+    the extra values.  Raises ValueError for a file that is not a
+    snapshot of this version.
+    """
+    data = memmap(filename, dtype=uint8, mode="c")
+    if (len(data) < HEADER.size):
+        raise ValueError("Snapshot " + filename + " is too short.")
+    (magic, version, count, offset, length) = HEADER.unpack(data[0:HEADER.size].tobytes())
+    if (magic != MAGIC):
+        raise ValueError(filename + " is not a snapshot.")
+    if (version != VERSION):
+        raise ValueError("Snapshot " + filename + " has version " + str(version)
+            + ", expected " + str(VERSION) + ".")
+    index = json.loads(data[offset:offset + length].tobytes().decode("utf-8"))
+    arrays = list()
+    for (name, kind) in ARRAYS:
+        (start, typestr, shape) = index["arrays"][name]
+        kind = numpytype(typestr)
+        nbytes = kind.itemsize
+        for size in shape:
+            nbytes *= size
+        arrays.append(data[start:start + nbytes].view(kind).reshape(shape))
+    if (len(arrays[0]) != count):
+        raise ValueError("Snapshot " + filename + " has a damaged index.")
+    field = CubeField()
+    field.setArrays(*arrays)
+    return (field, index["camera"], index["extra"])
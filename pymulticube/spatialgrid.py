@@ -0,0 +1,90 @@
+"""
+**********************************************************
+* SpatialGrid:  A class to find the cubes near a point
+* without looking at every cube.  Space is cut into cubic
+* cells, each cube is filed under the cell holding its
+* center, and the cubes are kept sorted by cell so the
+* cubes of any cell are one run of the sorted order, found
+* with a binary search.  A query looks at the few cells
+* around it, so its cost does not grow with the number of
+* cubes, and the grid is rebuilt in one numpy sort when
+* the cubes move.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from numpy import arange, argsort, array, concatenate, floor, int64, searchsorted, zeros
+from pymulticube.tracer import tracer
+
+CELLBITS = 21
+# The bits given to each cell coordinate in a cell key.
+CELLOFFSET = 1 << (CELLBITS - 1)
+# Added to the cell coordinates so negative cells fit the key.
+
+
+def cellKeys(cells):
+    """
+    One int64 key for each row of (n, 3) integer cell coordinates.
+    """
+    cells = cells.astype(int64) + CELLOFFSET
+    return (cells[..., 0] << (2 * CELLBITS)) | (cells[..., 1] << CELLBITS) | cells[..., 2]
+
+
+class SpatialGrid:
+    """
+    SpatialGrid:  Call build() with the cube centers, then near()
+    for the cubes within reach of a point.  The cell size should
+    be at least the reach of most queries.
+    """
+    cellSize = 2.0
+    # The edge of a cell.
+    order = None
+    # The cube indices sorted by cell.
+    keys = None
+    # The cell key of each cube in sorted order.
+    count = 0
+    # The number of cubes filed.
+
+    def __init__(self, cellSize = 2.0):
+        """
+        Set the cell size, the grid is empty until build().
+        """
+        self.cellSize = cellSize
+        self.order = zeros(0, int64)
+        self.keys = zeros(0, int64)
+
+    def cells(self, points):
+        """
+        The integer cell coordinates of points, shape (n, 3).
+        """
+        return floor(points / self.cellSize).astype(int64)
+
+    def build(self, positions):
+        """
+        File the cubes at positions, shape (n, 3), under their cells.
+        """
+        with tracer.span("SpatialGrid.build", {"cubes": len(positions)}):
+            keys = cellKeys(self.cells(positions))
+            self.order = argsort(keys, kind="stable")
+            self.keys = keys[self.order]
+            self.count = len(positions)
+
+    def near(self, point, reach):
+        """
+        The cubes with centers in the cells within reach of a point.
+        The caller makes the exact test.
+        """
+        point = array(point, 'f')
+        lower = self.cells((point - reach)[None, :])[0]
+        upper = self.cells((point + reach)[None, :])[0]
+        span = upper - lower + 1
+        # Every cell in the block from lower to upper.
+        steps = arange(span.prod())
+        offsets = array([steps // (span[1] * span[2]), (steps // span[2]) % span[1], steps % span[2]]).T
+        keys = cellKeys(lower + offsets)
+        starts = searchsorted(self.keys, keys, "left")
+        ends = searchsorted(self.keys, keys, "right")
+        runs = [self.order[start:end] for (start, end) in zip(starts, ends) if (end > start)]
+        if (len(runs) == 0):
+            return zeros(0, int64)
+        return concatenate(runs)
@@ -0,0 +1,185 @@
+"""
+**********************************************************
+* StreamBuffer:  A class to stream data that changes every
+* frame to an OpenGL buffer object.  The buffer is split in
+* three regions used in turn, so the CPU writes one region
+* while the GPU still reads the others.  Where the context
+* supports glBufferStorage the buffer is persistently mapped
+* and the data is written straight into it through a numpy
+* view, with a fence per region to keep the CPU from writing
+* a region the GPU has not finished with.  Otherwise the
+* data is written to a numpy staging array and uploaded into
+* an orphaned buffer each frame.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import ctypes
+from OpenGL.GL import *
+from numpy import frombuffer, zeros, dtype as numpytype
+from pymulticube.tracer import tracer
+
+
+def persistentSupported():
+    """
+    True if the current context provides glBufferStorage.
+    """
+    try:
+        return bool(glBufferStorage) and bool(glFenceSync)
+    except Exception:
+        return False
+
+
+class StreamBuffer:
+    """
+    StreamBuffer:  For each frame call map() to get numpy views to
+    write into, commit() to make the data available and get its
+    byte offset in the buffer, draw with the buffer bound, then
+    call fence() once the draw calls using the region are issued.
+    """
+    REGIONS = 3
+    # The number of regions, one being written and two in flight.
+    ALIGNMENT = 256
+    # The byte alignment of each region and each mapped view.
+    TIMEOUT = 1000000
+    # The fence wait in nanoseconds before trying again.
+    target = GL_ARRAY_BUFFER
+    # The buffer binding target.
+    bufferID = 0
+    # The OpenGL buffer object.
+    regionBytes = 0
+    # The size of one region in bytes.
+    persistent = False
+    # True when the buffer is persistently mapped.
+    memory = None
+    # The numpy byte view of the whole buffer, mapped or staging.
+    fences = None
+    # The fence for each region, or None.
+    region = 0
+    # The region being written.
+    used = 0
+    # The bytes handed out in the current region.
+    stalls = 0
+    # The number of times the CPU had to wait for a fence.
+
+    def __init__(self, regionBytes, usePersistent = True, target = GL_ARRAY_BUFFER):
+        """
+        Create the buffer with room for regionBytes per frame.  A
+        current OpenGL context is required.
+        """
+        self.target = target
+        self.persistent = usePersistent and persistentSupported()
+        self.allocate(regionBytes)
+        print("\n\tStreaming buffer using",
+            "persistent mapping." if self.persistent else "buffer orphaning.")
+
+    def align(self, value):
+        return (value + self.ALIGNMENT - 1) & ~(self.ALIGNMENT - 1)
+
+    def allocate(self, regionBytes):
+        """
+        (Re)create the buffer object with regions of at least regionBytes.
+        """
+        self.release()
+        self.regionBytes = self.align(max(regionBytes, self.ALIGNMENT))
+        total = self.regionBytes * self.REGIONS
+        self.fences = [None] * self.REGIONS
+        self.region = 0
+        self.used = 0
+        self.bufferID = int(glGenBuffers(1))
+        glBindBuffer(self.target, self.bufferID)
+        if (self.persistent):
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            glBufferStorage(self.target, total, None, flags)
+            pointer = glMapBufferRange(self.target, 0, total, flags)
+            address = ctypes.cast(pointer, ctypes.c_void_p).value
+            self.memory = frombuffer((ctypes.c_ubyte * total).from_address(address), 'B')
+        else:
+            glBufferData(self.target, total, None, GL_STREAM_DRAW)
+            self.memory = zeros(total, 'B')
+        glBindBuffer(self.target, 0)
+
+    def reserve(self, nbytes):
+        """
+        Make sure a single frame can hold nbytes, growing the buffer if not.
+        """
+        if (nbytes > self.regionBytes):
+            self.allocate(nbytes * 2)
+
+    def waitRegion(self):
+        """
+        Wait until the GPU is done with the current region.
+        """
+        fence = self.fences[self.region]
+        if (fence is None):
+            return
+        with tracer.span("StreamBuffer.wait"):
+            result = glClientWaitSync(fence, 0, 0)
+            if (result == GL_TIMEOUT_EXPIRED):
+                self.stalls += 1
+                tracer.count("streamStalls", self.stalls)
+                while (result == GL_TIMEOUT_EXPIRED):
+                    result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, self.TIMEOUT)
+            glDeleteSync(fence)
+        self.fences[self.region] = None
+
+    def map(self, kind, shape):
+        """
+        Return a numpy array of the given dtype and shape that lives
+        in the current region.  Several views may be taken per frame.
+        """
+        kind = numpytype(kind)
+        count = 1
+        for size in shape:
+            count *= size
+        nbytes = count * kind.itemsize
+        if (self.used == 0):
+            self.waitRegion()
+        start = self.region * self.regionBytes + self.used
+        self.used = self.align(self.used + nbytes)
+        if (self.used > self.regionBytes):
+            raise ValueError("StreamBuffer region of " + str(self.regionBytes)
+                + " bytes is too small, call reserve() first.")
+        return self.memory[start:start + nbytes].view(kind).reshape(shape)
+
+    def commit(self):
+        """
+        Finish writing the current region.  The buffer is left bound
+        and the byte offset of the region in it is returned.
+        """
+        start = self.region * self.regionBytes
+        glBindBuffer(self.target, self.bufferID)
+        if (not self.persistent):
+            # Orphan the old storage so the driver never waits on the GPU.
+            glBufferData(self.target, self.regionBytes * self.REGIONS, None, GL_STREAM_DRAW)
+            glBufferSubData(self.target, start, self.used, self.memory[start:start + self.used])
+        return start
+
+    def fence(self):
+        """
+        Mark the end of the draw calls reading the current region and
+        move on to the next region.
+        """
+        if (self.persistent):
+            self.fences[self.region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glBindBuffer(self.target, 0)
+        self.region = (self.region + 1) % self.REGIONS
+        self.used = 0
+
+    def release(self):
+        """
+        Delete the buffer object and its fences.
+        """
+        if (self.fences is not None):
+            for fence in self.fences:
+                if (fence is not None):
+                    glDeleteSync(fence)
+        self.fences = None
+        self.memory = None
+        if (self.bufferID):
+            if (self.persistent):
+                glBindBuffer(self.target, self.bufferID)
+                glUnmapBuffer(self.target)
+                glBindBuffer(self.target, 0)
+            glDeleteBuffers(1, [self.bufferID])
+        self.bufferID = 0
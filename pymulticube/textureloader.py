@@ -0,0 +1,289 @@
+"""
+**********************************************************
+* TextureLoader:  A class to load the textures without
+* holding up the first frame.  Every texture starts as a
+* one pixel placeholder, the pictures are decoded by a pool
+* of worker threads, and the results are uploaded a few at
+* a time from the render loop, within a budget of time and
+* bytes per frame, so a texture swap never causes a hitch.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from OpenGL.GL import *
+from numpy import array, concatenate
+from PIL import Image
+from pymulticube.tracer import tracer
+
+
+class TextureLoader:
+    """
+    TextureLoader:  Decode pictures in the background with the
+    CreateImage class and upload them when pump() is called.
+    """
+    budgetMs = 4.0
+    # The upload time allowed per frame in milliseconds.
+    budgetBytes = 8 * 1024 * 1024
+    # The upload size allowed per frame in bytes.
+    placeholderColor = (128, 128, 128, 255)
+    # The color of the placeholder textures.
+    outstanding = 0
+    # The number of textures not yet uploaded.
+    mipmaps = None
+    # The MipBuilder making the mipmaps on the workers, or None to
+    # leave them to glGenerateMipmap.
+    manager = None
+    # The TextureManager allocating and tracking the textures, or None
+    # to number them from the start index.
+
+    def __init__(self, image, workers = 4, budgetMs = 4.0, budgetBytes = 8 * 1024 * 1024, mipmaps = None):
+        """
+        Take a CreateImage instance to do the decoding and uploading,
+        and optionally a MipBuilder.
+        """
+        self.image = image
+        self.mipmaps = mipmaps
+        self.budgetMs = budgetMs
+        self.budgetBytes = budgetBytes
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode")
+        self.ready = queue.Queue()
+        self.outstanding = 0
+
+    def placeholder(self, textureID, target = GL_TEXTURE_2D):
+        """
+        Make a texture ID a single pixel texture until the real one arrives.
+        """
+        pixel = array(self.placeholderColor, "uint8")
+        glBindTexture(target, textureID)
+        glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+        if (target == GL_TEXTURE_CUBE_MAP):
+            for i in range(6):
+                glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixel)
+        else:
+            glTexImage2D(target, 0, GL_RGBA, 1, 1, 0, GL_RGBA, GL_UNSIGNED_BYTE, pixel)
+        # No mipmaps yet, so no mipmap filter.
+        glTexParameteri(target, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(target, 0)
+
+    def textureIDs(self, count, startindex = 0):
+        """
+        Allocate count texture IDs from the manager, or number them
+        from startindex without one.
+        """
+        if (self.manager is not None):
+            return self.manager.allocate(count)
+        return [startindex + x for x in range(count)]
+
+    def request(self, textureID, job, *args, pinned = False):
+        """
+        Submit the job loading a texture, and give it to the manager
+        to run again if the texture is evicted.
+        """
+        if (self.manager is not None):
+            self.manager.track(textureID, job, args, pinned)
+        return self.submit(job, *args)
+
+    def submit(self, job, *args):
+        """
+        Run a decode job on the pool.  Its result, an (upload function,
+        arguments, byte count) tuple, is queued for pump().
+        """
+        self.outstanding += 1
+        future = self.pool.submit(job, *args)
+        future.add_done_callback(self.ready.put)
+        return future
+
+    def loadDoubleImages(self, imagearray, startindex = 0):
+        """
+        The asynchronous form of CreateImage.doubleImage(): returns the
+        texture IDs at once, with placeholders behind them.
+        """
+        textureID = self.textureIDs(len(imagearray), startindex)
+        for x in range(len(imagearray)):
+            self.placeholder(textureID[x])
+        background = self.pool.submit(self.image.loadImage, imagearray[0])
+        for x in range(len(imagearray) - 1):
+            self.request(textureID[x], self.decodeDouble, background, imagearray[x], textureID[x], imagearray[0])
+        return textureID
+
+    def decodeDouble(self, background, filename, textureID, backname = None):
+        """
+        Worker job: composite one picture on the shared background.
+        With a MipBuilder the mipmaps are made here too, or read from
+        its cache without decoding at all.
+        """
+        if (self.mipmaps is not None):
+            # The blend mode and fit change the pixels, so a chain cached under others is not used.
+            compositor = self.image.compositor
+            levels = self.mipmaps.build(lambda: self.decodeComposite(background, filename)[2],
+                ["double", backname, filename, compositor.mode, compositor.fit], (backname, filename))
+            nbytes = sum([level.nbytes for level in levels])
+            return (self.image.uploadMipmaps, (textureID, levels), nbytes)
+        (width, height, pixels) = self.decodeComposite(background, filename)
+        return (self.image.uploadTexture, (textureID, width, height, pixels), pixels.nbytes)
+
+    def decodeComposite(self, background, filename):
+        """
+        Composite one picture once the background future is done.
+        """
+        with tracer.span("TextureLoader.decode", {"file": filename}):
+            return self.image.compositeImage(background.result(), filename)
+
+    def loadPackImages(self, imagearray, pack, startindex = 0):
+        """
+        The image pack form of loadDoubleImages(): the double images
+        held by the PackReader are uploaded straight from the mapped
+        file, and any it lacks are decoded as usual.  A pack built over
+        another background or with another blend mode or fit is not
+        used.
+        """
+        if (not pack.builtFor(imagearray[0], self.image.compositor)):
+            print("\n\tThe image pack ", pack.filename, " was built with another background, blend mode or fit, decoding the pictures.")
+            pack.close()
+            return self.loadDoubleImages(imagearray, startindex)
+        textureID = self.textureIDs(len(imagearray), startindex)
+        for x in range(len(imagearray)):
+            self.placeholder(textureID[x])
+        pack.prefetch()
+        background = None
+        for x in range(len(imagearray) - 1):
+            if (pack.levels(imagearray[x]) is not None):
+                self.request(textureID[x], self.readPack, pack, imagearray[x], textureID[x])
+                continue
+            if (background is None):
+                background = self.pool.submit(self.image.loadImage, imagearray[0])
+            self.request(textureID[x], self.decodeDouble, background, imagearray[x], textureID[x], imagearray[0])
+        return textureID
+
+    def readPack(self, pack, filename, textureID):
+        """
+        Worker job: find the levels of one image in the pack.  The
+        views are not copied, the upload reads the mapped file.
+        """
+        levels = pack.levels(filename)
+        return (self.image.uploadMipmaps, (textureID, levels), sum([level.nbytes for level in levels]))
+
+    def loadAtlasImages(self, imagearray, atlas, startindex = 0):
+        """
+        The atlas form of loadDoubleImages(): the double images are
+        packed into atlas pages, one texture per page.  Returns the
+        texture ID for each image and the (images, 4) array of the
+        texture coordinate rectangles.  Every double image has the
+        size of the background, imagearray[0].
+        """
+        # As in doubleImage() the last picture is not loaded.
+        names = imagearray[:-1]
+        size = Image.open(imagearray[0]).size
+        rects = atlas.layout(names, [size] * len(names))
+        pageID = self.textureIDs(atlas.pages, startindex)
+        for page in range(atlas.pages):
+            self.placeholder(pageID[page])
+        textureID = [pageID[atlas.pageOf(x)] for x in range(len(names))]
+        # The unused last image shares the first image's place.
+        textureID.append(textureID[0])
+        rects = concatenate((rects, rects[0:1]))
+        background = self.pool.submit(self.image.loadImage, imagearray[0])
+        decoded = list()
+        for x in range(len(names)):
+            decoded.append(self.pool.submit(self.decodeComposite, background, names[x]))
+        # Padding p keeps the levels up to log2(p) clean of the neighbors.
+        maxLevel = max(int(atlas.padding).bit_length() - 1, 0)
+        # The pages share the decoded images, so they are not evicted.
+        for page in range(atlas.pages):
+            self.request(pageID[page], self.composePage, atlas, page, decoded, pageID[page], maxLevel, pinned=True)
+        return (textureID, rects)
+
+    def composePage(self, atlas, page, decoded, textureID, maxLevel):
+        """
+        Worker job: wait for the double images and build one atlas page.
+        """
+        images = [future.result()[2] for future in decoded]
+        with tracer.span("TextureLoader.composePage", {"page": page}):
+            pixels = atlas.compose(images, page)[0]
+        if (self.mipmaps is not None):
+            # The page keeps its size, the padding is laid out for it.
+            with tracer.span("TextureLoader.mipmaps", {"page": page}):
+                levels = self.mipmaps.build(pixels, levels=maxLevel + 1, clamp=False)
+            return (self.image.uploadMipmaps, (textureID, levels, maxLevel),
+                sum([level.nbytes for level in levels]))
+        return (self.image.uploadTexture,
+            (textureID, atlas.pageSize, atlas.pageSize, pixels, maxLevel), pixels.nbytes)
+
+    def loadSkyBox(self, filenames, index = 0):
+        """
+        The asynchronous form of CreateImage.createSkyBoxTex().  With
+        a manager a new ID is allocated in place of index.
+        """
+        if (self.manager is not None):
+            index = self.manager.allocate(1)[0]
+        self.placeholder(index, GL_TEXTURE_CUBE_MAP)
+        self.request(index, self.decodeSkyBox, filenames, index, pinned=True)
+        return index
+
+    def decodeSkyBox(self, filenames, index):
+        """
+        Worker job: load all six faces, which are uploaded together.
+        """
+        with tracer.span("TextureLoader.decode", {"file": filenames[0]}):
+            faces = list()
+            for i in range(6):
+                faces.append(self.image.skyBoxFace(filenames[i], i))
+        if ((self.mipmaps is not None) and (None not in faces)):
+            with tracer.span("TextureLoader.mipmaps", {"file": filenames[0]}):
+                faces = [self.mipmaps.chain(face) for face in faces]
+            nbytes = sum([level.nbytes for face in faces for level in face])
+        else:
+            nbytes = sum([face.nbytes for face in faces if (face is not None)])
+        return (self.image.uploadSkyBox, (index, faces), nbytes)
+
+    def pump(self):
+        """
+        Upload decoded textures until this frame's budget is spent.
+        At least one texture is uploaded per call if any is ready.
+        """
+        if (self.outstanding == 0):
+            return 0
+        start = perf_counter()
+        uploaded = 0
+        nbytes = 0
+        while ((uploaded == 0) or ((nbytes < self.budgetBytes) and
+            ((perf_counter() - start) * 1000.0 < self.budgetMs))):
+            try:
+                future = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.outstanding -= 1
+            try:
+                (upload, args, size) = future.result()
+            except Exception as error:
+                print("\n\tTexture load failed: ", error, ".")
+                continue
+            with tracer.span("TextureLoader.upload", {"bytes": size}):
+                upload(*args)
+            if (self.manager is not None):
+                generated = (self.mipmaps is None) and (upload != self.image.uploadMipmaps)
+                self.manager.uploaded(args[0], size, generated)
+            uploaded += 1
+            nbytes += size
+        if (uploaded > 0):
+            tracer.count("texturesPending", self.outstanding)
+        return uploaded
+
+    def finish(self):
+        """
+        Block until every texture is uploaded.
+        """
+        while (self.outstanding > 0):
+            future = self.ready.get()
+            self.ready.put(future)
+            self.pump()
+
+    def shutdown(self):
+        """
+        Stop the worker threads.
+        """
+        self.pool.shutdown(wait=False)
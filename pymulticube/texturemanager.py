@@ -0,0 +1,169 @@
+"""
+**********************************************************
+* TextureManager:  A class to keep the textures in video
+* memory within a budget.  Texture IDs are allocated with
+* glGenTextures, the size of every uploaded texture is
+* estimated, and when the total passes the budget the
+* textures least recently drawn are put back to their one
+* pixel placeholders.  An evicted texture is loaded again
+* through the TextureLoader as soon as it is drawn.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+from collections import OrderedDict
+from OpenGL.GL import *
+from pymulticube.tracer import tracer
+
+
+class TextureEntry:
+    """
+    TextureEntry:  The state of one managed texture.
+    """
+    def __init__(self, job, args, pinned):
+        """
+        Keep the decode job that loads the texture.
+        """
+        self.job = job
+        # The TextureLoader job that decodes the texture.
+        self.args = args
+        # The arguments for the job.
+        self.pinned = pinned
+        # True if the texture is never evicted.
+        self.nbytes = 0
+        # The estimated video memory used, zero when not resident.
+        self.loading = True
+        # True while a decode and upload are outstanding.
+        self.lastFrame = -1
+        # The frame the texture was last drawn on.
+
+
+class TextureManager:
+    """
+    TextureManager:  Call allocate() for texture IDs, track() for
+    each texture with the job that loads it, touch() every frame
+    with the textures drawn, and endFrame() to enforce the budget.
+    The TextureLoader reports each upload with uploaded().
+    """
+    budgetBytes = 512 * 1024 * 1024
+    # The video memory allowed for the textures, zero for no limit.
+    graceFrames = 60
+    # Textures drawn within this many frames are not evicted.
+    frame = 0
+    # The frame counter.
+    residentBytes = 0
+    # The estimated video memory in use.
+    evictions = 0
+    # The number of textures evicted.
+    reloads = 0
+    # The number of evicted textures loaded again.
+
+    def __init__(self, loader, budgetBytes = 512 * 1024 * 1024):
+        """
+        Take the TextureLoader used to load the textures again.
+        """
+        self.loader = loader
+        self.budgetBytes = budgetBytes
+        # Least recently drawn first.
+        self.entries = OrderedDict()
+        self.allocated = list()
+
+    def allocate(self, count):
+        """
+        Return a list of count new texture IDs.
+        """
+        if (count <= 0):
+            return list()
+        names = list()
+        while (len(names) < count):
+            generated = glGenTextures(count - len(names))
+            generated = [int(generated)] if (count - len(names) == 1) else [int(name) for name in generated]
+            # An evicted texture is deleted and made again under the same
+            # name, so the driver may hand that name out again.
+            names.extend([name for name in generated if (name not in self.allocated)])
+        self.allocated.extend(names)
+        return names
+
+    def track(self, textureID, job, args, pinned = False):
+        """
+        Manage a texture.  The job and its arguments are run on the
+        loader to load it, now by the caller and later on reloads.
+        Pinned textures count against the budget but stay loaded.
+        """
+        self.entries[textureID] = TextureEntry(job, args, pinned)
+
+    def uploaded(self, textureID, nbytes, generated = False):
+        """
+        Record a finished upload of nbytes of level data.  With
+        generated True the driver made the mipmaps, a third more.
+        """
+        entry = self.entries.get(textureID)
+        if (entry is None):
+            return
+        if (generated):
+            nbytes = nbytes * 4 // 3
+        self.residentBytes += nbytes - entry.nbytes
+        entry.nbytes = nbytes
+        entry.loading = False
+
+    def touch(self, textureIDs):
+        """
+        Mark textures as drawn this frame, loading again any that
+        were evicted.
+        """
+        for textureID in textureIDs:
+            entry = self.entries.get(textureID)
+            if (entry is None):
+                continue
+            entry.lastFrame = self.frame
+            self.entries.move_to_end(textureID)
+            if ((entry.nbytes == 0) and (not entry.loading)):
+                entry.loading = True
+                self.reloads += 1
+                self.loader.submit(entry.job, *entry.args)
+
+    def endFrame(self):
+        """
+        Evict the least recently drawn textures while over budget.
+        """
+        if ((self.budgetBytes > 0) and (self.residentBytes > self.budgetBytes)):
+            self.evict(self.residentBytes - self.budgetBytes)
+        tracer.count("textureBytes", self.residentBytes)
+        self.frame += 1
+
+    def evict(self, nbytes):
+        """
+        Free at least nbytes if possible, oldest textures first.
+        Textures drawn within graceFrames are kept.
+        """
+        freed = 0
+        oldest = self.frame - self.graceFrames
+        for (textureID, entry) in self.entries.items():
+            if (freed >= nbytes):
+                break
+            if (entry.lastFrame > oldest):
+                # The rest were drawn more recently still.
+                break
+            if ((entry.pinned) or (entry.nbytes == 0)):
+                continue
+            # Deleting frees every mipmap level, and the placeholder
+            # makes the texture again, so the ID stays valid.
+            glDeleteTextures([textureID])
+            self.loader.placeholder(textureID)
+            freed += entry.nbytes
+            self.residentBytes -= entry.nbytes
+            entry.nbytes = 0
+            self.evictions += 1
+        if (freed > 0):
+            tracer.count("textureEvictions", self.evictions)
+        return freed
+
+    def delete(self):
+        """
+        Delete every allocated texture.
+        """
+        if (len(self.allocated) > 0):
+            glDeleteTextures(self.allocated)
+        self.allocated = list()
+        self.entries.clear()
+        self.residentBytes = 0
@@ -0,0 +1,243 @@
+"""
+**********************************************************
+* TileRenderer:  A class and a command to render a saved
+* scene as one very large picture, larger than any window
+* or framebuffer.  The picture is cut into tiles and each
+* tile is drawn with its own off-axis frustum, the part of
+* the camera's view it covers, so the tiles meet without a
+* seam.  The tiles are shared among worker processes, each
+* with its own off screen OSMesa context, and every worker
+* writes its tiles straight into one memory mapped file of
+* the whole picture, which is saved when all are done.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from numpy import memmap, uint8, zeros
+from pymulticube.tracer import tracer
+
+worker = None
+# The TileRenderer of a worker process.
+
+
+def tiles(width, height, tile):
+    """
+    The (x, y, width, height) of every tile of a picture, x and y
+    from the picture's lower left, as OpenGL counts.
+    """
+    return [(x, y, min(tile, width - x), min(tile, height - y))
+        for y in range(0, height, tile) for x in range(0, width, tile)]
+
+
+def startWorker(snapshot, width, height, tile, rawfile):
+    """
+    Worker process initializer: make the context and load the
+    scene once for all the tiles the worker draws.
+    """
+    global worker
+    worker = TileRenderer(snapshot, width, height, tile, rawfile)
+
+
+def renderTile(x, y, tileWidth, tileHeight):
+    """
+    Worker process job: draw one tile into the picture file.
+    """
+    worker.render(x, y, tileWidth, tileHeight)
+    return (x, y)
+
+
+class TileRenderer:
+    """
+    TileRenderer:  Made in each worker process by startWorker(), it
+    draws a tile with render().  PYOPENGL_PLATFORM must be osmesa
+    before OpenGL is first imported in the process.
+    """
+    width = 0
+    # The width of the whole picture in pixels.
+    height = 0
+    # The height of the whole picture in pixels.
+    tile = 0
+    # The largest tile edge in pixels.
+    pixels = None
+    # The OSMesa color buffer, shape (tile, tile, 4), bottom row first.
+    picture = None
+    # The memory mapped picture, shape (height, width, 4), top row first.
+
+    def __init__(self, snapshot, width, height, tile, rawfile):
+        """
+        Make an off screen context of a tile's size, load the scene
+        saved in a snapshot file and upload its textures.
+        """
+        from OpenGL import osmesa
+        from OpenGL.GL import (GL_DEPTH_TEST, GL_TRUE, GL_UNSIGNED_BYTE, glDepthMask,
+            glDepthRange, glEnable)
+        from glm import vec3
+        from pymulticube.camera import Camera
+        from pymulticube.createimage import CreateImage
+        from pymulticube.cubemaker import CubeMaker
+        from pymulticube.renderqueue import RenderQueue
+        from pymulticube.snapshot import loadSnapshot
+        from pymulticube.textureloader import TextureLoader
+        from pymulticube.texturemanager import TextureManager
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        if (not self.context):
+            raise RuntimeError("Unable to make an OSMesa context.")
+        self.pixels = zeros((tile, tile, 4), uint8)
+        if (not osmesa.OSMesaMakeCurrent(self.context, self.pixels, GL_UNSIGNED_BYTE, tile, tile)):
+            raise RuntimeError("Unable to use an OSMesa context of " + str(tile) + " pixels.")
+        (self.cubes, view, extra) = loadSnapshot(snapshot)
+        self.camera = Camera(width, height, vec3(0.0, 0.0, 20.0), vec3(0.0, 0.0, 0.0))
+        if (view is not None):
+            self.camera.setState(view)
+        glEnable(GL_DEPTH_TEST)
+        glDepthMask(GL_TRUE)
+        self.maker = CubeMaker()
+        self.queue = RenderQueue(self.maker.createCube(True, False))
+        self.skyboxverts = self.maker.createCube(False, False) * 2000.0
+        # Every texture is loaded before the first tile, with no budget to unload them.
+        loader = TextureLoader(CreateImage())
+        loader.manager = TextureManager(loader, 0)
+        self.textureID = loader.loadDoubleImages(extra["boximages"], 0)
+        self.skyboxID = loader.loadSkyBox(extra["skyfiles"], max(self.textureID) + 1)
+        loader.finish()
+        loader.shutdown()
+        glDepthRange(0.1, 200.0)
+        self.picture = memmap(rawfile, dtype=uint8, mode="r+", shape=(height, width, 4))
+
+    def render(self, x, y, tileWidth, tileHeight):
+        """
+        Draw the tile with its lower left corner x, y pixels from the
+        picture's lower left and copy it into the picture.
+        """
+        from OpenGL.GL import (GL_COLOR_BUFFER_BIT, GL_CULL_FACE, GL_DEPTH_BUFFER_BIT, GL_FRONT,
+            GL_MODELVIEW, GL_PROJECTION, glClear, glClearColor, glCullFace, glDisable, glEnable,
+            glFinish, glLoadIdentity, glLoadMatrixf, glMatrixMode, glPopMatrix, glPushMatrix,
+            glRotatef, glTranslate, glViewport)
+        from glm import value_ptr
+        with tracer.span("TileRenderer.render", {"x": x, "y": y}):
+            glViewport(0, 0, tileWidth, tileHeight)
+            glClearColor(0.0, 0.0, 0.0, 1.0)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            glMatrixMode(GL_PROJECTION)
+            frustum = self.maker.createFrustum(*self.camera.tileBounds(x, y, tileWidth, tileHeight,
+                self.width, self.height))
+            # GLM keeps its matrices by column, as OpenGL wants them.
+            glLoadMatrixf(value_ptr(frustum))
+            glMatrixMode(GL_MODELVIEW)
+            glLoadIdentity()
+            self.camera.setGluViewMatrix()
+            position = self.camera.getPosition()
+            (pitch, yaw) = self.camera.getPitchYaw()
+            front = self.camera.Front
+            # The same view of the cubes and the sky box as MultiCube.drawFrame().
+            glPushMatrix()
+            glEnable(GL_CULL_FACE)
+            glCullFace(GL_FRONT)
+            glLoadIdentity()
+            glRotatef(yaw, 0.0, 1.0, 0.0)
+            glRotatef(-pitch, 1.0, 0.0, 0.0)
+            glTranslate(-position.x, -position.y, -position.z)
+            self.queue.draw(self.cubes, self.textureID, (position.x, position.y, position.z),
+                (front.x, front.y, front.z))
+            glDisable(GL_CULL_FACE)
+            glPopMatrix()
+            self.drawSkyBox()
+            glFinish()
+            # OSMesa's rows are bottom up and the picture's top down.
+            top = self.height - y - tileHeight
+            self.picture[top:top + tileHeight, x:x + tileWidth] = self.pixels[tileHeight - 1::-1, :tileWidth]
+            self.picture.flush()
+
+    def drawSkyBox(self):
+        """
+        Draw the sky box behind the cubes.
+        """
+        from OpenGL.GL import (GL_FALSE, GL_LEQUAL, GL_LESS, GL_TEXTURE_CUBE_MAP,
+            GL_TRIANGLES, GL_TRUE, glBegin, glBindTexture, glDepthFunc, glDepthMask, glDisable,
+            glEnable, glEnd, glTexCoord3f, glVertex3f)
+        glDepthFunc(GL_LEQUAL)
+        glDepthMask(GL_FALSE)
+        glBindTexture(GL_TEXTURE_CUBE_MAP, self.skyboxID)
+        glEnable(GL_TEXTURE_CUBE_MAP)
+        glBegin(GL_TRIANGLES)
+        for z in range(36):
+            glTexCoord3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
+            glVertex3f(self.skyboxverts[z][0], self.skyboxverts[z][1], self.skyboxverts[z][2])
+        glEnd()
+        glDisable(GL_TEXTURE_CUBE_MAP)
+        glDepthMask(GL_TRUE)
+        glDepthFunc(GL_LESS)
+
+
+def renderPicture(snapshot, output, width, height, tile = 2048, workers = None):
+    """
+    Render the scene in a snapshot file as a width by height
+    picture, saved to output in a format PIL knows by its name.
+    Returns True if every tile was drawn.
+    """
+    from PIL import Image
+    workers = workers or os.cpu_count() or 1
+    rawfile = output + ".raw"
+    # Set before the workers start, so each one's OpenGL draws off screen on one thread.
+    os.environ.setdefault("PYOPENGL_PLATFORM", "osmesa")
+    os.environ.setdefault("LP_NUM_THREADS", "1")
+    jobs = tiles(width, height, tile)
+    print("\n\tRendering", width, "x", height, "pixels in", len(jobs), "tiles on", workers, "processes.")
+    drawn = 0
+    # The picture file is as large as the picture, it is removed however the render ends.
+    try:
+        picture = memmap(rawfile, dtype=uint8, mode="w+", shape=(height, width, 4))
+        del picture
+        try:
+            with ProcessPoolExecutor(workers, get_context("spawn"), startWorker,
+                    (snapshot, width, height, tile, rawfile)) as pool:
+                for future in as_completed([pool.submit(renderTile, *job) for job in jobs]):
+                    future.result()
+                    drawn += 1
+                    print("\n\tTile", drawn, "of", len(jobs), "done.")
+        except (BrokenProcessPool, RuntimeError, OSError, ValueError, KeyError) as error:
+            print("\n\tUnable to render the tiles: ", error, ".")
+            return False
+        with tracer.span("renderPicture.save", {"file": output}):
+            picture = memmap(rawfile, dtype=uint8, mode="r", shape=(height, width, 4))
+            Image.frombuffer("RGBA", (width, height), picture, "raw", "RGBA", 0, 1).save(output)
+            del picture
+    finally:
+        if (os.path.exists(rawfile)):
+            os.remove(rawfile)
+    print("\n\tSaved ", output, ".")
+    return True
+
+
+def main():
+    """
+    Render a snapshot saved with the p key as a large picture.
+    """
+    parser = ArgumentParser(prog="python3 -m pymulticube.tiledrender",
+        description="Render a scene snapshot as one large picture, in tiles on several processes.")
+    parser.add_argument("snapshot", help="the snapshot file, saved with the p key")
+    parser.add_argument("output", help="the picture file to write, as poster.png")
+    parser.add_argument("--width", type=int, default=16384, metavar="PIXELS",
+        help="the picture width (default 16384)")
+    parser.add_argument("--height", type=int, default=9216, metavar="PIXELS",
+        help="the picture height (default 9216)")
+    parser.add_argument("--tile", type=int, default=2048, metavar="PIXELS",
+        help="the largest tile edge, within the OSMesa size limit (default 2048)")
+    parser.add_argument("--workers", type=int, metavar="COUNT",
+        help="the worker processes (default one per core)")
+    options = parser.parse_args()
+    return 0 if (renderPicture(options.snapshot, options.output, options.width, options.height,
+        options.tile, options.workers)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
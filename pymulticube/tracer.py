@@ -0,0 +1,266 @@
+"""
+**********************************************************
+* Tracer:  A class to instrument the program with named
+* spans, counters and event hooks.  With no subscriber
+* attached every call is bound to a no-op, so the hooks
+* can stay in the render loop at no real cost.  The
+* ChromeTraceWriter subscriber saves the results in the
+* Chrome trace-format JSON used by chrome://tracing and
+* Perfetto.
+* Created by: Edward Charles Eberle <eberdeed@eberdeed.net>
+* May 2020 San Diego, California USA
+* ********************************************************
+"""
+import json
+import threading
+from time import perf_counter
+
+
+class NullSpan:
+    """
+    The span handed out when nobody is listening.  It does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        return False
+
+
+class Span:
+    """
+    A timed span reported to the tracer subscribers on exit.
+    """
+    def __init__(self, tracer, name, args):
+        """
+        Record the owner, the span name and the optional arguments.
+        """
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        self.tracer.publish("onSpan", self.name, self.start,
+            perf_counter() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    """
+    Tracer:  The hub for spans, counters and events.  The
+    methods span(), count() and event() are rebound whenever
+    the subscriber list changes, so that with no subscribers
+    they are plain no-op calls.  Event and span arguments may
+    be given as a callable returning a dictionary, which is
+    only evaluated when there is a subscriber to receive it.
+    """
+    enabled = False
+    # True while at least one subscriber is attached.
+    subscribers = None
+    # The list of subscriber objects.
+    nullSpan = NullSpan()
+    # The shared do-nothing span.
+
+    def __init__(self):
+        """
+        Start with no subscribers and the no-op hooks in place.
+        """
+        self.subscribers = list()
+        self.lock = threading.Lock()
+        self.bindHooks()
+
+    def subscribe(self, subscriber):
+        """
+        Attach a subscriber.  A subscriber may define any of
+        onSpan(name, start, duration, args),
+        onCounter(name, value, timestamp) and
+        onEvent(name, timestamp, args).  Times are in seconds
+        from time.perf_counter().
+        """
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.bindHooks()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Detach a subscriber.  The hooks go back to no-ops
+        once the last one is removed.
+        """
+        with self.lock:
+            if (subscriber in self.subscribers):
+                self.subscribers.remove(subscriber)
+            self.bindHooks()
+
+    def bindHooks(self):
+        """
+        Point the hook methods at the live or the no-op implementations.
+        """
+        self.enabled = len(self.subscribers) > 0
+        if (self.enabled):
+            self.span = self.liveSpan
+            self.count = self.liveCount
+            self.event = self.liveEvent
+        else:
+            self.span = self.noSpan
+            self.count = self.noCount
+            self.event = self.noEvent
+
+    def publish(self, method, *args):
+        """
+        Hand a record to every subscriber that handles it.
+        """
+        for subscriber in tuple(self.subscribers):
+            handler = getattr(subscriber, method, None)
+            if (handler is not None):
+                handler(*args)
+
+    def liveSpan(self, name, args = None):
+        """
+        Return a timed span for use in a with statement.
+        """
+        return Span(self, name, args)
+
+    def liveCount(self, name, value = 1):
+        """
+        Report the current value of a named counter.
+        """
+        self.publish("onCounter", name, value, perf_counter())
+
+    def liveEvent(self, name, args = None):
+        """
+        Report an instantaneous event.
+        """
+        self.publish("onEvent", name, perf_counter(), args)
+
+    def noSpan(self, name, args = None):
+        return self.nullSpan
+
+    def noCount(self, name, value = 1):
+        return
+
+    def noEvent(self, name, args = None):
+        return
+
+
+def resolveArgs(args):
+    """
+    Evaluate lazily supplied span or event arguments.
+    """
+    if (callable(args)):
+        return args()
+    return args
+
+
+class ChromeTraceWriter:
+    """
+    ChromeTraceWriter:  A subscriber that collects the trace
+    records in memory and saves them as Chrome trace-format JSON.
+    """
+    def __init__(self, filename = None):
+        """
+        Set the optional output file name used by save().
+        """
+        self.filename = filename
+        self.records = list()
+        self.lock = threading.Lock()
+        self.epoch = perf_counter()
+
+    def timestamp(self, seconds):
+        """
+        Chrome traces count microseconds.
+        """
+        return (seconds - self.epoch) * 1000000.0
+
+    def append(self, record):
+        record["pid"] = 1
+        record["tid"] = threading.get_ident()
+        with self.lock:
+            self.records.append(record)
+
+    def onSpan(self, name, start, duration, args):
+        record = {"name": name, "ph": "X", "ts": self.timestamp(start),
+            "dur": duration * 1000000.0}
+        args = resolveArgs(args)
+        if (args):
+            record["args"] = args
+        self.append(record)
+
+    def onCounter(self, name, value, timestamp):
+        self.append({"name": name, "ph": "C", "ts": self.timestamp(timestamp),
+            "args": {name: value}})
+
+    def onEvent(self, name, timestamp, args):
+        record = {"name": name, "ph": "i", "s": "t", "ts": self.timestamp(timestamp)}
+        args = resolveArgs(args)
+        if (args):
+            record["args"] = args
+        self.append(record)
+
+    def save(self, filename = None):
+        """
+        Write the collected records to a JSON file.
+        """
+        if (filename is None):
+            filename = self.filename
+        with self.lock:
+            records = list(self.records)
+        with open(filename, "w") as outfile:
+            json.dump({"traceEvents": records, "displayTimeUnit": "ms"},
+                outfile, default=str)
+        print("\n\tSaved", len(records), "trace records to", filename, ".")
+
+
+class ConsoleSubscriber:
+    """
+    ConsoleSubscriber:  A subscriber that prints events and
+    counters on the console, in place of the old debug flags.
+    """
+    def onEvent(self, name, timestamp, args):
+        print("\n\t", name, ": ", resolveArgs(args))
+
+    def onCounter(self, name, value, timestamp):
+        print("\n\t", name, ": ", value)
+
+
+class StartupProfile:
+    """
+    StartupProfile:  A subscriber that keeps the spans named
+    startup.* and prints each phase, with the thread it ran on,
+    when report() is called at the first frame.  Times are from
+    the epoch given, the moment the program started.
+    """
+    def __init__(self, epoch = None):
+        """
+        Set the start time, now if none is given.
+        """
+        self.epoch = perf_counter() if (epoch is None) else epoch
+        self.phases = list()
+        self.lock = threading.Lock()
+
+    def onSpan(self, name, start, duration, args):
+        if (name.startswith("startup.")):
+            with self.lock:
+                self.phases.append((start - self.epoch, duration, name[8:],
+                    threading.current_thread().name))
+
+    def report(self):
+        """
+        Print the phases in the order they started and the total time.
+        """
+        with self.lock:
+            phases = sorted(self.phases)
+        print("\n\tStartup profile in milliseconds:")
+        print("\n\t%-12s %9s %9s  %s" % ("phase", "start", "time", "thread"))
+        for (start, duration, name, thread) in phases:
+            print("\t%-12s %9.1f %9.1f  %s" % (name, start * 1000.0, duration * 1000.0, thread))
+        print("\n\tFirst frame after %.1f ms." % ((perf_counter() - self.epoch) * 1000.0))
+
+
+tracer = Tracer()
+# The shared tracer for the program.